@@ -1,6 +1,6 @@
 import streamlit as st
 
-from modules.utils import init_prompts
+from modules.utils import get_metrics_server, init_prompts
 from variables import PROMPT_DEFAULT_PATH, PROMPT_USER_PATH, VERSION
 
 
@@ -11,6 +11,10 @@ st.set_page_config(
 )
 
 init_prompts(PROMPT_USER_PATH, PROMPT_DEFAULT_PATH)
+try:
+    get_metrics_server()
+except OSError as e:
+    st.warning(f"Metrics exporter not started: {e}")
 
 #########
 # STYLE #
@@ -31,7 +35,8 @@ pg = st.navigation(
         st.Page("pages_/home.py", title="Comparator", icon=":material/compare_arrows:"),
         st.Page("pages_/models.py", title="Models", icon=":material/network_node:"),
         st.Page("pages_/prompts.py", title="Prompts", icon=":material/article:"),
-        st.Page("pages_/viewer.py", title="Viewer", icon=":material/visibility:")
+        st.Page("pages_/viewer.py", title="Viewer", icon=":material/visibility:"),
+        st.Page("pages_/history.py", title="History", icon=":material/history:")
     ]
 )
 pg.run()
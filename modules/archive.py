@@ -0,0 +1,369 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import zipfile
+from contextlib import nullcontext
+from typing import Iterable, Iterator
+
+from modules.cache import image_hash
+
+ARCHIVE_FORMAT = "vision-comparator-archive"
+ARCHIVE_VERSION = 1
+
+
+def compact_record(record: dict) -> tuple[dict, str, bytes | None]:
+    """
+    Split a record into its results and its image.
+
+    Returns:
+        tuple: The record without 'image_data' but with 'image_sha256', the
+            SHA-256 of the image and the image bytes (None if the record has no image).
+    """
+    record = dict(record)
+    image_data = record.pop("image_data", None)
+    image = base64.b64decode(image_data) if image_data else None
+    if image is not None:
+        record["image_sha256"] = image_hash(image)
+    return record, record.get("image_sha256"), image
+
+def expand_record(record: dict, image: bytes | None) -> dict:
+    """Rebuild the JSON written by the "Download JSON" button."""
+    record = dict(record)
+    if image is not None:
+        record["image_data"] = base64.b64encode(image).decode("utf-8")
+    return record
+
+def index_entry(record_id: int, record: dict) -> dict:
+    """
+    Index line of a record: its date, image, models and prompts, and in
+    'results' every slot without its response, enough for stats.results_frame().
+    """
+    return {
+        "id": record_id,
+        "date": record.get("date"),
+        "image_name": record.get("image_name"),
+        "image_sha256": record.get("image_sha256"),
+        "mode": record.get("mode"),
+        "models": [model['name'] for model in record.get("models", [])],
+        "prompts": [prompt['prompt'] for prompt in record["models"][0]["prompts"]] if record.get("models") else [],
+        "results": [
+            {"name": model['name'], "prompts": [{key: value for key, value in slot.items() if key != "response"}
+                                                for slot in model['prompts']]}
+            for model in record.get("models", [])
+        ],
+    }
+
+def entry_summary(entry: dict) -> dict:
+    """Record of an index entry, without its responses nor its image."""
+    return {
+        "date": entry["date"],
+        "image_name": entry["image_name"],
+        "image_sha256": entry["image_sha256"],
+        "mode": entry.get("mode"),
+        "models": entry["results"],
+    }
+
+
+class ArchiveWriter:
+    """
+    Write records to a compact archive.
+
+    The archive is a zip file holding each image once, named by its SHA-256,
+    each record without its image as a small JSON member, and an index of the
+    records. Opening an existing archive appends to it.
+
+        images/<sha256>
+        results/<id>.json
+        index/<first id>.jsonl
+
+    Args:
+        path (str | file): Zip file to write.
+    """
+
+    def __init__(self, path):
+        mode = "a" if isinstance(path, str) and os.path.exists(path) else "w"
+        self.zip = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED)
+        names = set(self.zip.namelist())
+        self.images = {name.split("/", 1)[1] for name in names if name.startswith("images/")}
+        self.next_id = len([name for name in names if name.startswith("results/")])
+        self.first_id = self.next_id
+        self.entries = []
+        if "manifest.json" not in names:
+            self.zip.writestr("manifest.json", json.dumps({"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION}))
+
+    def add(self, record: dict) -> int:
+        """Add a record as written by the "Download JSON" button, returns its id."""
+        record, sha256, image = compact_record(record)
+        if image is not None and sha256 not in self.images:
+            # Images are already compressed.
+            self.zip.writestr(f"images/{sha256}", image, compress_type=zipfile.ZIP_STORED)
+            self.images.add(sha256)
+
+        record_id = self.next_id
+        self.zip.writestr(f"results/{record_id:06d}.json", json.dumps(record))
+        self.entries.append(index_entry(record_id, record))
+        self.next_id += 1
+        return record_id
+
+    def close(self) -> None:
+        if self.entries:
+            self.zip.writestr(f"index/{self.first_id:06d}.jsonl", "".join(json.dumps(entry) + "\n" for entry in self.entries))
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ArchiveReader:
+    """
+    Read a compact archive lazily.
+
+    Only the index is read when the archive is opened, records and images are
+    read when they are requested.
+
+    Args:
+        path (str | file): Zip file to read.
+    """
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path, "r")
+        names = self.zip.namelist()
+        entries = {}
+        for name in sorted(name for name in names if name.startswith("index/")):
+            for line in self.zip.read(name).decode("utf-8").splitlines():
+                entry = json.loads(line)
+                entries[entry['id']] = entry
+        # Records written by an interrupted writer have no index entry, the
+        # entries of older archives have no results.
+        for name in names:
+            if name.startswith("results/"):
+                record_id = int(name[len("results/"):-len(".json")])
+                if "results" not in entries.get(record_id, {}):
+                    entries[record_id] = index_entry(record_id, json.loads(self.zip.read(name)))
+        self.entries = [entries[record_id] for record_id in sorted(entries)]
+
+    def index(self) -> list[dict]:
+        """Date, image, models, prompts and results without responses of each record, see index_entry()."""
+        return self.entries
+
+    def record(self, record_id: int) -> dict:
+        """A record without its image, see image()."""
+        return json.loads(self.zip.read(f"results/{record_id:06d}.json"))
+
+    def image(self, sha256: str) -> bytes | None:
+        try:
+            return self.zip.read(f"images/{sha256}")
+        except KeyError:
+            return None
+
+    def records(self) -> Iterator[dict]:
+        for entry in self.entries:
+            yield self.record(entry['id'])
+
+    def close(self) -> None:
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def json_spans(data: bytes) -> Iterator[tuple[int, int, object]]:
+    """
+    (offset, length, value) of the record of a JSON file, or of each record
+    when the file holds a list of records (a JSON export of several records).
+    Offsets and lengths are in bytes.
+    """
+    text = data.decode("utf-8")
+    start = len(text) - len(text.lstrip())
+    if not text.startswith("[", start):
+        yield 0, len(data), json.loads(text)
+        return
+    decoder = json.JSONDecoder()
+    index = start + 1
+    offset = len(text[:index].encode("utf-8"))
+    while True:
+        skipped = index
+        while index < len(text) and text[index] in " \t\r\n,":
+            index += 1
+        if index >= len(text) or text[index] == "]":
+            return
+        offset += index - skipped
+        value, end = decoder.raw_decode(text, index)
+        length = len(text[index:end].encode("utf-8"))
+        yield offset, length, value
+        offset, index = offset + length, end
+
+
+class JsonReader:
+    """
+    Read a JSON or JSONL results file with the interface of ArchiveReader,
+    a JSON file can hold one record or a list of records.
+
+    The file is read once to build the index and the offset of each record,
+    then records and images are parsed again from the file when they are requested.
+
+    Args:
+        path (str | file): File to read, a binary file object must have a 'name'.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb") if isinstance(path, str) else path
+        self.lock = threading.Lock()
+        self.spans = []
+        self.entries = []
+        self.images = {}
+        name = path if isinstance(path, str) else getattr(path, "name", "")
+        self.file.seek(0)
+        if name.endswith(".jsonl"):
+            offset = 0
+            for line in self.file:
+                if line.strip():
+                    self.add(offset, len(line), json.loads(line))
+                offset += len(line)
+        else:
+            for offset, length, record in json_spans(self.file.read()):
+                self.add(offset, length, record)
+
+    def add(self, offset: int, length: int, record: dict) -> None:
+        if not isinstance(record, dict) or "models" not in record:
+            raise ValueError("not a result file")
+        record, sha256, image = compact_record(record)
+        record_id = len(self.entries)
+        if image is not None:
+            self.images.setdefault(sha256, record_id)
+        self.spans.append((offset, length))
+        self.entries.append(index_entry(record_id, record))
+
+    def read(self, record_id: int) -> dict:
+        offset, length = self.spans[record_id]
+        with self.lock:
+            self.file.seek(offset)
+            return json.loads(self.file.read(length))
+
+    def index(self) -> list[dict]:
+        return self.entries
+
+    def record(self, record_id: int) -> dict:
+        return compact_record(self.read(record_id))[0]
+
+    def image(self, sha256: str) -> bytes | None:
+        if sha256 not in self.images:
+            return None
+        return compact_record(self.read(self.images[sha256]))[2]
+
+    def records(self) -> Iterator[dict]:
+        for entry in self.entries:
+            yield self.record(entry['id'])
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+def is_archive(path) -> bool:
+    return zipfile.is_zipfile(path)
+
+def open_results(path) -> ArchiveReader | JsonReader:
+    """Reader of a compact archive, a JSON or a JSONL file."""
+    return ArchiveReader(path) if is_archive(path) else JsonReader(path)
+
+def read_records(path, images: bool = True) -> Iterator[dict]:
+    """
+    Records of a JSON file (one record or a list), a JSONL file or a compact archive.
+
+    JSONL files and archives are read one record at a time.
+
+    Args:
+        path (str | file): File to read, a binary file object must have a 'name'.
+        images (bool): Include the image data, records only have their
+            'image_sha256' otherwise.
+    """
+    if is_archive(path):
+        with ArchiveReader(path) as reader:
+            for record in reader.records():
+                yield expand_record(record, reader.image(record.get("image_sha256")) if images else None)
+        return
+
+    name = path if isinstance(path, str) else getattr(path, "name", "")
+    with (open(path, "rb") if isinstance(path, str) else nullcontext(path)) as f:
+        f.seek(0)
+        if name.endswith(".jsonl"):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            data = json.load(f)
+            records = data if isinstance(data, list) else [data]
+        for record in records:
+            yield record if images else compact_record(record)[0]
+
+def read_compact(path, seen: set = None) -> Iterator[tuple[dict, bytes | None]]:
+    """
+    Records without their image, with the image bytes the first time an image is seen.
+
+    Images of an archive are only read once, so a file with many results of
+    the same image is read quickly.
+
+    Args:
+        path (str | file): JSON, JSONL or archive file, see read_records().
+        seen (set): SHA-256 of the images already read, updated with the new ones.
+    """
+    seen = set() if seen is None else seen
+    if is_archive(path):
+        with ArchiveReader(path) as reader:
+            for record in reader.records():
+                sha256 = record.get("image_sha256")
+                image = None
+                if sha256 is not None and sha256 not in seen:
+                    image = reader.image(sha256)
+                    seen.add(sha256)
+                yield record, image
+        return
+
+    for record in read_records(path):
+        record, sha256, image = compact_record(record)
+        if sha256 in seen:
+            image = None
+        elif sha256 is not None:
+            seen.add(sha256)
+        yield record, image
+
+def write_archive(path, records: Iterable[dict]) -> int:
+    count = 0
+    with ArchiveWriter(path) as writer:
+        for record in records:
+            writer.add(record)
+            count += 1
+    return count
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.archive",
+        description="Pack JSON, JSONL results and archives into a compact archive, each image is stored once."
+    )
+    parser.add_argument("output", help="Archive to write (zip), appended to if it exists")
+    parser.add_argument("inputs", nargs="+", help="JSON, JSONL or archive files")
+    args = parser.parse_args(argv)
+
+    def records() -> Iterator[dict]:
+        for path in args.inputs:
+            yield from read_records(path)
+
+    count = write_archive(args.output, records())
+    print(f"{count} record(s) written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import argparse
+import datetime
+import difflib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import ollama
+
+from modules.engine import build_options, load_prompts, new_slot, run_prompt, run_turn
+from modules.preprocess import prepare_image
+from variables import PROMPT_USER_PATH
+
+PERCENTILES = (50, 90, 99)
+METRICS = ("total_duration", "load_duration", "prompt_eval_duration", "tokens_per_second", "ttft", "itl_p90")
+MODES = ("generate", "session")
+
+
+def sample_metrics(done: dict) -> dict:
+    """Durations in seconds and speed of one generation."""
+    return {
+        "total_duration": done['total_duration'] / 10**9,
+        "load_duration": done['load_duration'] / 10**9,
+        "prompt_eval_duration": done['prompt_eval_duration'] / 10**9,
+        "tokens_per_second": done['eval_count'] / done['eval_duration'] * 10**9 if done['eval_duration'] else 0.0,
+        "ttft": done['ttft'] / 10**9 if done.get('ttft') is not None else None,
+        "itl_p90": done['itl_p90'] / 10**9 if done.get('itl_p90') is not None else None,
+    }
+
+def summarize(values: list[float]) -> dict:
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return {}
+    summary = {
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = float(value)
+    return summary
+
+def unload(model: str, client: ollama.Client) -> str | None:
+    """Unload a model, returns the error instead of raising it (unknown model, server down)."""
+    try:
+        client.generate(model=model, keep_alive=0)
+    except (ollama.ResponseError, ConnectionError) as e:
+        return str(e)
+    return None
+
+def benchmark(image: str, models: list[str], prompts: list[dict], options: dict, warmup: int = 1,
+              repetitions: int = 5, cold: bool = False, client: ollama.Client = None,
+              progress=None) -> list[dict]:
+    """
+    Run each model / prompt pair `warmup` times unmeasured, then `repetitions` times measured.
+
+    Args:
+        image (str): Base64 image sent with every request.
+        cold (bool): Unload the model before each measured repetition to measure cold loads.
+        progress (Callable): Called with (model, prompt name, repetition) after each measured run.
+
+    Returns:
+        list[dict]: One entry per model and prompt with its raw samples,
+            its number of errors and the summary of each metric.
+    """
+    client = client or ollama
+    results = []
+    for model in models:
+        for prompt in prompts:
+            for _ in range(warmup):
+                run_prompt(new_slot(prompt['name']), model, prompt, image, options, client=client)
+
+            samples, errors = [], []
+            for repetition in range(repetitions):
+                error = unload(model, client) if cold else None
+                if error is not None:
+                    # Not a cold load, the repetition is counted as failed.
+                    errors.append(error)
+                    if progress is not None:
+                        progress(model, prompt['name'], repetition)
+                    continue
+                slot = run_prompt(new_slot(prompt['name']), model, prompt, image, options, client=client)
+                if slot.get("error") is not None or not slot["done"]:
+                    errors.append(slot.get("error"))
+                else:
+                    samples.append(sample_metrics(slot["done"]))
+                if progress is not None:
+                    progress(model, prompt['name'], repetition)
+
+            results.append({
+                "model": model,
+                "prompt": prompt['name'],
+                "samples": samples,
+                "errors": errors,
+                "metrics": {metric: summarize([sample[metric] for sample in samples if sample[metric] is not None])
+                            for metric in METRICS},
+            })
+        error = unload(model, client)
+        if error is not None and results:
+            results[-1]["errors"].append(error)
+    return results
+
+def run_pass(mode: str, model: str, prompts: list[dict], image: str, options: dict,
+             client: ollama.Client) -> tuple[list[dict], float]:
+    """Every prompt once in one mode, returns the slots and the wall time in seconds."""
+    start = time.perf_counter()
+    messages = []
+    slots = []
+    for prompt in prompts:
+        slot = new_slot(prompt['name'])
+        if mode == "session":
+            run_turn(slot, model, prompt, image, options, messages, client=client)
+        else:
+            run_prompt(slot, model, prompt, image, options, client=client)
+        slots.append(slot)
+    return slots, time.perf_counter() - start
+
+def compare_modes(image: str, models: list[str], prompts: list[dict], options: dict, warmup: int = 1,
+                  repetitions: int = 5, client: ollama.Client = None, progress=None) -> list[dict]:
+    """
+    Run the prompts of each model in generate mode (the image with every
+    prompt) and in session mode (the image once, the prompts as chat turns).
+
+    Each repetition runs both modes, in alternating order so neither always
+    runs first. The responses of the two modes are compared for each prompt
+    (difflib ratio, 1.0 for the same text).
+
+    Args:
+        progress (Callable): Called with (model, mode, repetition) after each pass.
+
+    Returns:
+        list[dict]: One entry per model with the wall time of each pass by
+            mode, the error of its unload if any, and for each prompt the
+            samples, errors and metrics by mode and the similarity of the responses.
+    """
+    client = client or ollama
+    results = []
+    for model in models:
+        for _ in range(warmup):
+            run_pass("generate", model, prompts[:1], image, options, client)
+
+        passes = {mode: [] for mode in MODES}
+        slots = {mode: [] for mode in MODES}
+        for repetition in range(repetitions):
+            for mode in (MODES if repetition % 2 == 0 else MODES[::-1]):
+                pass_slots, seconds = run_pass(mode, model, prompts, image, options, client)
+                passes[mode].append(seconds)
+                slots[mode].append(pass_slots)
+                if progress is not None:
+                    progress(model, mode, repetition)
+
+        entries = []
+        for j, prompt in enumerate(prompts):
+            modes = {}
+            for mode in MODES:
+                cells = [pass_slots[j] for pass_slots in slots[mode]]
+                samples = [sample_metrics(slot["done"]) for slot in cells if slot.get("error") is None and slot["done"]]
+                modes[mode] = {
+                    "samples": samples,
+                    "errors": [slot.get("error") for slot in cells if slot.get("error") is not None or not slot["done"]],
+                    "metrics": {metric: summarize([sample[metric] for sample in samples if sample[metric] is not None])
+                                for metric in METRICS},
+                }
+            pairs = [(generated[j]["response"], session[j]["response"])
+                     for generated, session in zip(slots["generate"], slots["session"])
+                     if generated[j]["response"] is not None and session[j]["response"] is not None]
+            entries.append({
+                "prompt": prompt['name'],
+                "modes": modes,
+                "similarity": summarize([difflib.SequenceMatcher(None, a, b).ratio() for a, b in pairs]),
+                "identical": sum(1 for a, b in pairs if a == b),
+            })
+
+        error = unload(model, client)
+        results.append({
+            "model": model,
+            "passes": {mode: summarize(passes[mode]) for mode in MODES},
+            "prompts": entries,
+            "errors": [error] if error is not None else [],
+        })
+    return results
+
+def format_table(results: list[dict]) -> str:
+    lines = [f"{'model':<24} {'prompt':<16} {'n':>3} {'err':>3} {'total p50/p90/p99 (s)':>24} {'load p50 (s)':>12} {'tokens/s p50/p90/p99':>24}"]
+    for result in results:
+        total = result['metrics']['total_duration']
+        load = result['metrics']['load_duration']
+        speed = result['metrics']['tokens_per_second']
+        if not total:
+            lines.append(f"{result['model']:<24} {result['prompt']:<16} {0:>3} {len(result['errors']):>3}")
+            continue
+        lines.append(
+            f"{result['model']:<24} {result['prompt']:<16} {len(result['samples']):>3} {len(result['errors']):>3} "
+            f"{total['p50']:>8.2f}/{total['p90']:.2f}/{total['p99']:.2f} {load['p50']:>12.2f} "
+            f"{speed['p50']:>8.1f}/{speed['p90']:.1f}/{speed['p99']:.1f}"
+        )
+    return "\n".join(lines)
+
+def format_modes(results: list[dict]) -> str:
+    lines = [f"{'model':<24} {'prompt':<16} {'generate p50 (s)':>16} {'session p50 (s)':>16} {'prompt eval g/s (s)':>20} {'similarity':>10}"]
+    for result in results:
+        passes = result['passes']
+        if passes['generate'] and passes['session']:
+            lines.append(f"{result['model']:<24} {'(all prompts)':<16} {passes['generate']['p50']:>16.2f} {passes['session']['p50']:>16.2f}")
+        for entry in result['prompts']:
+            totals = [entry['modes'][mode]['metrics']['total_duration'] for mode in MODES]
+            evals = [entry['modes'][mode]['metrics']['prompt_eval_duration'] for mode in MODES]
+            if not all(totals):
+                lines.append(f"{result['model']:<24} {entry['prompt']:<16} {'errors':>16}")
+                continue
+            similarity = f"{entry['similarity']['mean']:.2f}" if entry['similarity'] else "-"
+            lines.append(
+                f"{result['model']:<24} {entry['prompt']:<16} {totals[0]['p50']:>16.2f} {totals[1]['p50']:>16.2f} "
+                f"{evals[0]['p50']:>9.2f}/{evals[1]['p50']:.2f} {similarity:>10}"
+            )
+    return "\n".join(lines)
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.benchmark",
+        description="Benchmark models with warm-up runs and repetitions, report percentiles as JSON."
+    )
+    parser.add_argument("image", help="Image sent with every request")
+    parser.add_argument("-m", "--models", nargs="+", required=True, help="Models to benchmark")
+    parser.add_argument("-p", "--prompts", nargs="+", required=True, help="Names of the prompts to use")
+    parser.add_argument("-o", "--output", default=None, help="JSON report (default: standard output)")
+    parser.add_argument("-w", "--warmup", type=int, default=1, help="Unmeasured runs per model and prompt (default: 1)")
+    parser.add_argument("-n", "--repetitions", type=int, default=5, help="Measured runs per model and prompt (default: 5)")
+    parser.add_argument("--cold", action="store_true", help="Unload the model before each measured run")
+    parser.add_argument("--compare-modes", action="store_true",
+                        help="Run the prompts of each model in generate and session mode and compare time and responses")
+    parser.add_argument("--prompts-file", default=PROMPT_USER_PATH, help="Prompts file (default: prompts_user.json)")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-side", type=int, default=0, help="Downscale the image to this longest side in pixels")
+    parser.add_argument("--host", default=None, help="Ollama host (default: OLLAMA_HOST or localhost)")
+    args = parser.parse_args(argv)
+
+    prompts_index = load_prompts(args.prompts_file)
+    missing = [name for name in args.prompts if name not in prompts_index]
+    if missing:
+        print(f"Unknown prompt(s): {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    with open(args.image, "rb") as f:
+        prepared = prepare_image(f.read(), args.max_side)
+    options = build_options(args.temperature, args.seed)
+
+    def progress(model: str, prompt: str, repetition: int) -> None:
+        print(f"{model} / {prompt}: {repetition + 1}/{args.repetitions}", file=sys.stderr)
+
+    prompts = [prompts_index[name] for name in args.prompts]
+    client = ollama.Client(host=args.host)
+    report = {
+        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "host": args.host or os.environ.get("OLLAMA_HOST"),
+        "image_name": os.path.basename(args.image),
+        "image": prepared.settings,
+        "options": options,
+        "warmup": args.warmup,
+        "repetitions": args.repetitions,
+    }
+    if args.compare_modes:
+        results = compare_modes(prepared.data, args.models, prompts, options, warmup=args.warmup,
+                                repetitions=args.repetitions, client=client, progress=progress)
+        report.update({"modes": list(MODES), "results": results})
+        print(format_modes(results), file=sys.stderr)
+        failed = any(result['errors'] for result in results) or \
+            any(entry['modes'][mode]['errors'] for result in results for entry in result['prompts'] for mode in MODES)
+    else:
+        results = benchmark(prepared.data, args.models, prompts, options, warmup=args.warmup,
+                            repetitions=args.repetitions, cold=args.cold, client=client, progress=progress)
+        report.update({"cold": args.cold, "results": results})
+        print(format_table(results), file=sys.stderr)
+        failed = any(result['errors'] for result in results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+def image_hash(image: bytes) -> str:
+    return hashlib.sha256(image).hexdigest()
+
+def cache_key(digest: str, system: str, prompt: str, image_sha256: str, options: dict) -> str:
+    """
+    Key of a generation: the same model digest, texts, image and options give the same key.
+    """
+    data = json.dumps([digest, system, prompt, image_sha256, options], sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of generations, one JSON file per key.
+
+    The files are evicted in least recently used order when the cache grows
+    over `max_bytes`. A hit updates the modification time of its file.
+
+    Args:
+        path (str): Directory of the cache.
+        max_bytes (int): Maximum size of the cache.
+        bypass (bool): Never read from the cache, new results are still stored.
+    """
+
+    def __init__(self, path: str, max_bytes: int, bypass: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        if self.bypass:
+            return None
+        try:
+            with open(self.file(key), "r") as f:
+                entry = json.load(f)
+            os.utime(self.file(key))
+            return entry
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, entry: dict) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self.file(key))
+        self.evict()
+
+    def evict(self) -> None:
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".json"):
+                os.remove(entry.path)
@@ -0,0 +1,865 @@
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+import ollama
+from PIL import UnidentifiedImageError
+
+from modules.archive import ArchiveWriter
+from modules.cache import ResponseCache, cache_key, image_hash
+from modules.history import HistoryStore
+from modules.hosts import HostPool, parse_hosts
+from modules.journal import RunJournal
+from modules.metrics import record_generation, start_server
+from modules.preprocess import ImagePipeline
+from modules.pulls import format_eta
+from modules.registry import ModelRegistry
+from modules.scheduler import ResidencyScheduler, full_name
+from modules.telemetry import TelemetrySampler
+from variables import (CACHE_MAX_BYTES, CACHE_PATH, HISTORY_PATH, IMAGE_MAX_SIDE, MEMORY_BUDGET, METRICS_PORT, MODEL_NATIVE_SIDES,
+                       OLLAMA_HOSTS, PROMPT_USER_PATH, TELEMETRY_INTERVAL)
+
+DONE_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_prompts(prompt_path: str = PROMPT_USER_PATH) -> dict:
+    """
+    Read a prompts file and index it by prompt name.
+
+    Args:
+        prompt_path (str): Path to a JSON list of prompts.
+
+    Returns:
+        dict: Prompts indexed by name.
+    """
+    with open(prompt_path, "r") as f:
+        return {prompt['name']: prompt for prompt in json.load(f)}
+
+def resolve_seed(seed: int) -> int:
+    if seed == -1:
+        return random.randint(0, 2**32 - 1)
+    return seed
+
+def build_options(temperature: float, seed: int) -> dict:
+    return {
+        "temperature": temperature,
+        "seed": seed
+    }
+
+def new_slot(prompt_name: str) -> dict:
+    return {
+        "prompt": prompt_name,
+        "response": None,
+        "done": {}
+    }
+
+def new_model(model: str) -> dict:
+    return {
+        "name": model,
+        "prompts": [],
+    }
+
+def new_response(models: list[str] = (), prompt_names: list[str] = ()) -> dict:
+    """
+    Build an empty response with one slot per model and prompt.
+
+    The layout is the one written by the "Download JSON" button:
+    response["models"][i]["prompts"][j].
+    """
+    response = {
+        "models": []
+    }
+    for model in models:
+        model_object = new_model(model)
+        model_object["prompts"] = [new_slot(prompt_name) for prompt_name in prompt_names]
+        response["models"].append(model_object)
+    return response
+
+def latency_stats(start: int, times: list[int], end: int, total_duration: int) -> dict:
+    """
+    Client side latencies of a stream, in nanoseconds like the Ollama durations.
+
+    Args:
+        start (int): Time the request was sent.
+        times (list[int]): Time each chunk with text was received.
+        end (int): Time the final chunk was received.
+        total_duration (int): Duration reported by the server.
+
+    Returns:
+        dict: ttft (time to first token), itl_p50 / itl_p90 / itl_p99
+            (inter-token latency percentiles), max_stall (longest gap between
+            two chunks), wall_duration and client_overhead (wall-clock duration
+            minus the server total_duration).
+    """
+    stats = {
+        "ttft": times[0] - start if times else None,
+        "wall_duration": end - start,
+        "client_overhead": end - start - total_duration if total_duration is not None else None,
+    }
+    gaps = np.diff(times)
+    if len(gaps) > 0:
+        p50, p90, p99 = np.percentile(gaps, (50, 90, 99))
+        stats.update({"itl_p50": int(p50), "itl_p90": int(p90), "itl_p99": int(p99), "max_stall": int(gaps.max())})
+    else:
+        stats.update({"itl_p50": None, "itl_p90": None, "itl_p99": None, "max_stall": None})
+    return stats
+
+def collect(slot: dict, stream: Iterator, start: int, content: Callable[[object], str],
+            cancel: threading.Event = None) -> Iterator[str]:
+    """
+    Fill a slot from the chunks of a generate or chat stream, yielding the text of each chunk.
+
+    When `cancel` is set, the stream is closed at the next chunk and the slot is left unfinished.
+    """
+    times = []
+    response = ""
+    for chunk in stream:
+        if cancel is not None and cancel.is_set():
+            if hasattr(stream, "close"):
+                stream.close()
+            return
+        text = content(chunk) or ""
+        if chunk.done:
+            slot["response"] = (response + text).strip()
+            slot["done"] = {field: chunk[field] for field in DONE_FIELDS}
+            slot["done"].update(latency_stats(start, times, time.perf_counter_ns(), chunk.total_duration))
+        else:
+            if text:
+                times.append(time.perf_counter_ns())
+            response += text
+        yield text
+
+def stream_prompt(slot: dict, model: str, prompt: dict, image: bytes | str, options: dict,
+                  client: ollama.Client = None, keep_alive=-1, cancel: threading.Event = None) -> Iterator[str]:
+    """
+    Stream one model / prompt generation and store the result in its slot.
+
+    Args:
+        slot (dict): Entry of response["models"][i]["prompts"] to fill.
+        model (str): Name of the model.
+        prompt (dict): Prompt with its 'system' and 'prompt' texts.
+        image (bytes | str): Image submitted with the prompt, raw or base64 encoded.
+        options (dict): Generation options (temperature, seed).
+        client (ollama.Client): Client to use, the default ollama client if None.
+        keep_alive: Passed to ollama to control how long the model stays loaded.
+        cancel (threading.Event): If set, the generation stops at the next chunk, see collect().
+
+    Yields:
+        str: The content of each chunk of data.
+    """
+    client = client or ollama
+    try:
+        text = prompt['prompt']
+        if text is None or text == "":
+            text = ' '
+
+        start = time.perf_counter_ns()
+        stream = client.generate(
+            model=model,
+            system=prompt['system'],
+            prompt=text,
+            images=[image],
+            stream=True,
+            format='',
+            keep_alive=keep_alive,
+            options=options
+        )
+        yield from collect(slot, stream, start, lambda chunk: chunk.response, cancel)
+
+    except ollama.ResponseError as e:
+        slot["error"] = str(e)
+    finally:
+        record_generation(model, prompt.get('name', ''), slot)
+
+def session_text(prompt: dict) -> str:
+    """Text of a session turn: the system prompt of each prompt is part of its turn."""
+    text = prompt['prompt'] or ' '
+    if prompt.get('system'):
+        return f"{prompt['system']}\n\n{text}"
+    return text
+
+def session_turn(prompt: dict, image: bytes | str, messages: list[dict]) -> dict:
+    """User message of a prompt, with the image when it opens the conversation."""
+    turn = {"role": "user", "content": session_text(prompt)}
+    if not messages:
+        turn["images"] = [image]
+    return turn
+
+def stream_turn(slot: dict, model: str, prompt: dict, image: bytes | str, options: dict, messages: list[dict],
+                client: ollama.Client = None, keep_alive=-1, cancel: threading.Event = None) -> Iterator[str]:
+    """
+    Stream one prompt of a session with the chat API and store the result in its slot.
+
+    The image is only sent with the first turn. The following turns repeat the
+    same conversation as a prefix, so the model reuses the image and the
+    previous turns it already evaluated instead of encoding the image again.
+    Answers are conditioned on the previous turns.
+
+    Args:
+        messages (list[dict]): Conversation of the session so far, each
+            successful turn and its answer are appended to it.
+        See stream_prompt() for the other arguments.
+    """
+    client = client or ollama
+    turn = session_turn(prompt, image, messages)
+    try:
+        start = time.perf_counter_ns()
+        stream = client.chat(
+            model=model,
+            messages=messages + [turn],
+            stream=True,
+            format='',
+            keep_alive=keep_alive,
+            options=options
+        )
+        yield from collect(slot, stream, start, lambda chunk: chunk.message.content, cancel)
+
+    except ollama.ResponseError as e:
+        slot["error"] = str(e)
+        return
+    finally:
+        record_generation(model, prompt.get('name', ''), slot)
+
+    if slot["response"] is not None:
+        messages.extend([turn, {"role": "assistant", "content": slot["response"]}])
+
+def run_prompt(slot: dict, model: str, prompt: dict, image: bytes | str, options: dict,
+               client: ollama.Client = None, keep_alive=-1) -> dict:
+    for _ in stream_prompt(slot, model, prompt, image, options, client=client, keep_alive=keep_alive):
+        pass
+    return slot
+
+def run_turn(slot: dict, model: str, prompt: dict, image: bytes | str, options: dict, messages: list[dict],
+             client: ollama.Client = None, keep_alive=-1) -> dict:
+    for _ in stream_turn(slot, model, prompt, image, options, messages, client=client, keep_alive=keep_alive):
+        pass
+    return slot
+
+def model_digests(client: ollama.Client = None) -> dict:
+    client = client or ollama
+    return {model['model']: model['digest'] for model in client.list()['models']}
+
+def model_digest(digests: dict, model: str) -> str | None:
+    """Digest of a model given with or without its tag, None if no server lists it."""
+    return digests.get(full_name(model))
+
+def prompt_key(digest: str, prompt: dict, image_sha256: str, options: dict, previous: list[dict] = None) -> str:
+    """Cache key of a cell, a session turn also depends on the prompts of the turns before it."""
+    if previous is not None:
+        options = {**options, "session": [session_text(prompt) for prompt in previous]}
+    return cache_key(digest, prompt['system'], prompt['prompt'], image_sha256, options)
+
+def load_cached(cache: ResponseCache, key: str, slot: dict) -> bool:
+    """Fill a slot from the cache, keeping the original done stats. Returns True on a hit."""
+    entry = cache.get(key)
+    if entry is None:
+        return False
+    slot["response"] = entry["response"]
+    slot["done"] = entry["done"]
+    slot["cached"] = True
+    return True
+
+def load_journaled(journaled: dict, model: str, prompt_name: str, slot: dict) -> bool:
+    """Fill a slot from a cell finished before the run was interrupted. Returns True if there is one."""
+    saved = journaled.get((model, prompt_name))
+    if saved is None:
+        return False
+    slot.update(saved)
+    slot["resumed"] = True
+    return True
+
+def store_cached(cache: ResponseCache, key: str, slot: dict) -> None:
+    if slot.get("error") is None and slot["done"]:
+        cache.put(key, {"response": slot["response"], "done": slot["done"]})
+
+def finalize(response: dict, image_name: str, image: bytes, date: str = None, embed: bool = True) -> dict:
+    """Date and image of a record, the base64 image ('image_data') is only added if `embed` is set."""
+    response["date"] = date or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    response["image_name"] = image_name
+    response["image_sha256"] = image_hash(image)
+    if embed:
+        response["image_data"] = base64.b64encode(image).decode("utf-8")
+    return response
+
+@dataclass
+class RunSettings:
+    """
+    How the cells of a run are executed.
+
+    Attributes:
+        client (ollama.Client): Client to use, the default ollama client if None.
+        concurrency (int): Requests running at the same time overall.
+        per_model (int | dict): Requests running at the same time on one model,
+            either the same limit for all models or a mapping of model name to
+            limit (models missing from it get 1).
+        scheduler (ResidencyScheduler): If set, each model is acquired before
+            its prompts run, loading and evicting models within its budget.
+        cache (ResponseCache): If set, cells found in the cache are not
+            generated again and new results are stored in it.
+        registry (ModelRegistry): Source of the model digests, ollama.list()
+            is called when it is not set.
+        max_side (int): Longest side of the images sent, 0 for the original size.
+        model_sides (dict): Longest side for some models, by name or name without tag.
+        image_format (str): JPEG or PNG to re-encode the images, the original format if None.
+        image_quality (int): JPEG quality.
+        history (HistoryStore): If set, every record is appended to it.
+        prefetch (bool): When the models run one after the other, load the
+            next model in the background while the current one generates, if
+            it fits in the budget of the scheduler.
+        hosts (HostPool): If set, each model runs on the host the pool places
+            it on and the host is recorded in its slots. The pool is also the
+            scheduler of the run.
+        mode (str): "generate" sends the image with every prompt, "session"
+            sends it once per model and runs the prompts as the turns of one
+            chat, one after the other (see stream_turn()).
+        journal (RunJournal): If set, every finished cell is appended to it,
+            and the cells it already holds are not generated again (resume).
+        telemetry (float): Seconds between two samples of the loaded models
+            and of the host during each image (see TelemetrySampler), 0 to
+            record no telemetry.
+    """
+    client: ollama.Client = None
+    concurrency: int = 1
+    per_model: int | dict = 1
+    scheduler: ResidencyScheduler = None
+    cache: ResponseCache = None
+    registry: ModelRegistry = None
+    max_side: int = 0
+    model_sides: dict = None
+    image_format: str = None
+    image_quality: int = 90
+    history: HistoryStore = None
+    prefetch: bool = False
+    hosts: HostPool = None
+    mode: str = "generate"
+    journal: RunJournal = None
+    telemetry: float = 0.0
+
+    def pipeline(self, image: bytes) -> ImagePipeline:
+        return ImagePipeline(image, self.max_side, self.model_sides, self.image_format, self.image_quality)
+
+    def model_limit(self, model: str) -> int:
+        if isinstance(self.per_model, dict):
+            return max(1, self.per_model.get(model, 1))
+        return max(1, self.per_model)
+
+    def route(self, model: str) -> tuple[str | None, ollama.Client]:
+        """Host and client serving a model, no host without a pool."""
+        if self.hosts is None:
+            return None, self.client
+        host = self.hosts.place(model)
+        return host, self.hosts.client(host)
+
+    def clients(self) -> dict:
+        """Client of each host of the run."""
+        if self.hosts is not None:
+            return {host: self.hosts.client(host) for host in self.hosts.hosts}
+        return {None: self.client or ollama}
+
+    def sampler(self) -> TelemetrySampler | None:
+        if self.telemetry <= 0:
+            return None
+        return TelemetrySampler(self.clients(), self.telemetry)
+
+    def digests(self, models: list[str] = None) -> dict:
+        """Digests by model name, with several hosts the ones of the hosts the models are placed on."""
+        if self.hosts is not None:
+            return self.hosts.digests(models)
+        if self.registry is not None:
+            return self.registry.digests()
+        return model_digests(self.client)
+
+class ChunkBuffer:
+    """
+    Coalesce the chunks of concurrent streams.
+
+    Streams append their chunks from any thread, the UI drains the cells that
+    changed at its own pace and redraws each of them once per refresh instead
+    of once per token.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = {}
+        self.changed = set()
+        self.chunks = 0
+        self.flushes = 0
+
+    def append(self, i: int, j: int, text: str) -> None:
+        with self.lock:
+            self.texts[i, j] = self.texts.get((i, j), "") + (text or "")
+            self.changed.add((i, j))
+            self.chunks += 1
+
+    def drain(self) -> dict[tuple[int, int], str]:
+        """Full text of each cell changed since the last drain."""
+        with self.lock:
+            changed = {cell: self.texts[cell] for cell in self.changed}
+            self.changed.clear()
+            if changed:
+                self.flushes += 1
+            return changed
+
+def run_cells(response: dict, models: list[str], prompts: list[dict], image: ImagePipeline | bytes, options: dict,
+              settings: RunSettings = None, on_chunk: Callable[[int, int, str], None] = None,
+              cancel: threading.Event = None) -> dict:
+    """
+    Run every model / prompt cell of a response built by new_response().
+
+    The prompts of a model run together, so each model is loaded once. With
+    concurrency > 1 the models run on a pool of threads, at most `concurrency`
+    requests at a time overall and `per_model` at a time for each model.
+    Each stream writes into its own slot response["models"][i]["prompts"][j].
+
+    Args:
+        image (ImagePipeline | bytes): Image of the run, encoded once per target size.
+        settings (RunSettings): How the cells are executed.
+        on_chunk (Callable): Called with (i, j, text) for every chunk received.
+        cancel (threading.Event): When set, the streams stop at their next chunk
+            and no other cell starts. The unfinished cells are neither cached nor journaled.
+    """
+    settings = settings or RunSettings()
+    cancelled = cancel.is_set if cancel is not None else lambda: False
+    cache, scheduler, journal = settings.cache, settings.scheduler, settings.journal
+    pipeline = image if isinstance(image, ImagePipeline) else settings.pipeline(image)
+    journaled = journal.read()[1] if journal is not None else {}
+    requests = threading.BoundedSemaphore(max(1, settings.concurrency))
+    keys = {}
+    if cache is not None:
+        digests = settings.digests(models)
+        for i, model in enumerate(models):
+            digest = model_digest(digests, model)
+            if digest is None:
+                # Not cached: the key would not change when the model is updated.
+                continue
+            image_sha256 = pipeline.for_model(model).sha256
+            for j, prompt in enumerate(prompts):
+                previous = prompts[:j] if settings.mode == "session" else None
+                keys[i, j] = prompt_key(digest, prompt, image_sha256, options, previous)
+
+    def run_cell(i: int, j: int, messages: list[dict] = None) -> None:
+        if cancelled():
+            return
+        slot = response["models"][i]["prompts"][j]
+        data = pipeline.for_model(models[i]).data
+        host, client = settings.route(models[i])
+        if host is not None:
+            slot["host"] = host
+        with requests:
+            if messages is None:
+                stream = stream_prompt(slot, models[i], prompts[j], data, options, client=client, cancel=cancel)
+            else:
+                stream = stream_turn(slot, models[i], prompts[j], data, options, messages, client=client, cancel=cancel)
+            for text in stream:
+                if on_chunk is not None:
+                    on_chunk(i, j, text)
+        if cancelled() and not slot["done"]:
+            return
+        if (i, j) in keys:
+            store_cached(cache, keys[i, j], slot)
+        if journal is not None:
+            journal.add(models[i], prompts[j]['name'], slot)
+
+    def pending(i: int) -> list[int]:
+        """Prompts of a model to generate, the journaled and cached ones are loaded into their slots."""
+        todo = list(range(len(prompts)))
+        if journaled:
+            todo = [j for j in todo if not load_journaled(journaled, models[i], prompts[j]['name'], response["models"][i]["prompts"][j])]
+        if cache is not None:
+            todo = [j for j in todo if (i, j) not in keys or not load_cached(cache, keys[i, j], response["models"][i]["prompts"][j])]
+        if on_chunk is not None:
+            for j in set(range(len(prompts))) - set(todo):
+                on_chunk(i, j, response["models"][i]["prompts"][j]["response"])
+        return todo
+
+    def run_model(i: int, todo: list[int], next_model: str = None) -> None:
+        if not todo or cancelled():
+            return
+
+        if scheduler is not None:
+            scheduler.acquire(models[i])
+            if next_model is not None:
+                scheduler.prefetch(next_model)
+        try:
+            limit = settings.model_limit(models[i])
+            if settings.mode == "session":
+                # Turns run in order, the cached ones are replayed into the conversation.
+                messages = []
+                data = pipeline.for_model(models[i]).data
+                for j, slot in enumerate(response["models"][i]["prompts"]):
+                    if j in todo:
+                        run_cell(i, j, messages)
+                    elif slot["response"] is not None:
+                        turn = session_turn(prompts[j], data, messages)
+                        messages.extend([turn, {"role": "assistant", "content": slot["response"]}])
+            elif settings.concurrency <= 1 or limit <= 1:
+                for j in todo:
+                    run_cell(i, j)
+            else:
+                with ThreadPoolExecutor(max_workers=limit) as executor:
+                    for future in [executor.submit(run_cell, i, j) for j in todo]:
+                        future.result()
+        finally:
+            if scheduler is not None:
+                scheduler.release(models[i])
+
+    order = list(range(len(models)))
+    if scheduler is not None:
+        order = [models.index(model) for model in scheduler.order(models)]
+    todos = {i: pending(i) for i in order}
+
+    if settings.concurrency <= 1:
+        # Models left to generate, each one can prefetch the next one.
+        lane = [i for i in order if todos[i]]
+        for n, i in enumerate(lane):
+            next_model = models[lane[n + 1]] if settings.prefetch and n + 1 < len(lane) else None
+            run_model(i, todos[i], next_model)
+        return response
+
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        for future in [executor.submit(run_model, i, todos[i]) for i in order]:
+            future.result()
+    return response
+
+def run_image(image_name: str, image: bytes, models: list[str], prompts: list[dict], options: dict,
+              settings: RunSettings = None, pipeline: ImagePipeline = None, error: str = None) -> dict:
+    """
+    Run every model against every prompt for one image.
+
+    Args:
+        pipeline (ImagePipeline): Image already prepared, built from the settings if None.
+        error (str): If set, the image could not be prepared: every prompt
+            records this error and nothing is generated.
+
+    Returns:
+        dict: A record with the same shape as the downloaded JSON.
+    """
+    settings = settings or RunSettings()
+    response = new_response(models, [prompt['name'] for prompt in prompts])
+    digests = settings.digests(models)
+    for model_object in response["models"]:
+        model_object["digest"] = model_digest(digests, model_object["name"])
+    pipeline = pipeline or settings.pipeline(image)
+    if error is None:
+        sampler = settings.sampler()
+        if sampler is not None:
+            with sampler:
+                run_cells(response, models, prompts, pipeline, options, settings=settings)
+            response["telemetry"] = sampler.series()
+        else:
+            run_cells(response, models, prompts, pipeline, options, settings=settings)
+        response["preprocess"] = pipeline.report()
+    else:
+        for model_object in response["models"]:
+            for slot in model_object["prompts"]:
+                slot["error"] = error
+    response["options"] = options
+    response["mode"] = settings.mode
+    if settings.scheduler is not None:
+        response["scheduler"] = settings.scheduler.drain()
+    finalize(response, image_name, image)
+    if settings.history is not None:
+        settings.history.add(response)
+    return response
+
+def is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+def count_zip(source) -> int:
+    """Number of images of a zip file (path or file object)."""
+    with zipfile.ZipFile(source) as archive:
+        return sum(1 for info in archive.infolist() if not info.is_dir() and is_image(info.filename))
+
+def iter_zip(source) -> Iterator[tuple[str, bytes]]:
+    """Yield (name, bytes) for each image of a zip file (path or file object), in name order."""
+    with zipfile.ZipFile(source) as archive:
+        for info in sorted(archive.infolist(), key=lambda info: info.filename):
+            if not info.is_dir() and is_image(info.filename):
+                yield os.path.basename(info.filename), archive.read(info)
+
+def iter_images(paths: Iterable[str]) -> Iterator[tuple[str, bytes]]:
+    """
+    Yield (name, bytes) for each image file, directories and zip files are walked in sorted order.
+
+    Images are read one at a time so large folders are never held in memory.
+    """
+    for path in paths:
+        if os.path.isfile(path) and path.lower().endswith(".zip"):
+            yield from iter_zip(path)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file in sorted(files):
+                    if is_image(file):
+                        with open(os.path.join(root, file), "rb") as f:
+                            yield file, f.read()
+        else:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+
+def count_images(paths: Iterable[str]) -> int:
+    """Number of images iter_images() yields, without reading them."""
+    count = 0
+    for path in paths:
+        if os.path.isfile(path) and path.lower().endswith(".zip"):
+            count += count_zip(path)
+        elif os.path.isdir(path):
+            count += sum(1 for _, _, files in os.walk(path) for file in files if is_image(file))
+        else:
+            count += 1
+    return count
+
+def prepare_images(images: Iterable[tuple[str, bytes]], models: list[str], settings: RunSettings,
+                   depth: int = 2) -> Iterator[tuple[str, bytes, ImagePipeline, str | None]]:
+    """
+    Read, decode and downscale the next images in a background thread while the current one runs.
+
+    At most `depth` prepared images wait for the models, so the memory used
+    does not grow with the number of images.
+
+    Yields:
+        tuple: The name, the bytes and the pipeline of each image, and the
+            error if the image could not be decoded.
+    """
+    queue = Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for image_name, image in images:
+                pipeline = settings.pipeline(image)
+                error = None
+                try:
+                    for model in models:
+                        pipeline.for_model(model)
+                except UnidentifiedImageError:
+                    error = "Cannot read image: unknown format"
+                except (OSError, ValueError) as e:
+                    error = f"Cannot read image: {e}"
+                if not put((image_name, image, pipeline, error)):
+                    return
+        except Exception as e:
+            put(e)
+        put(None)
+
+    thread = threading.Thread(target=produce, name="prepare", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+class BatchProgress:
+    """
+    Images done, throughput and ETA of a batch run.
+
+    Args:
+        total (int): Number of images of the run, None if unknown (no ETA).
+    """
+
+    def __init__(self, total: int = None):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    def add(self, record: dict) -> None:
+        self.done += 1
+        if any(slot.get("error") for model in record["models"] for slot in model["prompts"]):
+            self.failed += 1
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def rate(self) -> float:
+        """Images per second."""
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> float | None:
+        """Seconds left."""
+        rate = self.rate()
+        if self.total is None or rate == 0:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def format(self) -> str:
+        total = f"/{self.total}" if self.total is not None else ""
+        return (f"{self.done}{total} image(s) - {self.failed} with errors - {self.rate() * 60:.1f} images/min "
+                f"- ETA {format_eta(self.eta())}")
+
+def run_batch(images: Iterable[tuple[str, bytes]], models: list[str], prompts: list[dict], options: dict,
+              output_path: str, settings: RunSettings = None, progress: BatchProgress = None) -> Iterator[dict]:
+    """
+    Run the images × models × prompts matrix and append each record to the output.
+
+    The images are prepared in the background (prepare_images()) while the
+    models run on the previous one, and each record is written as soon as its
+    image is done, so only a few images are in memory at a time.
+
+    The output is a JSONL file, or a compact archive if its name ends with .zip.
+    JSONL records are flushed as soon as their image is done, so an interrupted
+    run keeps every finished image; an archive is complete once the run ends.
+
+    Args:
+        progress (BatchProgress): Updated after each image.
+
+    Yields:
+        dict: The record of each image.
+    """
+    settings = settings or RunSettings()
+
+    def records() -> Iterator[dict]:
+        for image_name, image, pipeline, error in prepare_images(images, models, settings):
+            record = run_image(image_name, image, models, prompts, options, settings=settings, pipeline=pipeline, error=error)
+            if progress is not None:
+                progress.add(record)
+            yield record
+
+    if output_path.endswith(".zip"):
+        with ArchiveWriter(output_path) as writer:
+            for record in records():
+                writer.add(record)
+                yield record
+        return
+
+    with open(output_path, "a") as f:
+        for record in records():
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            yield record
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.engine",
+        description="Compare vision models on a set of images without the Streamlit UI."
+    )
+    parser.add_argument("images", nargs="+", help="Image files, directories or zip files of images")
+    parser.add_argument("-m", "--models", nargs="+", required=True, help="Models to compare")
+    parser.add_argument("-p", "--prompts", nargs="+", required=True, help="Names of the prompts to use")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file or compact archive (.zip) the records are appended to")
+    parser.add_argument("--prompts-file", default=PROMPT_USER_PATH, help="Prompts file (default: prompts_user.json)")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42, help="-1: random seed")
+    parser.add_argument("--host", default=None, help="Ollama host (default: OLLAMA_HOST or localhost)")
+    parser.add_argument("--hosts", nargs="+", default=parse_hosts(OLLAMA_HOSTS),
+                        help="Several Ollama hosts, each model runs on one of them (default: VC_OLLAMA_HOSTS)")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Requests running at the same time (default: 1)")
+    parser.add_argument("--per-model", type=int, default=1, help="Requests running at the same time on one model (default: 1)")
+    parser.add_argument("--model-limit", action="append", default=[], metavar="MODEL=N",
+                        help="Per model limit for one model, can be repeated")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET / 1e9,
+                        help="Memory budget for the loaded models in GB, 0 for no limit (default: VC_MEMORY_BUDGET_GB or 0)")
+    parser.add_argument("--keep-loaded", action="store_true", help="Keep the models loaded at the end of the run")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="Load the next model while the current one generates, when it fits in the memory budget")
+    parser.add_argument("--mode", choices=["generate", "session"], default="generate",
+                        help="session: send the image once per model and the prompts as the turns of a chat (default: generate)")
+    parser.add_argument("--telemetry", type=float, default=TELEMETRY_INTERVAL,
+                        help=f"Seconds between two samples of the model and host memory, 0: no telemetry (default: {TELEMETRY_INTERVAL})")
+    parser.add_argument("--max-side", type=int, default=IMAGE_MAX_SIDE,
+                        help="Downscale the images to this longest side in pixels, 0 for the original size")
+    parser.add_argument("--native-size", action="store_true", help="Downscale the images to the input size of each model")
+    parser.add_argument("--image-format", choices=["JPEG", "PNG"], default=None, help="Re-encode the images in this format")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality (default: 90)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port serving OpenMetrics on /metrics during the run, 0: disabled (default: VC_METRICS_PORT or 0)")
+    parser.add_argument("--history", default=HISTORY_PATH, help="Run history database (default: history.db)")
+    parser.add_argument("--no-history", action="store_true", help="Do not append the runs to the history")
+    parser.add_argument("--cache-dir", default=CACHE_PATH, help="Directory of the response cache")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the response cache")
+    parser.add_argument("--bypass-cache", action="store_true", help="Generate every response again, new results are still cached")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] = None) -> int:
+    args = parse_args(argv)
+
+    prompts_index = load_prompts(args.prompts_file)
+    missing = [name for name in args.prompts if name not in prompts_index]
+    if missing:
+        print(f"Unknown prompt(s): {', '.join(missing)}", file=sys.stderr)
+        return 2
+    prompts = [prompts_index[name] for name in args.prompts]
+
+    per_model = args.per_model
+    if args.model_limit:
+        per_model = {model: args.per_model for model in args.models}
+        for limit in args.model_limit:
+            model, _, value = limit.rpartition("=")
+            per_model[model] = int(value)
+
+    start_server(args.metrics_port)
+    client = ollama.Client(host=args.host or (args.hosts[0] if len(args.hosts) == 1 else None))
+    options = build_options(args.temperature, resolve_seed(args.seed))
+    hosts = None
+    if len(args.hosts) > 1:
+        hosts = scheduler = HostPool(args.hosts, budget=int(args.memory_budget * 1e9))
+    else:
+        scheduler = ResidencyScheduler(budget=int(args.memory_budget * 1e9), client=client)
+    settings = RunSettings(
+        client=client,
+        hosts=hosts,
+        concurrency=args.concurrency,
+        per_model=per_model,
+        scheduler=scheduler,
+        cache=None if args.no_cache else ResponseCache(args.cache_dir, CACHE_MAX_BYTES, bypass=args.bypass_cache),
+        registry=ModelRegistry(client=client) if hosts is None else None,
+        max_side=args.max_side,
+        model_sides=MODEL_NATIVE_SIDES if args.native_size else None,
+        image_format=args.image_format,
+        image_quality=args.quality,
+        history=None if args.no_history else HistoryStore(args.history),
+        prefetch=args.prefetch,
+        mode=args.mode,
+        telemetry=args.telemetry
+    )
+
+    progress = BatchProgress(count_images(args.images))
+    try:
+        for record in run_batch(iter_images(args.images), args.models, prompts, options, args.output, settings=settings,
+                                progress=progress):
+            errors = sum(1 for model in record["models"] for slot in model["prompts"] if slot.get("error"))
+            print(f"{record['image_name']}: {len(record['models'])} model(s), {errors} error(s) - {progress.format()}")
+    finally:
+        scheduler.finish(keep_loaded=args.keep_loaded)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
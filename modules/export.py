@@ -0,0 +1,139 @@
+import argparse
+import importlib.util
+import io
+import itertools
+import json
+import sys
+import tempfile
+from typing import IO, Iterable, Iterator
+
+from modules.archive import ArchiveWriter, compact_record, expand_record, read_records
+from modules.stats import results_frame
+
+# Label, extension and MIME type of each format.
+FORMATS = {
+    "json": ("JSON", "json", "application/json"),
+    "jsonl": ("JSONL", "jsonl", "application/jsonl"),
+    "zip": ("Archive", "zip", "application/zip"),
+    "csv": ("CSV (metrics)", "csv", "text/csv"),
+    "parquet": ("Parquet (metrics)", "parquet", "application/vnd.apache.parquet"),
+}
+
+
+def formats() -> list[str]:
+    """Formats available, Parquet needs pyarrow."""
+    return [name for name in FORMATS if name != "parquet" or importlib.util.find_spec("pyarrow") is not None]
+
+def file_name(prefix: str, format: str) -> str:
+    return f"{prefix}.{FORMATS[format][1]}"
+
+def prepare(records: Iterable[dict], image: bool, images: dict = None) -> Iterator[dict]:
+    """
+    Records with or without their image, one at a time.
+
+    Args:
+        image (bool): Embed the image ('image_data'), records only keep their 'image_sha256' otherwise.
+        images (dict): Image bytes by SHA-256, for the records that do not embed their image.
+    """
+    for record in records:
+        record, sha256, data = compact_record(record)
+        if image:
+            record = expand_record(record, data if data is not None else (images or {}).get(sha256))
+        yield record
+
+def write_export(f: IO[bytes], records: Iterable[dict], format: str, image: bool = True, images: dict = None) -> int:
+    """
+    Write records to a binary file, one record at a time for JSON, JSONL and archives.
+
+    JSON holds one record as written by the "Download JSON" button, or a list
+    of records. CSV and Parquet hold the metrics table of stats.results_frame()
+    with the responses, and the base64 image of each row if `image` is set.
+
+    Returns:
+        int: Number of records written.
+    """
+    records = prepare(records, image, images)
+    count = 0
+    if format == "zip":
+        with ArchiveWriter(f) as writer:
+            for record in records:
+                writer.add(record)
+                count += 1
+        return count
+
+    if format in ("csv", "parquet"):
+        records = list(records)
+        frame = results_frame(records, responses=True)
+        if image:
+            data = {record.get("image_sha256"): record.get("image_data") for record in records}
+            frame["image_data"] = frame["image_sha256"].map(data)
+        if format == "csv":
+            frame.to_csv(f, index=False)
+        else:
+            frame.to_parquet(f, index=False)
+        return len(records)
+
+    text = io.TextIOWrapper(f, encoding="utf-8")
+    if format == "jsonl":
+        for record in records:
+            json.dump(record, text)
+            text.write("\n")
+            count += 1
+    else:
+        first, second = next(records, None), next(records, None)
+        if first is not None and second is None:
+            # A single record keeps the shape of the "Download JSON" button.
+            json.dump(first, text)
+            count = 1
+        else:
+            text.write("[")
+            for record in itertools.chain([record for record in (first, second) if record is not None], records):
+                text.write(", " if count else "")
+                json.dump(record, text)
+                count += 1
+            text.write("]")
+    text.flush()
+    text.detach()
+    return count
+
+def export_file(records: Iterable[dict], format: str, image: bool = True, images: dict = None) -> IO[bytes]:
+    """
+    Export to an anonymous temporary file, removed once closed.
+
+    Returns:
+        IO[bytes]: The file, positioned at its start.
+    """
+    f = tempfile.TemporaryFile(prefix="vision-comparator-", suffix=f".{FORMATS[format][1]}")
+    write_export(f, records, format, image, images)
+    f.seek(0)
+    return f
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.export",
+        description="Export JSON, JSONL results and archives as JSON, JSONL, archive, CSV or Parquet."
+    )
+    parser.add_argument("output", help="File to write")
+    parser.add_argument("inputs", nargs="+", help="JSON, JSONL or archive files")
+    parser.add_argument("-f", "--format", choices=list(FORMATS), default=None,
+                        help="Format of the output (default: from its extension)")
+    parser.add_argument("--no-image", action="store_true", help="Do not embed the images")
+    args = parser.parse_args(argv)
+
+    format = args.format or args.output.rsplit(".", 1)[-1]
+    if format not in FORMATS:
+        print(f"Unknown format: {format}", file=sys.stderr)
+        return 2
+
+    def records() -> Iterator[dict]:
+        for path in args.inputs:
+            yield from read_records(path, images=not args.no_image)
+
+    with open(args.output, "wb") as f:
+        count = write_export(f, records(), format, image=not args.no_image)
+    print(f"{count} record(s) written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
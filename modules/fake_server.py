@@ -0,0 +1,400 @@
+import argparse
+import datetime
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+from modules.archive import read_records
+from modules.engine import load_prompts
+from variables import PROMPT_USER_PATH
+
+LOREM = (
+    "The image shows a small black cat with a white tail playing with a red ball in a leafy square "
+    "next to a duck pond under a bright blue sky while people walk along the path in the background"
+).split()
+
+
+def digest(name: str) -> str:
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+def now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def split_tokens(text: str) -> list[str]:
+    """Approximate the token chunks of a response, one word and its trailing spaces per chunk."""
+    return re.findall(r"\S+\s*|\s+", text) or [""]
+
+
+class FakeOllama:
+    """
+    Stand-in for an Ollama server, without any real model.
+
+    Models either replay responses recorded in archives (JSON written by
+    "Download JSON", JSONL or compact archives) with their original pacing, or
+    generate synthetic responses at a fixed rate.
+
+    Args:
+        speed (float): Time scale of the replay, 10 runs ten times faster.
+        size (int): Memory size reported for each model.
+        pull_rate (float): Simulated download rate of /api/pull in bytes per second.
+        reuse (float): Share of the time to the first chunk left for a chat
+            turn whose image was sent in an earlier turn, the model having
+            already evaluated it.
+        vram (int): VRAM of the simulated GPU, 0 for no limit. The loaded
+            models fill it in load order, the rest of them is reported on the CPU.
+    """
+
+    def __init__(self, speed: float = 1.0, size: int = 2 * 10**9, pull_rate: float = 200e6, reuse: float = 0.3,
+                 vram: int = 0):
+        self.speed = speed
+        self.size = size
+        self.pull_rate = pull_rate
+        self.reuse = reuse
+        self.vram = vram
+        self.lock = threading.Lock()
+        self.models = {}
+        self.resident = {}
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+    def add_model(self, name: str, **kwargs) -> dict:
+        if ":" not in name:
+            name = f"{name}:latest"
+        model = self.models.setdefault(name, {
+            "name": name,
+            "size": self.size,
+            "digest": digest(name),
+            "modified_at": now(),
+            "responses": {},
+            "rate": 20.0,
+            "latency": 0.2,
+            "load": 1.0,
+            "tokens": 60,
+        })
+        model.update(kwargs)
+        return model
+
+    def add_replay(self, path: str, prompts: dict = None) -> int:
+        """
+        Add the responses of an archive.
+
+        Args:
+            path (str): JSON, JSONL or compact archive.
+            prompts (dict): Prompts indexed by name, to find a response from the
+                prompt text of a request.
+
+        Returns:
+            int: Number of responses added.
+        """
+        texts = {name: (prompt['system'], prompt['prompt']) for name, prompt in (prompts or {}).items()}
+        count = 0
+        for record in read_records(path, images=False):
+            for model_object in record["models"]:
+                model = self.add_model(model_object["name"])
+                for prompt in model_object["prompts"]:
+                    if prompt.get("error") is not None or not prompt["done"]:
+                        continue
+                    key = texts.get(prompt["prompt"], prompt["prompt"])
+                    model["responses"].setdefault(key, []).append((prompt["response"], prompt["done"]))
+                    count += 1
+        return count
+
+    def add_synthetic(self, count: int, rate: float, latency: float, load: float, tokens: int) -> None:
+        for index in range(count):
+            self.add_model(f"synthetic-{index}", rate=rate, latency=latency, load=load, tokens=tokens)
+
+    def tags(self) -> dict:
+        return {"models": [self.describe(model) for model in self.models.values()]}
+
+    def describe(self, model: dict) -> dict:
+        return {
+            "name": model["name"],
+            "model": model["name"],
+            "modified_at": model["modified_at"],
+            "size": model["size"],
+            "digest": model["digest"],
+            "details": {"format": "gguf", "family": "fake", "families": ["fake", "clip"]},
+        }
+
+    def ps(self) -> dict:
+        with self.lock:
+            models, free = [], self.vram
+            for name, expires in self.resident.items():
+                if name not in self.models:
+                    continue
+                size = self.models[name]["size"]
+                size_vram = size if self.vram <= 0 else max(0, min(size, free))
+                free -= size_vram
+                models.append({**self.describe(self.models[name]), "size_vram": size_vram, "expires_at": expires})
+            return {"models": models}
+
+    def show(self, name: str) -> dict | None:
+        model = self.find(name)
+        if model is None:
+            return None
+        return {
+            "modified_at": model["modified_at"],
+            "details": self.describe(model)["details"],
+            "model_info": {"general.architecture": "fake"},
+            "capabilities": ["completion", "vision"],
+        }
+
+    def find(self, name: str) -> dict | None:
+        return self.models.get(name) or self.models.get(f"{name}:latest")
+
+    def script(self, model: dict, system: str, prompt: str) -> tuple[list[str], float, float, int]:
+        """Chunks of a response, delay before the first one, delay between chunks and prompt eval count."""
+        recorded = model["responses"].get((system, prompt)) or model["responses"].get(prompt)
+        if recorded is None and model["responses"]:
+            # Unknown prompt: pick a recorded response from the prompt text, always the same one.
+            entries = [entry for entries in model["responses"].values() for entry in entries]
+            recorded = [entries[int(digest(f"{system}{prompt}"), 16) % len(entries)]]
+
+        if recorded:
+            text, done = recorded[0]
+            chunks = split_tokens(text)
+            first = (done.get("ttft") or done.get("prompt_eval_duration") or 0) / 10**9
+            if done.get("ttft") is not None:
+                # The recorded ttft includes the load of the model, replayed separately.
+                first = max(0.0, first - (done.get("load_duration") or 0) / 10**9)
+            interval = (done.get("eval_duration") or 0) / 10**9 / max(1, len(chunks))
+            if done.get("itl_p50") is not None:
+                interval = done["itl_p50"] / 10**9
+            return chunks, first, interval, done.get("prompt_eval_count") or 1
+
+        words = [LOREM[index % len(LOREM)] for index in range(model["tokens"])]
+        return [f"{word} " for word in words], model["latency"], 1 / model["rate"], len(prompt.split()) + 1
+
+    def load(self, model: dict, keep_alive) -> int:
+        """Make a model resident, returns the load duration in nanoseconds."""
+        with self.lock:
+            loaded = model["name"] in self.resident
+            self.resident[model["name"]] = "0001-01-01T00:00:00Z" if keep_alive == -1 else now()
+        if loaded:
+            return 0
+        start = time.perf_counter_ns()
+        self.sleep(model["load"])
+        return time.perf_counter_ns() - start
+
+    def generate(self, body: dict) -> Iterator[dict]:
+        model = self.find(body.get("model", ""))
+        if body.get("keep_alive") == 0 and not body.get("prompt"):
+            with self.lock:
+                self.resident.pop(model["name"], None)
+            yield {"model": model["name"], "created_at": now(), "response": "", "done": True, "done_reason": "unload"}
+            return
+
+        start = time.perf_counter_ns()
+        load_duration = self.load(model, body.get("keep_alive"))
+        if not body.get("prompt"):
+            yield {"model": model["name"], "created_at": now(), "response": "", "done": True, "done_reason": "load",
+                   "total_duration": time.perf_counter_ns() - start, "load_duration": load_duration}
+            return
+
+        chunks, first, interval, prompt_eval_count = self.script(model, body.get("system") or "", body["prompt"])
+        if body.get("reused"):
+            first *= self.reuse
+            prompt_eval_count = max(1, int(prompt_eval_count * self.reuse))
+        prompt_start = time.perf_counter_ns()
+        self.sleep(first)
+        eval_start = time.perf_counter_ns()
+        for chunk in chunks:
+            yield {"model": model["name"], "created_at": now(), "response": chunk, "done": False}
+            self.sleep(interval)
+        end = time.perf_counter_ns()
+
+        yield {
+            "model": model["name"],
+            "created_at": now(),
+            "response": "",
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": end - start,
+            "load_duration": load_duration,
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": eval_start - prompt_start,
+            "eval_count": len(chunks),
+            "eval_duration": end - eval_start,
+        }
+
+    def chat(self, body: dict) -> Iterator[dict]:
+        """Answer the last user message of a chat, as generate() would answer the same prompt."""
+        model = self.find(body.get("model", ""))
+        messages = body.get("messages") or []
+        users = [message for message in messages if message.get("role") == "user"]
+        system = "\n\n".join(message["content"] for message in messages if message.get("role") == "system")
+        prompt = users[-1]["content"] if users else ""
+        for key in model["responses"]:
+            # Session turns carry the system prompt in the user message.
+            if isinstance(key, tuple) and not system and prompt in (f"{key[0]}\n\n{key[1]}", key[1]):
+                system, prompt = key
+                break
+        reused = bool(users) and not users[-1].get("images") and any(message.get("images") for message in users)
+
+        request = {**body, "system": system, "prompt": prompt, "reused": reused}
+        for chunk in self.generate(request):
+            chunk["message"] = {"role": "assistant", "content": chunk.pop("response")}
+            yield chunk
+
+    def pull(self, name: str) -> Iterator[dict]:
+        model = self.find(name) or self.add_model(name)
+        yield {"status": "pulling manifest"}
+        status = f"pulling {model['digest'][:12]}"
+        step = max(1, int(self.pull_rate / 10))
+        for completed in range(0, model["size"], step):
+            yield {"status": status, "digest": model["digest"], "total": model["size"], "completed": completed}
+            self.sleep(0.1)
+        yield {"status": status, "digest": model["digest"], "total": model["size"], "completed": model["size"]}
+        yield {"status": "verifying sha256 digest"}
+        yield {"status": "writing manifest"}
+        model["modified_at"] = now()
+        yield {"status": "success"}
+
+    def delete(self, name: str) -> bool:
+        model = self.find(name)
+        if model is None:
+            return False
+        with self.lock:
+            self.models.pop(model["name"], None)
+            self.resident.pop(model["name"], None)
+        return True
+
+
+def make_handler(fake: FakeOllama) -> type:
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def body(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def send_json(self, data: dict, status: int = 200) -> None:
+            payload = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_stream(self, chunks: Iterator[dict], stream: bool) -> None:
+            if not stream:
+                chunks = list(chunks)
+                final = dict(chunks[-1])
+                if "response" in final:
+                    final["response"] = "".join(chunk.get("response", "") for chunk in chunks)
+                if "message" in final:
+                    final["message"]["content"] = "".join(chunk["message"]["content"] for chunk in chunks)
+                self.send_json(final)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(json.dumps(chunk).encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+        def not_found(self, name: str) -> None:
+            self.send_json({"error": f"model '{name}' not found"}, status=404)
+
+        def do_GET(self) -> None:
+            if self.path == "/api/tags":
+                self.send_json(fake.tags())
+            elif self.path == "/api/ps":
+                self.send_json(fake.ps())
+            elif self.path == "/api/version":
+                self.send_json({"version": "0.0.0-fake"})
+            elif self.path == "/":
+                self.send_json({"status": "Ollama is running"})
+            else:
+                self.send_json({"error": "not found"}, status=404)
+
+        def do_POST(self) -> None:
+            body = self.body()
+            name = body.get("model", "")
+            if self.path == "/api/generate":
+                if fake.find(name) is None:
+                    return self.not_found(name)
+                self.send_stream(fake.generate(body), body.get("stream", True))
+            elif self.path == "/api/chat":
+                if fake.find(name) is None:
+                    return self.not_found(name)
+                self.send_stream(fake.chat(body), body.get("stream", True))
+            elif self.path == "/api/show":
+                show = fake.show(name)
+                if show is None:
+                    return self.not_found(name)
+                self.send_json(show)
+            elif self.path == "/api/pull":
+                self.send_stream(fake.pull(name), body.get("stream", True))
+            else:
+                self.send_json({"error": "not found"}, status=404)
+
+        def do_DELETE(self) -> None:
+            name = self.body().get("model", "")
+            if self.path != "/api/delete":
+                return self.send_json({"error": "not found"}, status=404)
+            if not fake.delete(name):
+                return self.not_found(name)
+            self.send_json({})
+
+    return Handler
+
+def serve(fake: FakeOllama, host: str = "127.0.0.1", port: int = 11435) -> ThreadingHTTPServer:
+    """Start the server in a background thread, port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.fake_server",
+        description="Ollama stand-in replaying recorded archives or streaming synthetic responses."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--replay", nargs="*", default=[], help="JSON, JSONL or archive files to replay")
+    parser.add_argument("--prompts-file", default=PROMPT_USER_PATH, help="Prompts of the replayed archives")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of synthetic models")
+    parser.add_argument("--rate", type=float, default=20.0, help="Tokens/s of the synthetic models")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token of the synthetic models")
+    parser.add_argument("--load", type=float, default=1.0, help="Seconds to load a synthetic model")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens of a synthetic response")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time scale, 10 replays ten times faster")
+    parser.add_argument("--size", type=float, default=2.0, help="Size of each model in GB")
+    parser.add_argument("--vram", type=float, default=0.0, help="VRAM of the simulated GPU in GB, 0 for no limit")
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama(speed=args.speed, size=int(args.size * 1e9), vram=int(args.vram * 1e9))
+    try:
+        prompts = load_prompts(args.prompts_file)
+    except FileNotFoundError:
+        prompts = {}
+    for path in args.replay:
+        print(f"{path}: {fake.add_replay(path, prompts)} response(s)")
+    fake.add_synthetic(args.synthetic, args.rate, args.latency, args.load, args.tokens)
+    if not fake.models:
+        print("No model: use --replay and/or --synthetic", file=sys.stderr)
+        return 2
+
+    server = serve(fake, args.host, args.port)
+    print(f"Serving {len(fake.models)} model(s) on http://{args.host}:{server.server_port}, use OLLAMA_HOST={args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import argparse
+import base64
+import sqlite3
+import sys
+from contextlib import closing
+
+import pandas as pd
+
+from modules.archive import read_records
+from modules.cache import image_hash
+from variables import HISTORY_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    image_name TEXT,
+    image_sha256 TEXT,
+    temperature REAL,
+    seed INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    date TEXT NOT NULL,
+    model TEXT NOT NULL,
+    model_digest TEXT,
+    prompt TEXT NOT NULL,
+    image_sha256 TEXT,
+    response TEXT,
+    error TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    total_duration INTEGER,
+    load_duration INTEGER,
+    prompt_eval_count INTEGER,
+    prompt_eval_duration INTEGER,
+    eval_count INTEGER,
+    eval_duration INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_model ON results(model, date);
+CREATE INDEX IF NOT EXISTS results_digest ON results(model_digest, date);
+CREATE INDEX IF NOT EXISTS results_prompt ON results(prompt, date);
+CREATE INDEX IF NOT EXISTS results_image ON results(image_sha256);
+CREATE INDEX IF NOT EXISTS results_date ON results(date);
+CREATE INDEX IF NOT EXISTS runs_date ON runs(date);
+"""
+
+PERIODS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+}
+GROUPS = ("model", "model_digest", "prompt", "image_sha256")
+
+
+class HistoryStore:
+    """
+    SQLite store of every run, one row per model / prompt result.
+
+    Args:
+        path (str): Database file, created if it does not exist.
+    """
+
+    def __init__(self, path: str = HISTORY_PATH):
+        self.path = path
+        with closing(self.connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, record: dict) -> int:
+        """Append a record as written by the "Download JSON" button, returns the id of the run."""
+        image_sha256 = record.get("image_sha256")
+        if image_sha256 is None and record.get("image_data"):
+            image_sha256 = image_hash(base64.b64decode(record["image_data"]))
+        options = record.get("options", {})
+
+        with closing(self.connect()) as connection, connection:
+            run_id = connection.execute(
+                "INSERT INTO runs (date, image_name, image_sha256, temperature, seed) VALUES (?, ?, ?, ?, ?)",
+                (record["date"], record.get("image_name"), image_sha256, options.get("temperature"), options.get("seed"))
+            ).lastrowid
+            connection.executemany(
+                """INSERT INTO results (run_id, date, model, model_digest, prompt, image_sha256, response, error, cached,
+                    total_duration, load_duration, prompt_eval_count, prompt_eval_duration, eval_count, eval_duration)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (
+                        run_id, record["date"], model['name'], model.get("digest"), prompt['prompt'], image_sha256,
+                        prompt.get("response"), prompt.get("error"), int(bool(prompt.get("cached"))),
+                        prompt['done'].get("total_duration"), prompt['done'].get("load_duration"),
+                        prompt['done'].get("prompt_eval_count"), prompt['done'].get("prompt_eval_duration"),
+                        prompt['done'].get("eval_count"), prompt['done'].get("eval_duration"),
+                    )
+                    for model in record["models"] for prompt in model["prompts"]
+                ]
+            )
+        return run_id
+
+    def where(self, model=None, prompt=None, model_digest=None, image_sha256=None,
+              since: str = None, until: str = None, cached: bool = False) -> tuple[str, list]:
+        clauses, params = [], []
+        if not cached:
+            # A cached result repeats the timings and response of an earlier row under a new date.
+            clauses.append("cached = 0")
+        for column, value in (("model", model), ("prompt", prompt), ("model_digest", model_digest),
+                              ("image_sha256", image_sha256)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        if since is not None:
+            clauses.append("date >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("date <= ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit: int = 1000, **filters) -> pd.DataFrame:
+        """
+        Results matching the filters, most recent first.
+
+        Args:
+            limit (int): Maximum number of rows.
+            **filters: model, prompt, model_digest, image_sha256 (a value or a
+                list of values), since and until (dates as YYYY-MM-DD[ HH:MM:SS]),
+                cached (include the results served from the response cache, False by default).
+        """
+        where, params = self.where(**filters)
+        with closing(self.connect()) as connection:
+            return pd.read_sql_query(
+                f"SELECT * FROM results{where} ORDER BY date DESC LIMIT ?", connection, params=params + [limit]
+            )
+
+    def aggregate(self, by: tuple[str] = ("model", "prompt"), period: str = None, **filters) -> pd.DataFrame:
+        """
+        Mean statistics of the results matching the filters, computed by SQLite.
+
+        Args:
+            by (tuple[str]): Columns to group by, among model, model_digest, prompt and image_sha256.
+            period (str): Also group by day, week or month.
+            **filters: See query().
+
+        Returns:
+            pd.DataFrame: One row per group with the number of results, the
+                number of errors, the mean durations in seconds and the mean tokens/s.
+        """
+        columns = [column for column in by if column in GROUPS]
+        if period is not None:
+            columns = [f"strftime('{PERIODS[period]}', date) AS period"] + columns
+        groups = ", ".join(column.split(" AS ")[-1] for column in columns)
+        where, params = self.where(**filters)
+
+        sql = f"""
+            SELECT {', '.join(columns) + ',' if columns else ''}
+                COUNT(*) AS count,
+                SUM(error IS NOT NULL) AS errors,
+                AVG(total_duration) / 1e9 AS total_duration,
+                AVG(load_duration) / 1e9 AS load_duration,
+                AVG(prompt_eval_duration) / 1e9 AS prompt_eval_duration,
+                AVG(eval_duration) / 1e9 AS eval_duration,
+                AVG(eval_count * 1e9 / NULLIF(eval_duration, 0)) AS tokens_per_second
+            FROM results{where}
+            {f'GROUP BY {groups} ORDER BY {groups}' if groups else ''}
+        """
+        with closing(self.connect()) as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    def version(self) -> int:
+        """Id of the last result, it changes when results are added."""
+        with closing(self.connect()) as connection:
+            return connection.execute("SELECT MAX(id) FROM results").fetchone()[0] or 0
+
+    def distinct(self, column: str) -> list:
+        if column not in GROUPS:
+            raise ValueError(f"Unknown column: {column}")
+        with closing(self.connect()) as connection:
+            return [row[0] for row in connection.execute(f"SELECT DISTINCT {column} FROM results ORDER BY {column}")]
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.history",
+        description="Import JSON, JSONL results or archives into the run history."
+    )
+    parser.add_argument("inputs", nargs="+", help="JSON, JSONL or archive files")
+    parser.add_argument("--db", default=HISTORY_PATH, help="History database (default: history.db)")
+    args = parser.parse_args(argv)
+
+    history = HistoryStore(args.db)
+    count = 0
+    for path in args.inputs:
+        for record in read_records(path, images=False):
+            history.add(record)
+            count += 1
+    print(f"{count} run(s) imported into {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import threading
+
+import ollama
+
+from modules.scheduler import ResidencyScheduler, full_name
+from variables import OLLAMA_HOSTS
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def parse_hosts(hosts: str) -> list[str]:
+    """Hosts of a comma or space separated list."""
+    return [host for host in hosts.replace(",", " ").split() if host]
+
+def get_client(host: str = None) -> ollama.Client:
+    """One client per host, shared so each host keeps its pool of HTTP connections."""
+    with _clients_lock:
+        if host not in _clients:
+            _clients[host] = ollama.Client(host=host)
+        return _clients[host]
+
+
+class HostPool:
+    """
+    Several Ollama servers used by one run.
+
+    Each model is placed on one host for the whole run: a host where it is
+    already loaded (ollama.ps()) if there is one, otherwise the host with the
+    most free memory once the models already placed are counted. Only the
+    hosts that have the model (ollama.list()) are considered, when any has it.
+
+    The pool has the interface of ResidencyScheduler (order, acquire, release,
+    prefetch, finish, drain), each host keeping the models of the run within `budget`.
+
+    A host that cannot be reached is left out of the run (`unreachable`),
+    the pool fails only when none can be reached.
+
+    Args:
+        hosts (list[str]): Ollama hosts, VC_OLLAMA_HOSTS if None.
+        budget (int): Memory budget of each host in bytes, 0 for no limit.
+    """
+
+    def __init__(self, hosts: list[str] = None, budget: int = 0):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.schedulers, self.unreachable = {}, {}
+        for host in hosts or parse_hosts(OLLAMA_HOSTS) or [None]:
+            try:
+                self.schedulers[host] = ResidencyScheduler(budget, client=get_client(host))
+            except Exception as e:
+                self.unreachable[host] = e
+        if not self.schedulers:
+            raise next(iter(self.unreachable.values()))
+        self.hosts = list(self.schedulers)
+        self.placements = {}
+        self.assigned = {host: scheduler.used() for host, scheduler in self.schedulers.items()}
+
+    def client(self, host: str) -> ollama.Client:
+        return get_client(host)
+
+    def free(self, host: str) -> tuple[int, int]:
+        """
+        Free memory of a host, or minus its used memory when there is no budget,
+        then minus the number of models placed on it.
+        """
+        placed = sum(1 for placement in self.placements.values() if placement == host)
+        if self.budget > 0:
+            return self.budget - self.assigned[host], -placed
+        return -self.assigned[host], -placed
+
+    def place(self, model: str) -> str:
+        """Host serving a model during this run."""
+        with self.lock:
+            if model in self.placements:
+                return self.placements[model]
+            name = full_name(model)
+            candidates = [host for host in self.hosts if name in self.schedulers[host].sizes] or self.hosts
+            loaded = [host for host in candidates if name in self.schedulers[host].resident]
+            if loaded:
+                host = max(loaded, key=self.free)
+            else:
+                host = max(candidates, key=self.free)
+                self.assigned[host] += self.schedulers[host].sizes.get(name, 0)
+            self.placements[model] = host
+            return host
+
+    def order(self, models: list[str]) -> list[str]:
+        """Models already in memory on any host first."""
+        resident = {model for scheduler in self.schedulers.values() for model in scheduler.resident}
+        return [model for model in models if full_name(model) in resident] + \
+            [model for model in models if full_name(model) not in resident]
+
+    def acquire(self, model: str) -> None:
+        self.schedulers[self.place(model)].acquire(model)
+
+    def release(self, model: str) -> None:
+        self.schedulers[self.place(model)].release(model)
+
+    def prefetch(self, model: str) -> bool:
+        return self.schedulers[self.place(model)].prefetch(model)
+
+    def finish(self, keep_loaded: bool = False) -> None:
+        for scheduler in self.schedulers.values():
+            scheduler.finish(keep_loaded)
+
+    def digests(self, models: list[str] = None) -> dict:
+        """
+        Digest of each model on the host it is placed on, or of every model
+        of every host (the first host listing it) if `models` is None.
+        """
+        if models is None:
+            digests = {}
+            for scheduler in self.schedulers.values():
+                for model, digest in scheduler.digests.items():
+                    digests.setdefault(model, digest)
+            return digests
+        digests = {}
+        for model in models:
+            digest = self.schedulers[self.place(model)].digests.get(full_name(model))
+            if digest is not None:
+                digests[full_name(model)] = digest
+        return digests
+
+    def drain(self) -> dict:
+        """Budget, placements and events of every host since the last call."""
+        events, prefetched = [], []
+        for host, scheduler in self.schedulers.items():
+            drained = scheduler.drain()
+            events.extend({**event, "host": host} for event in drained["events"])
+            prefetched.extend({**prefetch, "host": host} for prefetch in drained["prefetch"]["models"])
+        with self.lock:
+            placements = dict(self.placements)
+        return {
+            "budget": self.budget,
+            "hosts": self.hosts,
+            "unreachable": {host: str(error) for host, error in self.unreachable.items()},
+            "placements": placements,
+            "events": sorted(events, key=lambda event: event['date']),
+            "prefetch": {
+                "models": prefetched,
+                "load_duration": sum(prefetch["load_duration"] or 0 for prefetch in prefetched),
+                "hidden": sum(prefetch["hidden"] for prefetch in prefetched),
+            }
+        }
@@ -0,0 +1,129 @@
+import datetime
+import json
+import os
+import threading
+import uuid
+
+from variables import JOURNAL_PATH
+
+
+class RunJournal:
+    """
+    On-disk journal of a comparison, to resume it after a crash or a disconnection.
+
+    The journal is a JSONL file: a header with everything needed to run the
+    comparison again (models, prompts, options, image), then one line per
+    finished model / prompt cell, each line flushed and synced to disk before
+    the next cell starts. The image is saved next to it. A journal is removed
+    once its run has finished, so the journals left are the unfinished runs.
+
+        <run id>.jsonl
+        <run id>.image
+
+    Args:
+        path (str): Journal file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.image_path = os.path.splitext(path)[0] + ".image"
+        self.lock = threading.Lock()
+        self.checked = False
+
+    @classmethod
+    def create(cls, header: dict, image: bytes, directory: str = JOURNAL_PATH) -> "RunJournal":
+        """
+        Start the journal of a new run.
+
+        Args:
+            header (dict): Description of the run: models, prompts (with their texts), options, image_name, ...
+            image (bytes): Image of the run.
+            directory (str): Directory of the journals.
+        """
+        os.makedirs(directory, exist_ok=True)
+        run_id = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        journal = cls(os.path.join(directory, f"{run_id}.jsonl"))
+        with open(journal.image_path, "wb") as f:
+            f.write(image)
+            f.flush()
+            os.fsync(f.fileno())
+        journal.append({"type": "run", "id": run_id, "date": datetime.datetime.now().isoformat(), **header})
+        return journal
+
+    def append(self, entry: dict) -> None:
+        """Write one line and sync it to disk."""
+        with self.lock, open(self.path, "a+b") as f:
+            if not self.checked:
+                # A line cut by a crash is ended so the next entry starts on its own line.
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                self.checked = True
+            f.write(json.dumps(entry).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, model: str, prompt: str, slot: dict) -> None:
+        """Record a finished cell, failed cells are not recorded so a resume runs them again."""
+        if slot.get("error") is None and slot["done"]:
+            self.append({"type": "cell", "model": model, "prompt": prompt, "slot": slot})
+
+    def read(self) -> tuple[dict, dict[tuple[str, str], dict]]:
+        """
+        Header and finished cells of the run.
+
+        A last line cut by a crash is ignored.
+
+        Returns:
+            tuple: The header and the slot of each finished cell by (model, prompt name).
+        """
+        header, cells = None, {}
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["type"] == "run":
+                    header = entry
+                elif entry["type"] == "cell":
+                    cells[entry["model"], entry["prompt"]] = entry["slot"]
+        return header, cells
+
+    def image(self) -> bytes:
+        with open(self.image_path, "rb") as f:
+            return f.read()
+
+    def remove(self) -> None:
+        """Forget the run, once it has finished."""
+        for path in (self.path, self.image_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def unfinished(directory: str = JOURNAL_PATH) -> list[tuple[RunJournal, dict, int]]:
+    """
+    Journals of the runs that did not finish, most recent first.
+
+    Returns:
+        list: The journal, its header and its number of finished cells.
+    """
+    runs = []
+    try:
+        names = sorted(os.listdir(directory), reverse=True)
+    except FileNotFoundError:
+        return runs
+    for name in names:
+        if not name.endswith(".jsonl"):
+            continue
+        journal = RunJournal(os.path.join(directory, name))
+        try:
+            header, cells = journal.read()
+        except OSError:
+            continue
+        if header is not None and os.path.exists(journal.image_path):
+            runs.append((journal, header, len(cells)))
+    return runs
@@ -0,0 +1,284 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from modules.hosts import get_client, parse_hosts
+from variables import METRICS_ADDRESS, METRICS_PORT, OLLAMA_HOSTS
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def format_bound(value: float) -> str:
+    """Bucket bound (le) in its canonical form, always a float: 1.0, 0.25, +Inf."""
+    return "+Inf" if math.isinf(value) else repr(float(value))
+
+
+class Metric:
+    """
+    Metric family with a fixed set of labels, one value per combination of label values.
+
+    Args:
+        name (str): Name of the family, without the _total suffix of counters.
+        help (str): Description shown by the scrapers.
+        labels (tuple[str]): Names of the labels.
+        unit (str): OpenMetrics unit, which must end the name.
+    """
+    type = "unknown"
+
+    def __init__(self, name: str, help: str, labels: tuple[str] = (), unit: str = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.unit = unit
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self) -> list[str]:
+        lines = [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {escape(self.help)}"]
+        if self.unit:
+            lines.append(f"# UNIT {self.name} {self.unit}")
+        return lines
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return self.header() + self.samples()
+
+
+class Counter(Metric):
+    """Value that only goes up, exposed as <name>_total."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        with self.lock:
+            key = self.key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            return [f"{self.name}_total{format_labels(dict(zip(self.labels, key)))} {format_value(value)}"
+                    for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Value set at any time, e.g. refreshed at each scrape."""
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def clear(self) -> None:
+        """Forget every value, for series that disappear (a model unloaded)."""
+        with self.lock:
+            self.values.clear()
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            return [f"{self.name}{format_labels(dict(zip(self.labels, key)))} {format_value(value)}"
+                    for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets, with their count and sum.
+
+    Args:
+        buckets (tuple[float]): Upper bounds of the buckets, +Inf is added.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str] = (), unit: str = None, buckets: tuple[float] = ()):
+        super().__init__(name, help, labels, unit)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        with self.lock:
+            key = self.key(labels)
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                labels = dict(zip(self.labels, key))
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': format_bound(bound)})} {count}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {counts[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+        return lines
+
+
+class Registry:
+    """Metrics of the process, rendered together in the OpenMetrics text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def on_collect(self, collector: Callable[[], None]) -> None:
+        """Call `collector` before each rendering, to refresh gauges read from elsewhere."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        # One scrape at a time, so the collectors do not interleave.
+        with self.lock:
+            for collector in self.collectors:
+                collector()
+            lines = [line for metric in self.metrics for line in metric.render()]
+        return "\n".join(lines + ["# EOF"]) + "\n"
+
+
+REGISTRY = Registry()
+
+GENERATE_REQUESTS = REGISTRY.register(Counter(
+    "vc_generate_requests", "Generate and chat requests sent to Ollama", ("model", "prompt", "status")))
+GENERATE_LATENCY = REGISTRY.register(Histogram(
+    "vc_generate_latency_seconds", "Wall-clock duration of a generation, from the request to the last chunk",
+    ("model", "prompt"), "seconds", (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)))
+GENERATE_TTFT = REGISTRY.register(Histogram(
+    "vc_generate_ttft_seconds", "Time to the first token of a generation",
+    ("model", "prompt"), "seconds", (0.1, 0.25, 0.5, 1, 2, 5, 10, 30)))
+GENERATE_SPEED = REGISTRY.register(Histogram(
+    "vc_generate_tokens_per_second", "Generation speed reported by Ollama (eval_count / eval_duration)",
+    ("model", "prompt"), None, (1, 2, 5, 10, 20, 30, 50, 75, 100, 200)))
+GENERATE_LOAD = REGISTRY.register(Histogram(
+    "vc_generate_load_duration_seconds", "Time Ollama spent loading the model for a generation",
+    ("model",), "seconds", (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)))
+GENERATE_TOKENS = REGISTRY.register(Counter(
+    "vc_generate_tokens", "Tokens generated", ("model",)))
+
+PULL_REQUESTS = REGISTRY.register(Counter(
+    "vc_pull_requests", "Model pulls finished", ("model", "status")))
+PULL_BYTES = REGISTRY.register(Counter(
+    "vc_pull_bytes", "Bytes downloaded by the model pulls", ("model",), "bytes"))
+PULL_DURATION = REGISTRY.register(Histogram(
+    "vc_pull_duration_seconds", "Duration of a model pull, queue time excluded",
+    ("model", "status"), "seconds", (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)))
+
+OLLAMA_UP = REGISTRY.register(Gauge(
+    "vc_ollama_up", "1 if the Ollama host answered the last scrape, 0 otherwise", ("host",)))
+LOADED_MODELS = REGISTRY.register(Gauge(
+    "vc_loaded_models", "Models loaded on the Ollama host", ("host",)))
+LOADED_SIZE = REGISTRY.register(Gauge(
+    "vc_loaded_model_size_bytes", "Memory used by a loaded model", ("host", "model"), "bytes"))
+LOADED_VRAM = REGISTRY.register(Gauge(
+    "vc_loaded_model_vram_bytes", "Part of a loaded model in VRAM, the rest runs on the CPU", ("host", "model"), "bytes"))
+
+
+def record_generation(model: str, prompt: str, slot: dict) -> None:
+    """Count a generation sent to Ollama, a slot without its done record counts as an error."""
+    done = slot.get("done")
+    if slot.get("error") is not None or not done:
+        GENERATE_REQUESTS.inc(model=model, prompt=prompt, status="error")
+        return
+    GENERATE_REQUESTS.inc(model=model, prompt=prompt, status="success")
+    if done.get("wall_duration") is not None:
+        GENERATE_LATENCY.observe(done["wall_duration"] / 10**9, model=model, prompt=prompt)
+    if done.get("ttft") is not None:
+        GENERATE_TTFT.observe(done["ttft"] / 10**9, model=model, prompt=prompt)
+    if done.get("eval_count") and done.get("eval_duration"):
+        GENERATE_SPEED.observe(done["eval_count"] / done["eval_duration"] * 10**9, model=model, prompt=prompt)
+        GENERATE_TOKENS.inc(done["eval_count"], model=model)
+    if done.get("load_duration") is not None:
+        GENERATE_LOAD.observe(done["load_duration"] / 10**9, model=model)
+
+def record_pull(model: str, status: str, completed: int, duration: float) -> None:
+    """Count a finished pull ("done" or "error") with the bytes it downloaded."""
+    PULL_REQUESTS.inc(model=model, status=status)
+    PULL_BYTES.inc(completed, model=model)
+    PULL_DURATION.observe(duration, model=model, status=status)
+
+def collect_loaded(hosts: list[str] = None) -> None:
+    """Refresh the gauges of the loaded models from ollama.ps() of each host."""
+    hosts = hosts or parse_hosts(OLLAMA_HOSTS) or [None]
+    LOADED_SIZE.clear()
+    LOADED_VRAM.clear()
+    for host in hosts:
+        label = host or "default"
+        try:
+            models = get_client(host).ps()['models']
+        except Exception:
+            OLLAMA_UP.set(0, host=label)
+            LOADED_MODELS.set(0, host=label)
+            continue
+        OLLAMA_UP.set(1, host=label)
+        LOADED_MODELS.set(len(models), host=label)
+        for model in models:
+            LOADED_SIZE.set(model['size'], host=label, model=model['model'])
+            LOADED_VRAM.set(model.get('size_vram') or 0, host=label, model=model['model'])
+
+REGISTRY.on_collect(collect_loaded)
+
+
+def make_handler(registry: Registry) -> type:
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_server(port: int = METRICS_PORT, address: str = METRICS_ADDRESS,
+                 registry: Registry = REGISTRY) -> ThreadingHTTPServer | None:
+    """
+    Serve /metrics in a background thread, once per process.
+
+    Args:
+        port (int): Port of the exporter, 0 to disable it.
+        address (str): Interface to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The server, None when disabled.
+    """
+    global _server
+    if port <= 0:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((address, port), make_handler(registry))
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
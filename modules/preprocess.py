@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import threading
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+
+@dataclass
+class PreparedImage:
+    """
+    Image as sent to Ollama.
+
+    Attributes:
+        data (str): Base64 payload, passed as is to the ollama client.
+        sha256 (str): SHA-256 of the image bytes sent.
+        settings (dict): Size and encoding of the image.
+    """
+    data: str
+    sha256: str
+    settings: dict
+
+def prepare_image(image: bytes, max_side: int = 0, format: str = None, quality: int = 90) -> PreparedImage:
+    """
+    Downscale an image so its longest side is at most max_side and encode it in base64.
+
+    Args:
+        image (bytes): Original image.
+        max_side (int): Longest side in pixels, 0 to keep the original image.
+        format (str): JPEG or PNG, the original format if None.
+        quality (int): JPEG quality.
+    """
+    settings = {"max_side": max_side, "original_bytes": len(image)}
+    data = image
+
+    if max_side > 0 or format is not None:
+        with Image.open(BytesIO(image)) as original:
+            width, height = original.size
+            settings.update({"original_width": width, "original_height": height})
+
+            if max(width, height) <= max_side and format in (None, original.format):
+                settings.update({"width": width, "height": height, "format": original.format})
+            else:
+                resized = ImageOps.exif_transpose(original)
+                if max_side > 0:
+                    resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+                format = format or original.format or "PNG"
+                if format == "JPEG" and resized.mode not in ("RGB", "L"):
+                    resized = resized.convert("RGB")
+                buffer = BytesIO()
+                resized.save(buffer, format=format, quality=quality)
+                data = buffer.getvalue()
+                settings.update({"width": resized.width, "height": resized.height, "format": format})
+                if format == "JPEG":
+                    settings["quality"] = quality
+
+    settings["bytes"] = len(data)
+    return PreparedImage(
+        data=base64.b64encode(data).decode("utf-8"),
+        sha256=hashlib.sha256(data).hexdigest(),
+        settings=settings
+    )
+
+def thumbnail(image: bytes, side: int = 256) -> bytes | None:
+    """Small JPEG preview of an image, None if the image cannot be decoded."""
+    try:
+        return base64.b64decode(prepare_image(image, side, "JPEG", 80).data)
+    except (OSError, ValueError):
+        return None
+
+
+class ImagePipeline:
+    """
+    Decode an image once and reuse its encoded payload for every request of a run.
+
+    Each model gets the image downscaled to its target size: its entry in
+    `per_model` (by name or by name without tag) or `max_side`. One payload
+    is built per target size and shared by the models and prompts using it.
+
+    Args:
+        image (bytes): Original image.
+        max_side (int): Default longest side in pixels, 0 to keep the original image.
+        per_model (dict): Longest side for some models.
+        format (str): JPEG or PNG, the original format if None.
+        quality (int): JPEG quality.
+    """
+
+    def __init__(self, image: bytes, max_side: int = 0, per_model: dict = None,
+                 format: str = None, quality: int = 90):
+        self.image = image
+        self.max_side = max_side
+        self.per_model = per_model or {}
+        self.format = format
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.prepared = {}
+        self.models = {}
+
+    def target(self, model: str) -> int:
+        if model in self.per_model:
+            return self.per_model[model]
+        return self.per_model.get(model.split(':')[0], self.max_side)
+
+    def for_model(self, model: str) -> PreparedImage:
+        target = self.target(model)
+        with self.lock:
+            self.models[model] = target
+            if target not in self.prepared:
+                self.prepared[target] = prepare_image(self.image, target, self.format, self.quality)
+            return self.prepared[target]
+
+    def report(self) -> dict:
+        """Preprocessing settings of the run, saved with the results."""
+        with self.lock:
+            return {
+                "max_side": self.max_side,
+                "format": self.format,
+                "quality": self.quality,
+                "models": {model: self.prepared[target].settings for model, target in self.models.items()},
+            }
@@ -0,0 +1,196 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from variables import PROMPT_DEFAULT_PATH, PROMPT_USER_PATH
+
+FIELDS = ("name", "description", "system", "prompt")
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 10.0, stale: float = 30.0) -> Iterator[None]:
+    """
+    Lock shared by every process using the same file, held by creating `path` exclusively.
+
+    A lock older than `stale` seconds is left by a crashed process and is removed.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Lock held too long: {path}")
+            time.sleep(0.05)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        os.remove(path)
+
+def write_json(path: str, data) -> None:
+    """Write a file atomically: readers see either the old or the new content, never a partial one."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".prompts-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class PromptStore:
+    """
+    Prompts of the user file, indexed by name.
+
+    Every change re-reads the file and writes it under a lock with a
+    write-then-rename, so sessions and processes sharing the file do not
+    overwrite each other's changes. The file is read again only when it has
+    changed on disk. Each saved or deleted version of a prompt is appended to a
+    history file next to it.
+
+    Args:
+        path (str): Prompts file, created from `default_path` if it does not exist.
+        default_path (str): Default prompts.
+    """
+
+    def __init__(self, path: str = PROMPT_USER_PATH, default_path: str = PROMPT_DEFAULT_PATH):
+        self.path = path
+        self.default_path = default_path
+        self.history_path = os.path.splitext(path)[0] + ".history.jsonl"
+        self.lock_path = path + ".lock"
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.prompts = []
+        self.index = {}
+
+    def defaults(self) -> list[dict]:
+        try:
+            with open(self.default_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def load(self) -> None:
+        """Read the file if it changed since the last read."""
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                with file_lock(self.lock_path):
+                    if not os.path.exists(self.path):
+                        write_json(self.path, self.defaults())
+                stat = os.stat(self.path)
+            # Each write renames a new file over the old one, so the inode changes too.
+            mtime = (stat.st_ino, stat.st_mtime_ns)
+            if mtime == self.mtime:
+                return
+            with open(self.path, "r") as f:
+                self.prompts = json.load(f)
+            self.index = {prompt['name']: prompt for prompt in self.prompts}
+            self.mtime = mtime
+
+    def all(self) -> list[dict]:
+        self.load()
+        return [dict(prompt) for prompt in self.prompts]
+
+    def names(self) -> list[str]:
+        self.load()
+        return [prompt['name'] for prompt in self.prompts]
+
+    def get(self, name: str) -> dict | None:
+        self.load()
+        prompt = self.index.get(name)
+        return dict(prompt) if prompt is not None else None
+
+    @contextmanager
+    def update(self) -> Iterator[list[dict]]:
+        """Prompts to modify in place, written back when the block exits without error."""
+        with self.lock, file_lock(self.lock_path):
+            self.mtime = None
+            try:
+                with open(self.path, "r") as f:
+                    prompts = json.load(f)
+            except FileNotFoundError:
+                prompts = self.defaults()
+            yield prompts
+            write_json(self.path, prompts)
+
+    def record(self, action: str, name: str, prompt: dict = None, previous: str = None) -> None:
+        entry = {
+            "date": datetime.datetime.now().isoformat(),
+            "action": action,
+            "name": name,
+            "prompt": prompt,
+        }
+        if previous is not None:
+            entry["previous"] = previous
+        with open(self.history_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def put(self, prompt: dict, previous: str = None) -> None:
+        """
+        Add a prompt or replace the prompt named `previous` (its own name if None).
+
+        Raises:
+            ValueError: If the name is empty, or if a prompt is renamed to the name of another prompt.
+        """
+        prompt = {field: prompt.get(field, "") for field in FIELDS}
+        if len(prompt['name'].strip()) == 0:
+            raise ValueError("Name cannot be empty")
+        previous = previous or prompt['name']
+        with self.update() as prompts:
+            names = [item['name'] for item in prompts]
+            if prompt['name'] != previous and prompt['name'] in names:
+                raise ValueError(f"Prompt with name {prompt['name']} already exists")
+            if previous in names:
+                prompts[names.index(previous)] = prompt
+            else:
+                prompts.append(prompt)
+            if prompt['name'] != previous:
+                self.record("rename", prompt['name'], previous=previous)
+            self.record("save", prompt['name'], prompt)
+
+    def delete(self, name: str) -> None:
+        with self.update() as prompts:
+            prompts[:] = [prompt for prompt in prompts if prompt['name'] != name]
+            self.record("delete", name)
+
+    def reset(self) -> None:
+        """Replace every prompt with the default prompts."""
+        with self.update() as prompts:
+            for prompt in prompts:
+                self.record("delete", prompt['name'])
+            prompts[:] = self.defaults()
+            for prompt in prompts:
+                self.record("save", prompt['name'], prompt)
+
+    def history(self) -> dict[str, list[dict]]:
+        """Saved versions of each prompt, most recent first, following renames."""
+        versions = {}
+        try:
+            with open(self.history_path, "r") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry['action'] == "rename":
+                        versions[entry['name']] = versions.pop(entry['previous'], [])
+                    elif entry['prompt'] is not None:
+                        versions.setdefault(entry['name'], []).insert(0, entry)
+        except FileNotFoundError:
+            pass
+        return versions
@@ -0,0 +1,126 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import ollama
+
+from modules.metrics import record_pull
+from variables import PULL_CONCURRENCY
+
+
+def format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class PullManager:
+    """
+    Queue of model pulls downloaded in the background.
+
+    At most `concurrency` models are downloaded at the same time, the others
+    wait in the queue. The progress of each pull (bytes, throughput and ETA) is
+    published at most once per `interval` seconds, the UI reads it with jobs().
+
+    Args:
+        client (ollama.Client): Client to use, the default ollama client if None.
+        concurrency (int): Models downloaded at the same time.
+        interval (float): Seconds between two progress updates of a pull.
+        on_done (Callable): Called with the model name when a pull succeeds.
+    """
+
+    def __init__(self, client: ollama.Client = None, concurrency: int = PULL_CONCURRENCY, interval: float = 0.5,
+                 on_done: Callable[[str], None] = None):
+        self.client = client or ollama
+        self.interval = interval
+        self.on_done = on_done
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="pull")
+        self.lock = threading.Lock()
+        self.pulls = {}
+        self.next_id = 0
+
+    def submit(self, model: str) -> dict:
+        """Queue a pull, the pending pull of the same model if there is one."""
+        with self.lock:
+            for job in self.pulls.values():
+                if job['model'] == model and job['status'] in ("queued", "running"):
+                    return dict(job)
+            job = {
+                "id": self.next_id,
+                "model": model,
+                "status": "queued",
+                "step": "",
+                "total": 0,
+                "completed": 0,
+                "speed": 0.0,
+                "eta": None,
+                "error": None,
+                "queued_at": time.time(),
+                "finished_at": None,
+            }
+            self.pulls[job['id']] = job
+            self.next_id += 1
+        self.executor.submit(self.run, job['id'])
+        return dict(job)
+
+    def publish(self, job_id: int, **values) -> None:
+        with self.lock:
+            self.pulls[job_id].update(values)
+
+    def run(self, job_id: int) -> None:
+        model = self.pulls[job_id]['model']
+        self.publish(job_id, status="running")
+        layers = {}
+        started = time.monotonic()
+        last_time, last_completed, speed = started, 0, 0.0
+        try:
+            for chunk in self.client.pull(model=model, stream=True):
+                if chunk.get('digest') and chunk.get('total'):
+                    layers[chunk['digest']] = (chunk['total'], chunk.get('completed') or 0)
+                now = time.monotonic()
+                if now - last_time < self.interval:
+                    continue
+
+                total = sum(size for size, _ in layers.values())
+                completed = sum(done for _, done in layers.values())
+                current = max(0, completed - last_completed) / (now - last_time)
+                # Smoothed so the ETA does not jump with every update.
+                speed = current if speed == 0 else 0.3 * current + 0.7 * speed
+                self.publish(
+                    job_id, step=chunk['status'], total=total, completed=completed, speed=speed,
+                    eta=(total - completed) / speed if speed > 0 else None
+                )
+                last_time, last_completed = now, completed
+
+            total = sum(size for size, _ in layers.values())
+            self.publish(job_id, status="done", step="success", total=total, completed=total, eta=0,
+                         finished_at=time.time())
+            record_pull(model, "done", total, time.monotonic() - started)
+        except Exception as e:
+            # Any failure ends the job, otherwise it would stay "running".
+            self.publish(job_id, status="error", error=str(e) or type(e).__name__, finished_at=time.time())
+            record_pull(model, "error", sum(done for _, done in layers.values()), time.monotonic() - started)
+            return
+
+        if self.on_done is not None:
+            try:
+                self.on_done(model)
+            except Exception:
+                pass
+
+    def jobs(self) -> list[dict]:
+        """Copy of every pull, oldest first."""
+        with self.lock:
+            return [dict(job) for job in self.pulls.values()]
+
+    def active(self) -> bool:
+        with self.lock:
+            return any(job['status'] in ("queued", "running") for job in self.pulls.values())
+
+    def clear(self) -> None:
+        """Forget the finished pulls."""
+        with self.lock:
+            self.pulls = {job_id: job for job_id, job in self.pulls.items() if job['status'] in ("queued", "running")}
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import ollama
+
+from modules.hosts import get_client
+from variables import MODELS_AVAILABLE_PATH, REGISTRY_TTL
+
+
+def read_overrides(models_list: str) -> set:
+    """Model names listed in models.txt, an empty set if the file does not exist."""
+    try:
+        with open(models_list, "r") as f:
+            return {line.strip() for line in f if line.strip() and not line.startswith("#")}
+    except FileNotFoundError:
+        return set()
+
+def detect_vision(show: ollama.ShowResponse) -> bool:
+    """
+    Vision support from the metadata of ollama.show().
+
+    Recent Ollama versions list 'vision' in the capabilities, older ones only
+    expose the projector (clip) of the model in its families or metadata.
+    """
+    if show.capabilities is not None and "vision" in show.capabilities:
+        return True
+    if show.details is not None and "clip" in (show.details.families or []):
+        return True
+    return any(".vision." in key or key.startswith("clip.") for key in (show.modelinfo or {}))
+
+
+class ModelRegistry:
+    """
+    Models available on the Ollama server, fetched with one ollama.list() call.
+
+    With several hosts, the models of every host that answers are listed,
+    a host that cannot be reached is skipped unless none can be.
+
+    Models are indexed by name and by digest. Vision support is detected with
+    ollama.show() once per digest; the names listed in models.txt are always
+    considered vision models. The list is refreshed in the background when it
+    is older than `ttl` seconds.
+
+    Args:
+        client (ollama.Client): Client to use, the default ollama client if None.
+        ttl (float): Seconds before the list is refreshed.
+        models_list (str): Optional override list of vision models.
+        hosts (list[str]): Ollama hosts to list the models of, instead of `client`.
+    """
+
+    def __init__(self, client: ollama.Client = None, ttl: float = REGISTRY_TTL,
+                 models_list: str = MODELS_AVAILABLE_PATH, hosts: list[str] = None):
+        self.clients = [get_client(host) for host in hosts] if hosts else [client or ollama]
+        self.ttl = ttl
+        self.models_list = models_list
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.fetched_at = 0.0
+        self.by_name = {}
+        self.by_digest = {}
+        self.listed = {}
+        self.vision = {}
+        self.refresh()
+
+    def is_vision(self, model: dict, client: ollama.Client) -> bool:
+        if model['model'].split(':')[0] in self.overrides:
+            return True
+        if model['digest'] not in self.vision:
+            try:
+                self.vision[model['digest']] = detect_vision(client.show(model['model']))
+            except ollama.ResponseError:
+                return False
+        return self.vision[model['digest']]
+
+    def refresh(self) -> None:
+        """Fetch the list of models now."""
+        self.overrides = read_overrides(self.models_list)
+        listed, by_name, errors = {}, {}, []
+        for client in self.clients:
+            try:
+                models = client.list()['models']
+            except Exception as e:
+                errors.append(e)
+                continue
+            for model in models:
+                if model['model'] in listed:
+                    continue
+                listed[model['model']] = model['digest']
+                if self.is_vision(model, client):
+                    by_name[model['model']] = model
+        if len(errors) == len(self.clients):
+            raise errors[0]
+        by_digest = {model['digest']: model for model in by_name.values()}
+        with self.lock:
+            self.by_name, self.by_digest, self.listed = by_name, by_digest, listed
+            self.fetched_at = time.monotonic()
+            self.refreshing = False
+
+    def refresh_model(self, name: str) -> None:
+        """Refresh after one model was pulled, updated or deleted."""
+        with self.lock:
+            old = self.by_name.get(name)
+            if old is not None:
+                self.vision.pop(old['digest'], None)
+        self.refresh()
+
+    def check(self) -> None:
+        """Start a background refresh if the list is older than the TTL."""
+        with self.lock:
+            if self.refreshing or time.monotonic() - self.fetched_at < self.ttl:
+                return
+            self.refreshing = True
+
+        def run() -> None:
+            try:
+                self.refresh()
+            except Exception:
+                with self.lock:
+                    self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def models(self) -> list[dict]:
+        self.check()
+        return list(self.by_name.values())
+
+    def get(self, name: str) -> dict | None:
+        self.check()
+        return self.by_name.get(name)
+
+    def get_by_digest(self, digest: str) -> dict | None:
+        self.check()
+        return self.by_digest.get(digest)
+
+    def digests(self) -> dict:
+        """Digest of every model on the servers, with or without vision support."""
+        self.check()
+        return dict(self.listed)
@@ -0,0 +1,236 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+import ollama
+
+
+def full_name(model: str) -> str:
+    """Name of a model as listed by Ollama, with its tag."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ResidencyScheduler:
+    """
+    Keep the models of a run in memory within a memory budget.
+
+    The scheduler starts from the models reported by ollama.ps(). Before a
+    model is used it must be acquired: if it does not fit in the budget, the
+    least recently used models that are not in use are unloaded first. Every
+    load and eviction decision is recorded as an event.
+
+    The next model of a run can be prefetched: it is loaded in the background
+    while the current one generates, when it fits without evicting anything.
+
+    Models can be given with or without their tag, they are tracked by the
+    name Ollama lists them with (llava is llava:latest). A model that ps()
+    does not list once it is released (every request failed) is dropped, and
+    a failed unload is recorded as an "unload_error" event.
+
+    Args:
+        budget (int): Memory budget in bytes, 0 for no limit.
+        client (ollama.Client): Client to use, the default ollama client if None.
+    """
+
+    def __init__(self, budget: int = 0, client: ollama.Client = None):
+        self.budget = budget
+        self.client = client or ollama
+        self.condition = threading.Condition()
+        self.resident = OrderedDict()
+        self.in_use = {}
+        self.loaded = []
+        self.events = []
+        self.prefetching = {}
+        self.prefetched = []
+        listed = self.client.list()['models']
+        self.sizes = {model['model']: model['size'] for model in listed}
+        self.digests = {model['model']: model['digest'] for model in listed}
+        for model in self.client.ps()['models']:
+            self.resident[model['model']] = model['size']
+
+    def used(self) -> int:
+        return sum(self.resident.values())
+
+    def order(self, models: list[str]) -> list[str]:
+        """Models already in memory first, so that each model is loaded once."""
+        return [model for model in models if full_name(model) in self.resident] + \
+            [model for model in models if full_name(model) not in self.resident]
+
+    def record(self, action: str, model: str, **kwargs) -> None:
+        self.events.append({
+            "action": action,
+            "model": model,
+            "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "used": self.used(),
+            **kwargs
+        })
+
+    def evict(self, model: str, reason: str) -> int:
+        """Forget a resident model, with the condition held, unload() must then be called without it."""
+        size = self.resident.pop(model, 0)
+        self.record(reason, model, size=size)
+        return size
+
+    def unload(self, model: str, reason: str) -> None:
+        """Ask the server to unload a model, a failure is recorded as an event."""
+        try:
+            self.client.generate(model=model, keep_alive=0)
+        except (ollama.ResponseError, ConnectionError) as e:
+            with self.condition:
+                self.record("unload_error", model, reason=reason, error=str(e))
+
+    def fits(self, size: int) -> bool:
+        return self.budget <= 0 or self.used() + size <= self.budget
+
+    def acquire(self, model: str) -> None:
+        """
+        Reserve a model before sending it requests.
+
+        Waits while the model does not fit and other models are still in use.
+        When nothing else is in use the model is loaded even over budget.
+        """
+        model = full_name(model)
+        acquired = False
+        while not acquired:
+            evicted = []
+            with self.condition:
+                if model in self.prefetching:
+                    self.wait_prefetch(model)
+                if model in self.resident:
+                    self.resident.move_to_end(model)
+                    acquired = True
+                else:
+                    size = self.sizes.get(model, 0)
+                    for candidate in list(self.resident):
+                        if self.fits(size):
+                            break
+                        if not self.in_use.get(candidate):
+                            self.evict(candidate, "evict")
+                            evicted.append(candidate)
+
+                    busy = any(self.in_use.values())
+                    if self.fits(size) or not busy:
+                        self.resident[model] = size
+                        self.loaded.append(model)
+                        self.record("load", model, size=size, over_budget=not self.fits(0))
+                        acquired = True
+                    elif not evicted:
+                        self.condition.wait()
+                if acquired:
+                    self.in_use[model] = self.in_use.get(model, 0) + 1
+            # The server calls are made without the condition, so the other workers are not blocked.
+            for candidate in evicted:
+                self.unload(candidate, "evict")
+
+    def prefetch(self, model: str) -> bool:
+        """
+        Load a model in the background if it fits in the budget as it is.
+
+        Returns:
+            bool: Whether the model is being loaded.
+        """
+        model = full_name(model)
+        with self.condition:
+            if model in self.resident or model in self.prefetching:
+                return False
+            size = self.sizes.get(model, 0)
+            if not self.fits(size):
+                self.record("skip_prefetch", model, size=size)
+                return False
+            self.resident[model] = size
+            self.loaded.append(model)
+            # In use while it loads, so it is not evicted.
+            self.in_use[model] = self.in_use.get(model, 0) + 1
+            self.prefetching[model] = {"start": time.perf_counter_ns(), "end": None, "load_duration": None}
+
+        def run() -> None:
+            load_duration, failed = None, False
+            try:
+                load_duration = self.client.generate(model=model, keep_alive=-1)['load_duration']
+            except Exception:
+                failed = True
+            with self.condition:
+                self.prefetching[model].update(end=time.perf_counter_ns(), load_duration=load_duration)
+                self.in_use[model] -= 1
+                if failed:
+                    # Not loaded: acquire() loads it again, finish() does not unload it.
+                    self.forget(model)
+                self.record("prefetch", model, size=size, load_duration=load_duration)
+                self.condition.notify_all()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def wait_prefetch(self, model: str) -> None:
+        """Wait for the prefetch of a model, with the condition held, and record the load time hidden."""
+        start = time.perf_counter_ns()
+        while self.prefetching[model]["end"] is None:
+            self.condition.wait()
+        prefetch = self.prefetching.pop(model)
+        waited = time.perf_counter_ns() - start
+        hidden = max(0, (prefetch["load_duration"] or 0) - waited)
+        self.prefetched.append({"model": model, "load_duration": prefetch["load_duration"], "waited": waited, "hidden": hidden})
+        self.record("prefetch_used", model, waited=waited, hidden=hidden)
+
+    def release(self, model: str) -> None:
+        model = full_name(model)
+        with self.condition:
+            self.in_use[model] -= 1
+            idle = self.in_use[model] == 0
+            self.condition.notify_all()
+        if not idle:
+            return
+
+        # Use the real size of the loaded model from now on, asked without
+        # holding the lock so a slow server does not block the other workers.
+        try:
+            loaded = {loaded['model']: loaded['size'] for loaded in self.client.ps()['models']}
+        except (ollama.ResponseError, ConnectionError):
+            return
+        with self.condition:
+            if self.in_use.get(model) or model not in self.resident:
+                return
+            if model in loaded:
+                self.resident[model] = loaded[model]
+            else:
+                # No request succeeded (unknown model, error): it is not in memory.
+                self.forget(model)
+                self.record("not_loaded", model)
+            self.condition.notify_all()
+
+    def forget(self, model: str) -> None:
+        """Drop a model that is not in memory after all, with the condition held."""
+        self.resident.pop(model, None)
+        self.loaded = [loaded for loaded in self.loaded if loaded != model]
+
+    def finish(self, keep_loaded: bool = False) -> None:
+        """Unload every model loaded by the run, unless keep_loaded is set."""
+        unloaded = []
+        with self.condition:
+            while any(prefetch["end"] is None for prefetch in self.prefetching.values()):
+                self.condition.wait()
+            if not keep_loaded:
+                for model in self.loaded:
+                    if model in self.resident and not self.in_use.get(model):
+                        self.evict(model, "unload")
+                        unloaded.append(model)
+            self.loaded = []
+            self.prefetching = {}
+        for model in unloaded:
+            self.unload(model, "unload")
+
+    def drain(self) -> dict:
+        """Return the budget, the events and the prefetched models since the last call."""
+        with self.condition:
+            events, self.events = self.events, []
+            prefetched, self.prefetched = self.prefetched, []
+        return {
+            "budget": self.budget,
+            "events": events,
+            "prefetch": {
+                "models": prefetched,
+                "load_duration": sum(prefetch["load_duration"] or 0 for prefetch in prefetched),
+                "hidden": sum(prefetch["hidden"] for prefetch in prefetched),
+            }
+        }
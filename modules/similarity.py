@@ -0,0 +1,137 @@
+from typing import Callable
+
+import altair as alt
+import numpy as np
+import pandas as pd
+from streamlit import cache_data
+
+METHODS = {
+    "tfidf": "TF-IDF cosine",
+    "jaccard": "Token overlap (Jaccard)",
+}
+GROUP = ("image_sha256", "prompt")
+# Responses compared per image and prompt, the number of pairs grows with its square.
+MAX_GROUP = 200
+
+
+def terms(responses: pd.DataFrame) -> pd.DataFrame:
+    """(doc, term, count) table of the lowercased words of each response."""
+    words = responses["response"].fillna("").str.lower().str.findall(r"\w+")
+    words = words.explode().dropna().rename("term").reset_index().rename(columns={"index": "doc"})
+    return words.groupby(["doc", "term"], sort=False).size().rename("count").reset_index()
+
+def similarity_pairs(responses: pd.DataFrame, method: str = "tfidf", by: tuple[str] = GROUP,
+                     max_group: int = MAX_GROUP) -> pd.DataFrame:
+    """
+    Similarity of every pair of responses to the same image and prompt.
+
+    The terms are weighted once for all the responses, then each group is
+    compared as a (response, term) matrix multiplied by its transpose, so the
+    memory used grows with the size of a group and not with the square of its
+    number of shared terms.
+
+    Args:
+        responses (pd.DataFrame): One row per response, with the `by` columns,
+            "model" and "response" (results_frame(responses=True) or HistoryStore.query()).
+        method (str): "tfidf" for the cosine of the TF-IDF vectors (IDF over
+            all the responses), "jaccard" for the share of distinct words in common.
+        by (tuple[str]): Columns of a group of responses to compare.
+        max_group (int): Responses kept per group, the first ones.
+
+    Returns:
+        pd.DataFrame: One row per pair with the `by` columns, model_a, model_b and similarity.
+    """
+    by = list(by)
+    responses = responses[responses["response"].notna()]
+    responses = responses.groupby(by, sort=False).head(max_group).reset_index(drop=True)
+    columns = by + ["model_a", "model_b", "similarity"]
+    if len(responses) < 2:
+        return pd.DataFrame(columns=columns)
+    groups = responses.groupby(by, sort=False).ngroup()
+
+    counts = terms(responses)
+    if method == "jaccard":
+        counts["weight"] = 1.0
+    else:
+        idf = np.log((1 + len(responses)) / (1 + counts.groupby("term")["doc"].nunique())) + 1
+        counts["weight"] = counts["count"] * counts["term"].map(idf)
+        counts["weight"] /= np.sqrt((counts["weight"] ** 2).groupby(counts["doc"]).transform("sum"))
+    docs, codes, weights = counts["doc"].to_numpy(), pd.factorize(counts["term"])[0], counts["weight"].to_numpy()
+    rows_by_group = counts.groupby(counts["doc"].map(groups), sort=False).indices
+
+    firsts, seconds, scores, upper = [], [], [], {}
+    for group, members in groups.groupby(groups, sort=False).indices.items():
+        if len(members) < 2:
+            continue
+        rows = rows_by_group.get(group, np.array([], dtype=int))
+        terms_, term_index = np.unique(codes[rows], return_inverse=True)
+        matrix = np.zeros((len(members), len(terms_)))
+        matrix[np.searchsorted(members, docs[rows]), term_index] = weights[rows]
+        first, second = upper.get(len(members)) or upper.setdefault(len(members), np.triu_indices(len(members), 1))
+        score = (matrix @ matrix.T)[first, second]
+        if method == "jaccard":
+            sizes = matrix.sum(axis=1)
+            union = sizes[first] + sizes[second] - score
+            score = np.divide(score, union, out=np.ones_like(score), where=union > 0)
+        else:
+            score = score.clip(0.0, 1.0)
+        firsts.append(members[first])
+        seconds.append(members[second])
+        scores.append(score)
+    if not scores:
+        return pd.DataFrame(columns=columns)
+
+    first, second = np.concatenate(firsts), np.concatenate(seconds)
+    pairs = responses.loc[first, by].reset_index(drop=True)
+    pairs["model_a"] = responses["model"].to_numpy()[first]
+    pairs["model_b"] = responses["model"].to_numpy()[second]
+    pairs["similarity"] = np.concatenate(scores)
+    return pairs[columns]
+
+def similarity_matrix(pairs: pd.DataFrame, by: str = "prompt") -> pd.DataFrame:
+    """
+    Mean similarity of each pair of models, in both directions, for each `by` value.
+
+    Pairs of responses of the same model (several runs of the same image)
+    make the diagonal, the consistency of the model with itself.
+    """
+    both = pd.concat([
+        pairs,
+        pairs.rename(columns={"model_a": "model_b", "model_b": "model_a"})[pairs["model_a"] != pairs["model_b"]],
+    ], ignore_index=True)
+    return both.groupby([by, "model_a", "model_b"], sort=True)["similarity"].agg(["mean", "count"]).reset_index() \
+        .rename(columns={"mean": "similarity", "count": "pairs"})
+
+def agreement(responses: pd.DataFrame, method: str = "tfidf") -> pd.DataFrame:
+    """
+    similarity_matrix() of the responses, without the cached ones.
+
+    Cached results are copies of earlier responses, they would only inflate the diagonal.
+    """
+    if "cached" in responses:
+        responses = responses[~responses["cached"].fillna(False).astype(bool)]
+    return similarity_matrix(similarity_pairs(responses[["image_sha256", "prompt", "model", "response"]], method))
+
+@cache_data(max_entries=16, show_spinner=False)
+def get_similarity(key: tuple, method: str, _responses: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """
+    agreement() cached by `key`, the values the responses depend on (files,
+    filters), so the responses are only read and hashed when the key changes.
+    """
+    return agreement(_responses(), method)
+
+def heatmap(matrix: pd.DataFrame, by: str = "prompt") -> alt.FacetChart:
+    """Heatmap of a similarity_matrix(), one panel per `by` value."""
+    base = alt.Chart(matrix).encode(
+        x=alt.X("model_b:N", title=None),
+        y=alt.Y("model_a:N", title=None),
+    )
+    cells = base.mark_rect().encode(
+        color=alt.Color("similarity:Q", scale=alt.Scale(domain=[0, 1], scheme="blues"), title="Similarity"),
+        tooltip=["model_a", "model_b", alt.Tooltip("similarity:Q", format=".2f"), "pairs"],
+    )
+    labels = base.mark_text(fontSize=11).encode(
+        text=alt.Text("similarity:Q", format=".2f"),
+        color=alt.condition(alt.datum.similarity > 0.6, alt.value("white"), alt.value("black")),
+    )
+    return alt.layer(cells, labels, data=matrix).facet(facet=alt.Facet(f"{by}:N", title=None), columns=2)
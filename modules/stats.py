@@ -0,0 +1,114 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+# Fields of the done record in nanoseconds, converted to seconds.
+DURATIONS = (
+    "total_duration", "load_duration", "prompt_eval_duration", "eval_duration",
+    "ttft", "wall_duration", "client_overhead", "itl_p50", "itl_p90", "itl_p99", "max_stall",
+)
+COUNTS = ("prompt_eval_count", "eval_count")
+METRICS = DURATIONS + COUNTS + ("tokens_per_second",)
+KEYS = ("run", "date", "image_name", "image_sha256", "mode", "model", "prompt", "host", "cached", "error")
+
+
+def results_frame(records: Iterable[dict], responses: bool = False) -> pd.DataFrame:
+    """
+    One row per record, model and prompt, with every metric as a column.
+
+    Durations are in seconds, the metrics of failed prompts are NaN.
+
+    Args:
+        records (Iterable[dict]): Records as written by the "Download JSON" button.
+        responses (bool): Keep the text of the responses as a "response" column.
+    """
+    records = [{**record, "run": run} for run, record in enumerate(records)]
+    frame = pd.json_normalize(
+        records,
+        record_path=["models", "prompts"],
+        meta=["run", "date", "image_name", "image_sha256", "mode", ["models", "name"]],
+        errors="ignore",
+    )
+    frame = frame.rename(columns={"models.name": "model", **{f"done.{field}": field for field in DURATIONS + COUNTS}})
+    frame = frame.reindex(columns=list(dict.fromkeys(list(frame.columns) + list(KEYS) + list(DURATIONS + COUNTS) + ["response"])))
+
+    failed = frame["error"].notna()
+    frame[list(DURATIONS + COUNTS)] = frame[list(DURATIONS + COUNTS)].astype(float).mask(failed, np.nan)
+    frame[list(DURATIONS)] = frame[list(DURATIONS)] / 10**9
+    frame["tokens_per_second"] = frame["eval_count"] / frame["eval_duration"].replace(0, np.nan)
+    frame["cached"] = frame["cached"].fillna(False).astype(bool)
+    return frame[list(KEYS) + list(METRICS) + (["response"] if responses else [])]
+
+def melt_results(frame: pd.DataFrame) -> pd.DataFrame:
+    """Long table of a results_frame(), every other column (file, ...) is kept as a key."""
+    keys = [column for column in frame.columns if column not in METRICS]
+    return frame.melt(id_vars=keys, value_vars=list(METRICS), var_name="metric", value_name="value").dropna(subset=["value"])
+
+def long_frame(records: Iterable[dict]) -> pd.DataFrame:
+    """Normalized (run, date, image, model, prompt, metric, value) table of records, missing values dropped."""
+    return melt_results(results_frame(records))
+
+def aggregate(long: pd.DataFrame, by: tuple[str] = ("model", "prompt"), metrics: Iterable[str] = None,
+              percentiles: Iterable[int] = (50, 90, 99)) -> pd.DataFrame:
+    """
+    Count, mean, min, max and percentiles of each metric by group.
+
+    Args:
+        long (pd.DataFrame): Table built by long_frame().
+        by (tuple[str]): Columns to group by.
+        metrics (Iterable[str]): Metrics to keep, all of them if None.
+        percentiles (Iterable[int]): Percentiles to compute, as pXX columns.
+
+    Returns:
+        pd.DataFrame: One row per group and metric.
+    """
+    if metrics is not None:
+        long = long[long["metric"].isin(list(metrics))]
+    groups = long.groupby(list(by) + ["metric"], sort=True)["value"]
+    summary = groups.agg(["count", "mean", "min", "max"])
+    percentiles = list(percentiles)
+    if percentiles:
+        quantiles = groups.quantile([percentile / 100 for percentile in percentiles]).unstack()
+        quantiles.columns = [f"p{percentile}" for percentile in percentiles]
+        summary = summary.join(quantiles)
+    return summary.reset_index()
+
+def chart_key(name: str) -> str:
+    """Column name usable by st.bar_chart, which reads ':' and '.' as field modifiers."""
+    return name.replace(':', '-').replace('.', '-')
+
+def pivot_metric(long: pd.DataFrame, metric: str, index: str = "prompt", columns: str = "model",
+                 agg: str = "mean") -> tuple[list[str], pd.DataFrame]:
+    """
+    One row per `index` and one column per `columns` value of a metric, for st.bar_chart.
+
+    Returns:
+        tuple: The names of the value columns and the table, `index` as its first column.
+    """
+    values = long[long["metric"] == metric]
+    table = values.pivot_table(index=index, columns=columns, values="value", aggfunc=agg, sort=False)
+    table.columns = [chart_key(str(column)) for column in table.columns]
+    return list(table.columns), table.reset_index()
+
+def telemetry_frame(telemetry: dict) -> tuple[list[str], pd.DataFrame]:
+    """
+    Memory over time of the telemetry of a record, for st.line_chart.
+
+    Memory is in GB: the memory used on the host, then the VRAM of each model,
+    and the part of each model left outside VRAM when it was partly offloaded
+    to the CPU. Times are in seconds since the start of the run.
+
+    Returns:
+        tuple: The names of the memory columns and the table, with its "t" and "cpu" columns first.
+    """
+    frame = pd.DataFrame({"t": telemetry["t"], "cpu": pd.Series(telemetry["host"]["cpu"], dtype=float)})
+    columns = {"Host memory": telemetry["host"]["memory_used"]}
+    for name, series in telemetry["models"].items():
+        size, vram = pd.Series(series["size"], dtype=float), pd.Series(series["size_vram"], dtype=float)
+        columns[f"{name} VRAM"] = vram
+        if name in telemetry.get("offloaded", {}):
+            columns[f"{name} CPU"] = size - vram
+    for name, values in columns.items():
+        frame[chart_key(name)] = pd.Series(values, dtype=float) / 1e9
+    return [chart_key(name) for name in columns], frame
@@ -0,0 +1,179 @@
+import datetime
+import threading
+import time
+
+import ollama
+
+from variables import TELEMETRY_INTERVAL
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def read_proc_stat() -> tuple[int, int] | None:
+    """Idle and total CPU time of the host from /proc/stat (Linux)."""
+    try:
+        with open("/proc/stat", "r") as f:
+            values = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle + iowait
+    return values[3] + (values[4] if len(values) > 4 else 0), sum(values)
+
+def read_meminfo() -> tuple[int, int] | None:
+    """Used and total memory of the host in bytes from /proc/meminfo (Linux)."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            info = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f}
+        return info["MemTotal"] - info["MemAvailable"], info["MemTotal"]
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+class HostMetrics:
+    """CPU and memory of the host, with psutil when it is installed, from /proc otherwise."""
+
+    def __init__(self):
+        self.last = read_proc_stat() if psutil is None else None
+        if psutil is not None:
+            psutil.cpu_percent(None)
+
+    def sample(self) -> dict:
+        """CPU use in percent since the last sample, used and total memory in bytes, None if unknown."""
+        if psutil is not None:
+            memory = psutil.virtual_memory()
+            return {"cpu": psutil.cpu_percent(None), "memory_used": memory.total - memory.available,
+                    "memory_total": memory.total}
+
+        cpu = None
+        current = read_proc_stat()
+        if current is not None and self.last is not None and current[1] > self.last[1]:
+            cpu = 100.0 * (1 - (current[0] - self.last[0]) / (current[1] - self.last[1]))
+        self.last = current
+        memory = read_meminfo()
+        return {"cpu": cpu, "memory_used": memory[0] if memory else None, "memory_total": memory[1] if memory else None}
+
+
+class TelemetrySampler:
+    """
+    Sample the loaded models and the host in the background during a run.
+
+    Every `interval` seconds the sampler records ollama.ps() of each client
+    (memory size and VRAM size of each loaded model) and the CPU and memory of
+    the host the app runs on. The series are kept column by column so they
+    stay small in the result JSON.
+
+    Args:
+        clients (dict): Clients by host, the default ollama client if None.
+        interval (float): Seconds between two samples.
+
+    Example:
+        with TelemetrySampler() as sampler:
+            ...
+        record["telemetry"] = sampler.series()
+    """
+
+    def __init__(self, clients: dict = None, interval: float = TELEMETRY_INTERVAL):
+        self.clients = clients or {None: ollama}
+        self.interval = max(0.1, interval)
+        self.host = HostMetrics()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.start_time = None
+        self.start_date = None
+        self.times = []
+        self.cpu = []
+        self.memory_used = []
+        self.memory_total = None
+        self.models = {}
+
+    def model_name(self, host: str, model: str) -> str:
+        return model if len(self.clients) == 1 else f"{model} ({host})"
+
+    def sample(self) -> None:
+        now = round(time.monotonic() - self.start_time, 3)
+        loaded = {}
+        for host, client in self.clients.items():
+            try:
+                for model in client.ps()['models']:
+                    loaded[self.model_name(host, model['model'])] = (model['size'], model.get('size_vram') or 0)
+            except Exception:
+                # The models of a host that does not answer are missing from this sample.
+                pass
+        host = self.host.sample()
+
+        with self.lock:
+            index = len(self.times)
+            self.times.append(now)
+            self.cpu.append(None if host["cpu"] is None else round(host["cpu"], 1))
+            self.memory_used.append(host["memory_used"])
+            self.memory_total = host["memory_total"] or self.memory_total
+            for name, (size, size_vram) in loaded.items():
+                series = self.models.setdefault(name, {"size": [None] * index, "size_vram": [None] * index})
+                series["size"].append(size)
+                series["size_vram"].append(size_vram)
+            for name, series in self.models.items():
+                if name not in loaded:
+                    series["size"].append(None)
+                    series["size_vram"].append(None)
+
+    def try_sample(self) -> None:
+        """Take a sample, a sample that fails is left out of the series and sampling goes on."""
+        try:
+            self.sample()
+        except Exception:
+            pass
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.try_sample()
+            self.stopped.wait(self.interval)
+
+    def start(self) -> "TelemetrySampler":
+        self.start_time = time.monotonic()
+        self.start_date = datetime.datetime.now().isoformat()
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop sampling, after a last sample."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.try_sample()
+
+    def __enter__(self) -> "TelemetrySampler":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def series(self) -> dict:
+        """
+        Time series of the run, for the result JSON.
+
+        Returns:
+            dict: Start date, interval and times in seconds, host CPU (percent)
+                and memory (bytes), size and VRAM size of each model in bytes
+                (None while it is not loaded), and for each model partly
+                offloaded to the CPU the lowest share of it that was in VRAM.
+        """
+        with self.lock:
+            offloaded = {}
+            for name, series in self.models.items():
+                shares = [vram / size for size, vram in zip(series["size"], series["size_vram"]) if size]
+                if shares and min(shares) < 1:
+                    offloaded[name] = round(min(shares), 3)
+            return {
+                "start": self.start_date,
+                "interval": self.interval,
+                "t": list(self.times),
+                "host": {"cpu": list(self.cpu), "memory_used": list(self.memory_used), "memory_total": self.memory_total},
+                "models": {name: {key: list(values) for key, values in series.items()} for name, series in self.models.items()},
+                "offloaded": offloaded,
+            }
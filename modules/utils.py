@@ -1,10 +1,14 @@
-import os
+from variables import HISTORY_PATH, OLLAMA_HOSTS, PROMPT_DEFAULT_PATH, PROMPT_USER_PATH
+import streamlit as st
+from streamlit import cache_data, cache_resource
 
-import pandas as pd
-from variables import MODELS_AVAILABLE_PATH, PROMPT_USER_PATH
-from streamlit import cache_data
-import ollama
-import json
+from modules.history import HistoryStore
+from modules.hosts import parse_hosts
+from modules.metrics import start_server
+from modules.prompts import PromptStore
+from modules.pulls import PullManager
+from modules.registry import ModelRegistry
+from modules.stats import telemetry_frame
 
 @cache_data
 def get_available_models(models_list: str) -> list:
@@ -13,83 +17,50 @@ def get_available_models(models_list: str) -> list:
             models = f.readlines()
             models = [model.strip() for model in models if not model.startswith("#")]
 
-        return models
+        return [model for model in models if model]
     except FileNotFoundError:
-        raise FileNotFoundError(f"File not found: {models_list}")
-
-@cache_data
-def get_models() -> list:
-    return [model['model'] for model in ollama.list()['models']
-            if model['model'].split(':')[0] in get_available_models(MODELS_AVAILABLE_PATH)]
-
-@cache_data
-def get_sizes() -> list:
-    return [model['size'] for model in ollama.list()['models']
-            if model['model'].split(':')[0] in get_available_models(MODELS_AVAILABLE_PATH)]
-
-@cache_data
-def get_modified_at() -> list:
-    return [model['modified_at'] for model in ollama.list()['models']
-            if model['model'].split(':')[0] in get_available_models(MODELS_AVAILABLE_PATH)]
-
-@cache_data
-def load_prompt(prompt_path: str) -> list:
-    try:
-        with open(prompt_path, "r") as f:
-            prompts = json.load(f)
-        return prompts
-    except FileNotFoundError:
-        print(f"Prompt file not found: {prompt_path}")
         return []
 
-def init_prompts(prompt_path: str, default_path: str) -> None:
-    if not os.path.exists(prompt_path):
-        with open(prompt_path, "w") as f:
-            f.write(json.dumps(load_prompt(default_path)))
-    
-def get_prompt(prompt_name: str) -> str:
-    prompts = load_prompt(PROMPT_USER_PATH)
-    for prompt in prompts:
-        if prompt['name'] == prompt_name:
-            return prompt
-    return {}
+@cache_resource
+def get_registry() -> ModelRegistry:
+    # With several hosts, the models of every host of the pool are listed.
+    hosts = parse_hosts(OLLAMA_HOSTS)
+    return ModelRegistry(hosts=hosts if len(hosts) > 1 else None)
 
-def load_duration(data: dict) -> pd.DataFrame:
-    data_duration = pd.DataFrame(
-        {
-            "models": [model['name'] for model in data['models']],
-            "duration": [model['prompts'][0]['done']['load_duration'] if 'error' not in model['prompts'][0] or model['prompts'][0]['error'] is None else 0 / 10**9 for model in data['models'] ]
-        }
-    )
-    return data_duration
+@cache_resource
+def get_history() -> HistoryStore:
+    return HistoryStore(HISTORY_PATH)
 
-def total_duration(data: dict) -> tuple[list[str], pd.DataFrame]:
-    data_models = {}
-    for model in data['models']:
-        data_models[model['name']] = []
-        for prompt in model['prompts']:
-            data_models[model['name']].append(prompt['done']['eval_duration'] / 10**9 if 'error' not in model['prompts'][0] or model['prompts'][0]['error'] is None else 0)
+@cache_resource
+def get_pull_manager() -> PullManager:
+    return PullManager(on_done=get_registry().refresh_model)
 
-    data_duration = pd.DataFrame(
-        {
-            "col1": [prompt['prompt'] for prompt in data['models'][0]['prompts']]
-        }
-    
-    )
-    data_duration = data_duration.join(pd.DataFrame(data_models))
+@cache_resource
+def get_metrics_server():
+    return start_server()
 
+def get_models() -> list:
+    return [model['model'] for model in get_registry().models()]
+
+@cache_resource
+def get_prompt_store() -> PromptStore:
+    return PromptStore(PROMPT_USER_PATH, PROMPT_DEFAULT_PATH)
 
+def init_prompts(prompt_path: str, default_path: str) -> None:
+    PromptStore(prompt_path, default_path).load()
 
-    if len(data_models) == 1: 
-        key = list(data_models.keys())[0]
-        new_key = key.replace(':', '-')
-        new_key = new_key.replace('.', '-')
-        print(key, new_key)
-        # new_key = "Test"
-        keys = [new_key]
-        data_duration[new_key] = data_duration[key]
-        data_duration.pop(key)
-    else:
-        keys = list(data_models.keys())
+def get_prompt(prompt_name: str) -> dict:
+    return get_prompt_store().get(prompt_name) or {}
 
-    return keys, data_duration
\ No newline at end of file
+def display_telemetry(telemetry: dict | None) -> None:
+    """Memory and host CPU charts of a run, with the models offloaded to the CPU."""
+    if telemetry is None or not telemetry["t"]:
+        return
+    keys_, memory = telemetry_frame(telemetry)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.line_chart(memory, x="t", y=keys_, x_label="Run Time (s)", y_label="Memory (GB)")
+    with col2:
+        st.line_chart(memory, x="t", y="cpu", x_label="Run Time (s)", y_label="Host CPU (%)")
+    for model, share in telemetry["offloaded"].items():
+        st.caption(f":warning: {model} ran partly on the CPU: {share:.0%} of it in VRAM at worst")
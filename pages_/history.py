@@ -0,0 +1,117 @@
+import datetime
+import json
+import streamlit as st
+
+from modules.similarity import METHODS, get_similarity, heatmap
+from modules.utils import get_history
+
+# Most recent results compared by the agreement heatmaps.
+SIMILARITY_LIMIT = 50000
+
+st.write("## :material/history: History")
+
+history = get_history()
+
+models = history.distinct("model")
+prompts = history.distinct("prompt")
+
+if len(models) == 0:
+    st.write("No run yet. Every comparison is added to the history, older JSON files and archives can be imported with `python -m modules.history`.")
+    st.stop()
+
+col1, col2 = st.columns([1, 1], vertical_alignment="top")
+with col1:
+    models_selected = st.multiselect("Model(s)", options=models, placeholder="All models", key="history_models")
+with col2:
+    prompts_selected = st.multiselect("Prompt(s)", options=prompts, placeholder="All prompts", key="history_prompts")
+
+col1, col2 = st.columns([1, 1], vertical_alignment="top")
+with col1:
+    today = datetime.date.today()
+    dates = st.date_input("Dates", value=(today - datetime.timedelta(days=30), today), key="history_dates")
+with col2:
+    period = st.selectbox("Group by", options=["day", "week", "month"], index=0, key="history_period")
+cached = st.toggle("Include cached results", value=False, key="history_cached", help="Results served from the response cache repeat the timings and response of an earlier run")
+
+filters = {
+    "model": models_selected or None,
+    "prompt": prompts_selected or None,
+    "cached": cached,
+}
+if len(dates) == 2:
+    filters["since"] = dates[0].strftime("%Y-%m-%d")
+    filters["until"] = dates[1].strftime("%Y-%m-%d 23:59:59")
+
+summary = history.aggregate(by=("model", "prompt"), **filters)
+
+st.write("---")
+st.write("#### Summary")
+st.dataframe(
+    summary,
+    column_config={
+        "model": "Model",
+        "prompt": "Prompt",
+        "count": st.column_config.NumberColumn("Results"),
+        "errors": st.column_config.NumberColumn("Errors"),
+        "total_duration": st.column_config.NumberColumn("Total Duration", format="%.2f s"),
+        "load_duration": st.column_config.NumberColumn("Load Duration", format="%.2f s"),
+        "prompt_eval_duration": st.column_config.NumberColumn("Prompt Eval Duration", format="%.2f s"),
+        "eval_duration": st.column_config.NumberColumn("Eval Duration", format="%.2f s"),
+        "tokens_per_second": st.column_config.NumberColumn("Speed", format="%.2f tokens/s"),
+    },
+    hide_index=True,
+    use_container_width=True
+)
+
+trend = history.aggregate(by=("model",), period=period, **filters)
+if len(trend) > 0:
+    col1, col2 = st.columns(2)
+    with col1:
+        st.line_chart(
+            trend.pivot(index="period", columns="model", values="tokens_per_second"),
+            x_label=f"Speed by {period}",
+            y_label="Tokens/s"
+        )
+    with col2:
+        st.line_chart(
+            trend.pivot(index="period", columns="model", values="total_duration"),
+            x_label=f"Total Duration by {period}",
+            y_label="Time (s)"
+        )
+
+st.write("---")
+st.write("#### Agreement")
+if st.toggle("Compare the responses", value=False, key="history_agreement", help=f"Reads the responses of the {SIMILARITY_LIMIT} most recent results matching the filters"):
+    method = st.segmented_control("Similarity", options=list(METHODS), default="tfidf", format_func=METHODS.get, key="history_similarity", help="Similarity of the responses of each pair of models to the same image and prompt, averaged over the images  \nThe diagonal compares the runs of a model on the same image")
+
+    def responses():
+        results = history.query(limit=SIMILARITY_LIMIT, **{**filters, "cached": False})
+        return results[results["error"].isna()]
+
+    key = ("history", history.path, history.version(), json.dumps(filters, sort_keys=True))
+    matrix = get_similarity(key, method or "tfidf", responses)
+    if len(matrix) == 0:
+        st.write("At least two responses to the same image and prompt are needed")
+    else:
+        st.altair_chart(heatmap(matrix), use_container_width=True)
+
+st.write("---")
+st.write("#### Latest results")
+latest = history.query(limit=100, **filters)
+latest["total_duration"] = latest["total_duration"] / 10**9
+latest["eval_duration"] = latest["eval_duration"] / 10**9
+st.dataframe(
+    latest[["date", "model", "prompt", "total_duration", "eval_count", "eval_duration", "cached", "error"]],
+    column_config={
+        "date": "Date",
+        "model": "Model",
+        "prompt": "Prompt",
+        "total_duration": st.column_config.NumberColumn("Total Duration", format="%.2f s"),
+        "eval_count": st.column_config.NumberColumn("Eval Count"),
+        "eval_duration": st.column_config.NumberColumn("Eval Duration", format="%.2f s"),
+        "cached": st.column_config.CheckboxColumn("Cached"),
+        "error": "Error",
+    },
+    hide_index=True,
+    use_container_width=True
+)
@@ -1,88 +1,50 @@
-import base64
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterator
 import datetime
-from io import BytesIO
-import json
-import random
-import ollama
+import os
+import threading
 import pandas as pd
 import streamlit as st
 
-from variables import PROMPT_DEFAULT_PATH, PROMPT_USER_PATH
-from modules.utils import get_prompt, get_models, load_prompt, load_duration, total_duration
-
-def stream_data():
-    """
-    Stream data from ollama.
-
-    Yields:
-        str: The content of each chunk of data.
-    """
-    try:
-        prompt = st.session_state.prompt
-        if st.session_state.prompt is None or st.session_state.prompt == "":
-            prompt = ' '
-        
-        stream = ollama.generate(
-            model=st.session_state.active_model,
-            system=st.session_state.system,
-            prompt=prompt,
-            images=[st.session_state.image],
-            stream=True,
-            format='',
-            keep_alive=-1,
-            options={
-                "temperature": st.session_state.temperature,
-                "seed": st.session_state.last_seed
-            }
-        )
-        
-        response = ""
-        done = {}
-        for chunk in stream:
-            if chunk.done:
-                st.session_state.done = chunk
-                done['total_duration'] = chunk.total_duration
-                done['load_duration'] = chunk.load_duration
-                done['prompt_eval_count'] = chunk.prompt_eval_count
-                done['prompt_eval_duration'] = chunk.prompt_eval_duration
-                done['eval_count'] = chunk.eval_count
-                done['eval_duration'] = chunk.eval_duration
-
-                st.session_state.response["models"][-1]["prompts"][-1]["response"] = response.strip()
-                st.session_state.response["models"][-1]["prompts"][-1]["done"] = done
-            else:
-                response += chunk.response
-            yield chunk.response
-
-    except ollama.ResponseError as e:
-        st.session_state.done = None
-        st.session_state.response["models"][-1]["prompts"][-1]["error"] = str(e)
-        st.error(f"Error: {e}")
-
-def display_chart(data: dict):
+from variables import (BATCH_PATH, CACHE_MAX_BYTES, CACHE_PATH, IMAGE_MAX_SIDE, MEMORY_BUDGET, MODEL_NATIVE_SIDES,
+                       OLLAMA_HOSTS, STREAM_FLUSH_MS, TELEMETRY_INTERVAL)
+from modules.utils import display_telemetry, get_prompt, get_prompt_store, get_history, get_models, get_registry
+from modules.export import FORMATS, export_file, file_name, formats
+from modules.cache import ResponseCache
+from modules.hosts import HostPool, parse_hosts
+from modules.journal import RunJournal, unfinished
+from modules.scheduler import ResidencyScheduler
+from modules.stats import long_frame, melt_results, pivot_metric, results_frame
+from modules.engine import (BatchProgress, ChunkBuffer, RunSettings, build_options, count_images, count_zip, finalize,
+                            iter_images, iter_zip, load_cached, load_journaled, model_digest, new_model, new_response, new_slot,
+                            prompt_key, resolve_seed, run_batch, run_cells, session_turn, store_cached, stream_prompt, stream_turn)
+
+def display_chart(long: pd.DataFrame, telemetry: dict = None):
     st.write("---")
     st.write("#### Stats")
     col1, col2 = st.columns(2)
     with col1:
-        duration = load_duration(data=data)
+        keys_, duration = pivot_metric(long, "load_duration", index="model", columns="metric", agg="sum")
         st.bar_chart(
-            duration,   
-            x="models",
+            duration,
+            x="model",
+            y=keys_,
             x_label="Model(s) Load Duration",
             y_label="Time (s)",
             horizontal=False
         )
     with col2:
-        keys_, total = total_duration(data=data)
+        keys_, total = pivot_metric(long, "eval_duration")
         st.bar_chart(
             total,
-            x="col1",
+            x="prompt",
             x_label="Prompt(s) Eval Duration",
             y=keys_,
             y_label="Time (s)",
             horizontal=False,
             stack=False,
         )
+    display_telemetry(telemetry)
     st.write("---")
 
 def use_last_seed() -> None:
@@ -98,23 +60,168 @@ def display_options() -> None:
         st.number_input("Seed", min_value=-1, key="seed", help="Seed  \n-1: random seed")
     with col2:
         st.button(":material/sync:", key="button_last_seed", type="primary", use_container_width=True, on_click=use_last_seed, help="Use last seed")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.number_input("Parallel requests", min_value=1, max_value=32, value=1, key="concurrency", help="Generations running at the same time  \n1: one model and one prompt at a time")
+    with col2:
+        st.number_input("Per model", min_value=1, max_value=8, value=1, key="per_model", help="Generations running at the same time on one model  \nSee OLLAMA_NUM_PARALLEL on the Ollama server")
+    st.number_input("Memory budget (GB)", min_value=0.0, value=MEMORY_BUDGET / 1e9, step=1.0, key="memory_budget", help="Memory available for the loaded models, least recently used models are unloaded to stay within it  \n0: no limit")
+    st.toggle("Keep models loaded", value=False, key="keep_loaded", help="Keep the models in memory at the end of the run")
+    st.toggle("Prefetch next model", value=False, key="prefetch", help="Load the next model while the current one generates, when both fit in the memory budget  \nOnly when the models run one after the other (Parallel requests: 1)")
+    st.segmented_control("Mode", options=["generate", "session"], default="generate", key="mode", format_func=str.capitalize, help="Generate: the image is sent with every prompt  \nSession: the image is sent once per model and the prompts follow as the turns of a chat, each answer sees the previous ones")
+    st.toggle("Bypass cache", value=False, key="bypass_cache", help="Generate every response again instead of reusing the cached ones")
+    st.number_input("Max image side (px)", min_value=0, value=IMAGE_MAX_SIDE, step=64, key="max_side", help="Downscale the image before sending it  \n0: original size")
+    st.toggle("Model native size", value=False, key="native_size", help="Downscale the image to the input size of each model")
+    st.segmented_control("Layout", options=["Grid", "List"], default="Grid", key="layout", help="Grid: one column per model and one row per prompt, the generations running at the same time stream side by side  \nList: one model after the other")
+    st.number_input("Refresh interval (ms)", min_value=50, max_value=5000, value=STREAM_FLUSH_MS, step=50, key="flush_interval", help="Time between two refreshes of the grid, tokens received in between are displayed at once")
     st.write("---")
 
 @st.fragment()
-def download_json() -> None:
-    data = json.dumps(st.session_state.response)
+def download_export() -> None:
+    # Read here: the export runs on another thread, without access to the session state.
+    response, image = st.session_state.response, st.session_state.image
+    col1, col2, col3 = st.columns([1, 1, 1], vertical_alignment="bottom")
+    with col1:
+        format = st.selectbox("Format", options=formats(), format_func=lambda name: FORMATS[name][0], key="export_format", help="JSON, JSONL: the full results  \nArchive: compact archive, can be merged with `python -m modules.archive`  \nCSV, Parquet: one row per model and prompt with the metrics and the response")
+    with col2:
+        embed = st.toggle("Include image", value=True, key="export_image", help="Embed the image (base64) in the file")
+    with col3:
+        st.download_button(
+            label=":material/download: Download",
+            data=lambda: export_file([response], format, image=embed, images={response["image_sha256"]: image}),
+            file_name=file_name(f"vision-comparator_{response['date'].replace(' ', '_')}", format),
+            mime=FORMATS[format][2],
+            key="download_export",
+            type="primary",
+            on_click="ignore",
+            help="The file is written when the button is clicked"
+        )
 
-    st.download_button(
-        label=":material/save: Download JSON", 
-        data=data,
-        file_name=f"vision-comparator_{st.session_state.response['date'].replace(' ', '_')}.json", 
-        key="download_json", 
-        type="primary", 
-        help="Download response as JSON"
+def display_prompt(prompt: dict) -> None:
+    with st.expander(prompt['name']):
+        st.write(f"#### {prompt['name']}")
+        st.write(prompt['description'])
+        st.write(f"#### System Prompt")
+        st.write(prompt['system'])
+        st.write(f"#### Prompt")
+        st.write(prompt['prompt'])
+
+def display_done(slot: dict) -> None:
+    if slot.get("error") is not None:
+        st.error(f"Error: {slot['error']}")
+    st.session_state.done = slot["done"] or None
+    st.write("<hr style='margin: 0;'>", unsafe_allow_html=True)
+    if st.session_state.done is not None:
+        cached = " - Cached" if slot.get("cached") else ""
+        if slot.get("resumed"):
+            cached += " - Resumed"
+        if slot.get("host"):
+            cached += f" - {slot['host']}"
+        st.write(f"<p style='color: #999; font-size: .9em; text-align: right;'>Done in {st.session_state.done['total_duration'] / 10**9:.2f}s - Tokens: {st.session_state.done['eval_count']} - Speed {st.session_state.done['eval_count'] / st.session_state.done['eval_duration'] * 10**9:.2f} tokens/s - Seed {st.session_state.last_seed} - Temperature {round(st.session_state.temperature, 2)}{cached}</p>", unsafe_allow_html=True)
+
+def build_settings() -> RunSettings:
+    hosts = None
+    if len(parse_hosts(OLLAMA_HOSTS)) > 1:
+        hosts = scheduler = HostPool(budget=int(st.session_state.memory_budget * 1e9))
+    else:
+        scheduler = ResidencyScheduler(budget=int(st.session_state.memory_budget * 1e9))
+    return RunSettings(
+        concurrency=st.session_state.concurrency,
+        per_model=st.session_state.per_model,
+        scheduler=scheduler,
+        hosts=hosts,
+        cache=ResponseCache(CACHE_PATH, CACHE_MAX_BYTES, bypass=st.session_state.bypass_cache),
+        registry=get_registry(),
+        max_side=st.session_state.max_side,
+        model_sides=MODEL_NATIVE_SIDES if st.session_state.native_size else None,
+        prefetch=st.session_state.prefetch,
+        mode=st.session_state.mode or "generate",
+        telemetry=TELEMETRY_INTERVAL
     )
 
-def free_memory(model: str) -> None:
-    ollama.generate(model=model, keep_alive=0)
+def batch_images(files: list, directory: str) -> Iterator[tuple[str, bytes]]:
+    """Uploaded images and zip files, then the images of the server directory, read one at a time."""
+    for file in files:
+        if file.name.lower().endswith(".zip"):
+            yield from iter_zip(file)
+        else:
+            yield file.name, file.getvalue()
+    if directory:
+        yield from iter_images([directory])
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def count_upload(file_id: str, _file) -> int:
+    return count_zip(_file) if _file.name.lower().endswith(".zip") else 1
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def count_directory(directory: str, mtime: float) -> int:
+    """Images of a directory, counted again when its modification time changes."""
+    return count_images([directory])
+
+def count_batch(files: list, directory: str) -> int:
+    count = sum(count_upload(file.file_id, file) for file in files)
+    if directory and os.path.isdir(directory):
+        count += count_directory(directory, os.path.getmtime(directory))
+    return count
+
+def compare_batch(models: list[str], prompt_names: list[str], files: list, directory: str, total: int) -> None:
+    """
+    Run the models and prompts on every image of the batch.
+
+    Each record is appended to an archive in BATCH_PATH as soon as its image
+    is done, only a summary of each image is kept for the page.
+    """
+    st.session_state.last_seed = resolve_seed(st.session_state.seed)
+    options = build_options(st.session_state.temperature, st.session_state.last_seed)
+    settings = build_settings()
+    settings.history = get_history()
+    selected = [get_prompt(prompt_name) for prompt_name in prompt_names]
+
+    os.makedirs(BATCH_PATH, exist_ok=True)
+    output = os.path.join(BATCH_PATH, f"vision-comparator_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip")
+    progress = BatchProgress(total)
+    bar = st.progress(0.0, text=f"0/{total} image(s)")
+    placeholder_table = st.empty()
+
+    frames, rows = [], []
+    try:
+        for record in run_batch(batch_images(files, directory), models, selected, options, output, settings=settings, progress=progress):
+            frame = results_frame([record])
+            frames.append(frame)
+            rows.append({
+                "image_name": record["image_name"],
+                "errors": int(frame["error"].notna().sum()),
+                "total_duration": frame["total_duration"].sum(),
+                "tokens_per_second": frame["tokens_per_second"].mean(),
+            })
+            bar.progress(min(1.0, progress.done / max(1, total)), text=progress.format())
+            placeholder_table.dataframe(
+                pd.DataFrame(rows),
+                column_config={
+                    "image_name": "Image",
+                    "errors": st.column_config.NumberColumn("Errors"),
+                    "total_duration": st.column_config.NumberColumn("Total Duration", format="%.2f s"),
+                    "tokens_per_second": st.column_config.NumberColumn("Speed", format="%.2f tokens/s"),
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+    finally:
+        settings.scheduler.finish(keep_loaded=st.session_state.keep_loaded)
+
+    if not frames:
+        st.warning("No image found")
+        return
+    st.success(f"{progress.format()} - saved to {output}")
+    st.download_button(
+        label=":material/folder_zip: Download archive",
+        data=lambda: open(output, "rb"),
+        file_name=os.path.basename(output),
+        key="download_batch",
+        type="primary",
+        help="Download the results of every image as a compact archive  \nThe Viewer opens it"
+    )
+    display_chart(melt_results(pd.concat(frames, ignore_index=True)))
 
 if 'done' not in st.session_state:
     st.session_state['done'] = None    
@@ -135,13 +242,12 @@ if 'response' not in st.session_state:
         "models": []
     }
 
-prompts = load_prompt(PROMPT_USER_PATH)
-prompts = [prompt['name'] for prompt in prompts]
+prompts = get_prompt_store().names()
 with st.sidebar:
     
     display_options()
 
-    if "image_uploader" in st.session_state and st.session_state.image_uploader is not None:
+    if not st.session_state.get("batch") and st.session_state.get("image_uploader") is not None:
         st.image(st.session_state.image_uploader)
         st.write("---")
 
@@ -153,80 +259,229 @@ models_selected = st.multiselect("Select model(s)", placeholder="Select model(s)
 col1, col2 = st.columns([1,1], vertical_alignment="top")
 
 with col1:
-    image = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"], key="image_uploader", label_visibility="visible", help="Upload an image")
+    batch = st.toggle("Multiple images", value=False, key="batch", help="Run the comparison on many images, uploaded, as zip files or from a directory of the server  \nThe results are saved in an archive")
+    if batch:
+        image = None
+        images = st.file_uploader("Upload images", type=["jpg", "jpeg", "png", "zip"], accept_multiple_files=True, key="images_uploader", label_visibility="visible", help="Upload images or zip files of images")
+        directory = st.text_input("Server directory", key="image_directory", placeholder="/path/to/images", help="Directory of the server with the images to compare, subdirectories included")
+    else:
+        image = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"], key="image_uploader", label_visibility="visible", help="Upload an image")
 with col2:
     prompts_selected = st.multiselect("Select prompt(s)", placeholder="Select prompt(s)", options=prompts, key="prompt_selected", help="Select prompt(s) to use")
    
+    images_count = count_batch(images or [], directory.strip()) if batch else int(image is not None)
     disabled = True
-    if len(models_selected) > 0 and image is not None and len(prompts_selected) > 0:
+    if len(models_selected) > 0 and images_count > 0 and len(prompts_selected) > 0:
         disabled = False
     compare = st.button(":material/compare_arrows: Compare", disabled=disabled, key="compare", use_container_width=True, type="primary")
-
-if compare:
+    if batch and images_count > 0:
+        st.caption(f"{images_count} image(s)")
+
+resume = None
+runs = unfinished() if not batch else []
+if runs:
+    with st.expander(f":material/history: Unfinished runs ({len(runs)})"):
+        run_index = st.selectbox(
+            "Run",
+            options=range(len(runs)),
+            format_func=lambda n: f"{runs[n][1]['date'][:19].replace('T', ' ')} - {runs[n][1]['image_name']} - {', '.join(runs[n][1]['models'])} - {runs[n][2]}/{len(runs[n][1]['models']) * len(runs[n][1]['prompts'])} done",
+            key="resume_run",
+            help="Comparisons interrupted before the end, the finished results are kept"
+        )
+        col1, col2, _ = st.columns([1, 1, 2])
+        with col1:
+            if st.button(":material/resume: Resume run", key="resume", type="primary", help="Run the missing results only"):
+                resume = runs[run_index]
+        with col2:
+            if st.button(":material/delete: Discard", key="discard_run"):
+                runs[run_index][0].remove()
+                st.rerun()
+
+if compare and batch:
+    compare_batch(models_selected, prompts_selected, images or [], directory.strip(), images_count)
+elif compare or resume is not None:
 
     st.session_state.response = {
         "models": []
     }
 
-    bytes_data = image.getvalue()
-
-    st.session_state.image = bytes_data
-
-    if st.session_state.seed == -1:
-        st.session_state.last_seed = random.randint(0, 2**32 - 1)
+    settings = build_settings()
+    if resume is not None:
+        journal, header, _ = resume
+        bytes_data = journal.image()
+        image_name = header["image_name"]
+        models_run, selected, options = header["models"], header["prompts"], header["options"]
+        st.session_state.last_seed = options["seed"]
+        settings.mode, settings.max_side, settings.model_sides = header["mode"], header["max_side"], header["model_sides"]
     else:
-        st.session_state.last_seed = st.session_state.seed
+        bytes_data = image.getvalue()
+        image_name = image.name
+        models_run, selected = models_selected, [get_prompt(prompt_name) for prompt_name in prompts_selected]
+        st.session_state.last_seed = resolve_seed(st.session_state.seed)
+        options = build_options(st.session_state.temperature, st.session_state.last_seed)
+        journal = RunJournal.create({
+            "image_name": image_name,
+            "models": models_run,
+            "prompts": selected,
+            "options": options,
+            "mode": settings.mode,
+            "max_side": settings.max_side,
+            "model_sides": settings.model_sides,
+        }, bytes_data)
+    prompt_names = [prompt['name'] for prompt in selected]
+    settings.journal = journal
+    journaled = journal.read()[1]
 
-    placeholder_stats = st.empty()
-
-    for model in models_selected:
-        st.session_state.active_model = model
-        st.write(f"### {model}")
-
-        model_object = {
-            "name": model,
-            "prompts": [],
-        }
-        st.session_state.response["models"].append(model_object)
-
-        for prompt_name in prompts_selected:
-
-            st.session_state.response["models"][-1]["prompts"].append(
-                {
-                    "prompt": prompt_name,
-                    "response": None,
-                    "done": {}
-                }
-            )
-
-            prompt = get_prompt(prompt_name)
-            st.session_state.system = prompt['system']
-            st.session_state.prompt = prompt['prompt']
-
-            with st.expander(prompt_name):
-                st.write(f"#### {prompt['name']}")
-                st.write(prompt['description'])
-                st.write(f"#### System Prompt")
-                st.write(prompt['system'])
-                st.write(f"#### Prompt")
-                st.write(prompt['prompt'])
+    st.session_state.image = bytes_data
 
-            st.write_stream(stream_data)
-            st.write("<hr style='margin: 0;'>", unsafe_allow_html=True)
-            if st.session_state.done is not None:
-                st.write(f"<p style='color: #999; font-size: .9em; text-align: right;'>Done in {st.session_state.done['total_duration'] / 10**9:.2f}s - Tokens: {st.session_state.done['eval_count']} - Speed {st.session_state.done['eval_count'] / st.session_state.done['eval_duration'] * 10**9:.2f} tokens/s - Seed {st.session_state.last_seed} - Temperature {round(st.session_state.temperature, 2)}</p>", unsafe_allow_html=True)
+    scheduler, cache = settings.scheduler, settings.cache
+    pipeline = settings.pipeline(bytes_data)
+    digests = settings.digests(models_run)
+    sampler = settings.sampler()
+    if sampler is not None:
+        sampler.start()
 
-    free_memory(model=st.session_state.active_model)
+    try:
+        placeholder_stats = st.empty()
+
+        if st.session_state.layout != "List":
+            st.session_state.response = new_response(models_run, prompt_names)
+            st.session_state.active_model = models_run[-1]
+
+            columns = st.columns(len(models_run))
+            for column, model in zip(columns, models_run):
+                column.write(f"### {model}")
+            cells, footers = {}, {}
+            for j, prompt in enumerate(selected):
+                display_prompt(prompt)
+                columns = st.columns(len(models_run))
+                for i, column in enumerate(columns):
+                    with column:
+                        cells[i, j] = st.empty()
+                        footers[i, j] = st.empty()
+
+            buffer = ChunkBuffer()
+            cancel = threading.Event()
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(run_cells, st.session_state.response, models_run, selected, pipeline, options,
+                                     settings=settings, on_chunk=buffer.append, cancel=cancel)
+            try:
+                # The generations run in the background, the grid is redrawn once per interval.
+                while not future.done():
+                    wait([future], timeout=st.session_state.flush_interval / 1000)
+                    for cell, text in buffer.drain().items():
+                        cells[cell].markdown(text)
+                for cell, text in buffer.drain().items():
+                    cells[cell].markdown(text)
+                future.result()
+            finally:
+                # A stop or a rerun raises in the loop above: the generations stop at their next chunk.
+                cancel.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+
+            for i, model_object in enumerate(st.session_state.response["models"]):
+                for j, slot in enumerate(model_object["prompts"]):
+                    with footers[i, j].container():
+                        display_done(slot)
+        elif st.session_state.concurrency > 1:
+            st.session_state.response = new_response(models_run, prompt_names)
+            st.session_state.active_model = models_run[-1]
+
+            with st.spinner(f"Running {len(models_run) * len(selected)} generation(s)..."):
+                run_cells(st.session_state.response, models_run, selected, pipeline, options, settings=settings)
+
+            for model, model_object in zip(models_run, st.session_state.response["models"]):
+                st.write(f"### {model}")
+                for prompt, slot in zip(selected, model_object["prompts"]):
+                    display_prompt(prompt)
+                    if slot["response"] is not None:
+                        st.write(slot["response"])
+                    display_done(slot)
+        else:
+            order = scheduler.order(models_run)
+            # The journaled and cached cells are loaded first, so only the models left to generate are prefetched.
+            slots, keys, todos = {}, {}, {}
+            for model in order:
+                digest = model_digest(digests, model)
+                sha256 = pipeline.for_model(model).sha256
+                slots[model] = [new_slot(prompt['name']) for prompt in selected]
+                todos[model] = []
+                for n, (prompt, slot) in enumerate(zip(selected, slots[model])):
+                    previous = selected[:n] if settings.mode == "session" else None
+                    keys[model, n] = prompt_key(digest, prompt, sha256, options, previous) if digest is not None else None
+                    if not (load_journaled(journaled, model, prompt['name'], slot) or
+                            (keys[model, n] is not None and load_cached(cache, keys[model, n], slot))):
+                        todos[model].append(n)
+            lane = [model for model in order if todos[model]]
+
+            for model in order:
+                st.session_state.active_model = model
+                st.write(f"### {model}")
+                acquired = False
+
+                try:
+                    st.session_state.response["models"].append({**new_model(model), "prompts": slots[model]})
+                    messages = []
+
+                    for n, (prompt, slot) in enumerate(zip(selected, slots[model])):
+
+                        st.session_state.system = prompt['system']
+                        st.session_state.prompt = prompt['prompt']
+
+                        display_prompt(prompt)
+
+                        prepared = pipeline.for_model(model)
+                        key = keys[model, n]
+                        if n not in todos[model]:
+                            st.write(slot["response"])
+                            if settings.mode == "session":
+                                messages.extend([session_turn(prompt, prepared.data, messages), {"role": "assistant", "content": slot["response"]}])
+                        else:
+                            if not acquired:
+                                scheduler.acquire(model)
+                                acquired = True
+                                index = lane.index(model)
+                                if st.session_state.prefetch and index + 1 < len(lane):
+                                    scheduler.prefetch(lane[index + 1])
+                            host, client = settings.route(model)
+                            if host is not None:
+                                slot["host"] = host
+                            if settings.mode == "session":
+                                st.write_stream(stream_turn(slot, model, prompt, prepared.data, options, messages, client=client))
+                            else:
+                                st.write_stream(stream_prompt(slot, model, prompt, prepared.data, options, client=client))
+                            if key is not None:
+                                store_cached(cache, key, slot)
+                            journal.add(model, prompt['name'], slot)
+                        display_done(slot)
+                finally:
+                    if acquired:
+                        scheduler.release(model)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        scheduler.finish(keep_loaded=st.session_state.keep_loaded)
+    if sampler is not None:
+        st.session_state.response["telemetry"] = sampler.series()
+    for model_object in st.session_state.response["models"]:
+        model_object["digest"] = model_digest(digests, model_object["name"])
+    st.session_state.response["options"] = options
+    st.session_state.response["mode"] = settings.mode
+    st.session_state.response["scheduler"] = scheduler.drain()
+    st.session_state.response["preprocess"] = pipeline.report()
 
     st.write("<hr style='margin: 0;'>", unsafe_allow_html=True)
+    prefetch = st.session_state.response["scheduler"]["prefetch"]
+    if prefetch["models"]:
+        st.caption(f"Prefetched {len(prefetch['models'])} model(s): {prefetch['hidden'] / 10**9:.2f}s of {prefetch['load_duration'] / 10**9:.2f}s load time hidden")
+    if st.session_state.response["scheduler"].get("unreachable"):
+        st.caption(f":warning: Server(s) not reached, left out of the run: {', '.join(st.session_state.response['scheduler']['unreachable'])}")
 
-    st.session_state.response["date"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    st.session_state.response["image_name"] = image.name
-    st.session_state.response["image_data"] = base64.b64encode(bytes_data).decode("utf-8")
+    finalize(st.session_state.response, image_name, bytes_data, embed=False)
+    get_history().add(st.session_state.response)
+    journal.remove()
 
-    col1, _ = st.columns([1,1], vertical_alignment="bottom")
-    with col1:
-        download_json()
+    download_export()
     
     with placeholder_stats.container():
-        display_chart(data=st.session_state.response)
\ No newline at end of file
+        display_chart(long_frame([st.session_state.response]), st.session_state.response.get("telemetry"))
\ No newline at end of file
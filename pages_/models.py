@@ -1,10 +1,9 @@
-import datetime
-import time
 import ollama
 import streamlit as st
 
-from modules.utils import get_available_models, get_models, get_sizes, get_modified_at
-from variables import MODELS_AVAILABLE_PATH, PROMPT_DEFAULT_PATH, PROMPT_USER_PATH
+from modules.pulls import format_eta
+from modules.utils import get_available_models, get_pull_manager, get_registry
+from variables import MODELS_AVAILABLE_PATH
 
 css = """
 <style>
@@ -19,69 +18,75 @@ st.html(css)
 st.write("## :material/network_node: Models")
 
 def read_file(file_path: str) -> str:
-    with open(file_path, "r") as f:
-        return f.read()
+    try:
+        with open(file_path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
     
 def save_models(file_path: str) -> None:
     with open(file_path, "w") as f:
         f.write(st.session_state.list_models.strip())
-    st.cache_data.clear()
+    get_available_models.clear()
+    get_registry().refresh()
     st.session_state.edit_models = False
 
 
 def delete_model(model_name: str) -> None:
     ollama.delete(model=model_name)
-    st.cache_data.clear()
-
-def reload_model(model_name: str, placeholder) -> None:
-    st.session_state.pull_model_name = model_name
-    pull_model(reload=False, placeholder=placeholder)
-
-def pull_model(placeholder, reload: bool = True) -> None:
-    try:
-        stream = ollama.pull(model=st.session_state.pull_model_name, stream=True)
-        sections = []
-        progress = {}
-
-        with placeholder.container():
-            for chunk in stream:
-                print(chunk)
-                if chunk.status not in sections:
-                    sections.append(chunk.status)
-                        
-                    col1, col2 = st.columns([1, 5], vertical_alignment="bottom")
-                    if chunk.status != "success":
-                        with col1:
-                            st.write(chunk['status'])
-                    else:
-                        st.success(f"Model {st.session_state.pull_model_name} successfully pulled")
-
-                if 'completed' in chunk:
-                    if chunk.status not in progress:
-                        with col2:
-                            progress[chunk.status] = st.progress(chunk['completed']*100//chunk['total'], text=f"{chunk['completed']/1e9:.3f} / {chunk['total']/1e9:.2f} GB")
-                    else:
-                        progress[chunk.status].progress(chunk['completed']*100//chunk['total'], text=f"{chunk['completed']/1e9:.3f} / {chunk['total']/1e9:.2f} GB")
-            
-
-
-        st.cache_data.clear()
-        st.session_state.clear()
-        st.toast("Model successfully pulled")
-        if reload:
-            time.sleep(2)
-            st.rerun()
-        else:
-            st.session_state.pull_model_name = ""
-
-    except ollama.ResponseError as e:
-        placeholder.error(e)
-        time.sleep(2)
-        placeholder.empty()
+    get_registry().refresh_model(model_name)
+
+def pull_models(models: list[str]) -> None:
+    for model in models:
+        get_pull_manager().submit(model)
+
+def pull_model() -> None:
+    pull_models(st.session_state.pull_model_name.replace(",", " ").split())
+    st.session_state.pull_model_name = ""
+
+def format_pull(job: dict) -> str:
+    if job['status'] == "queued":
+        return "Queued"
+    if job['status'] == "done":
+        return f"Pulled - {job['total'] / 1e9:.2f} GB"
+    if not job['total']:
+        return job['step'] or "Starting"
+    return f"{job['completed'] / 1e9:.2f} / {job['total'] / 1e9:.2f} GB - {job['speed'] / 1e6:.1f} MB/s - ETA {format_eta(job['eta'])}"
+
+def display_pulls() -> None:
+    manager = get_pull_manager()
+
+    @st.fragment(run_every=1.0 if manager.active() else None)
+    def pulls() -> None:
+        jobs = manager.jobs()
+        if not jobs:
+            return
+        col1, col2 = st.columns([7, 1], vertical_alignment="center")
+        with col1:
+            st.write("#### Pull queue")
+        with col2:
+            st.button("Clear", key="clear_pulls", on_click=manager.clear, type="tertiary", use_container_width=True, help="Remove the finished pulls")
+        for job in jobs:
+            col1, col2 = st.columns([1, 5], vertical_alignment="bottom")
+            with col1:
+                st.write(job['model'])
+            with col2:
+                if job['status'] == "error":
+                    st.error(job['error'])
+                else:
+                    st.progress(job['completed'] / job['total'] if job['total'] else 0.0, text=format_pull(job))
+
+        # Display the pulled models once the queue is empty.
+        if st.session_state.get("pulls_active") and not manager.active():
+            st.session_state.pulls_active = False
+            st.rerun(scope="app")
+        st.session_state.pulls_active = manager.active()
+
+    pulls()
 
 col1, col2 = st.columns([7, 1], vertical_alignment="center")
 with col1:
-    st.write("### List of models with vision support")
+    st.write("### Vision support overrides")
 with col2:
     edit = st.toggle("Edit", key="edit_models")
 
@@ -90,22 +95,23 @@ if edit:
         list_models = st.text_area("Models", value=read_file(MODELS_AVAILABLE_PATH), height=200, key="list_models")
         st.form_submit_button("Save", on_click=save_models, args=(MODELS_AVAILABLE_PATH,), type="primary")
 else:
+    st.write("Vision support is detected from the model metadata. The models listed here are always considered as vision models.")
     content = get_available_models(MODELS_AVAILABLE_PATH)
     st.write(", ".join(content), unsafe_allow_html=True)
 
 st.write("### Models available")
-models = get_models()
-sizes = get_sizes()
-modified_at = get_modified_at()
+registry_models = get_registry().models()
 
-col1, col2 = st.columns([5, 1], vertical_alignment="bottom")
+col1, col2, col3 = st.columns([4, 1, 1], vertical_alignment="bottom")
 with col1:
-    pull1 = st.text_input("Pull model", key="pull_model_name", placeholder="Enter model name")
+    pull1 = st.text_input("Pull model", key="pull_model_name", placeholder="Enter model name(s)", help="Several models can be separated by spaces or commas, they are downloaded in the background")
 with col2:
     disabled = pull1 == ""
-    pull2 = st.button("Pull model", key="pull_model_button", disabled=disabled, type="primary", use_container_width=True)
+    st.button("Pull model", key="pull_model_button", on_click=pull_model, disabled=disabled, type="primary", use_container_width=True)
+with col3:
+    st.button("Update all", key="update_models", on_click=pull_models, args=([entry['model'] for entry in registry_models],), disabled=len(registry_models) == 0, type="secondary", use_container_width=True, help="Pull every model of the list again")
 
-placeholder = st.empty()
+display_pulls()
 
 col1, col2, col3, col4, col5 = st.columns([4, 2, 2, 1, 1], vertical_alignment="center")
 with col1:
@@ -122,7 +128,8 @@ with col5:
 st.write("<hr style='margin: 0; border-width: 1px; border-bottom-color: #1c83e1;'>", unsafe_allow_html=True)
 
 
-for size, model, modified in zip(sizes, models, modified_at):
+for entry in registry_models:
+    model, size, modified = entry['model'], entry['size'], entry['modified_at']
     col1, col2, col3, col4, col5 = st.columns([4, 2, 2, 1, 1], vertical_alignment="center")
     with col1:
         st.write(model)
@@ -131,10 +138,8 @@ for size, model, modified in zip(sizes, models, modified_at):
     with col3:
         st.write(modified.strftime("%Y-%m-%d %H:%M:%S"))
     with col4:
-        st.button(":material/sync:", key=f"reload_{model}", on_click=reload_model, args=(model, placeholder), type="tertiary", use_container_width=True)
+        st.button(":material/sync:", key=f"reload_{model}", on_click=pull_models, args=([model],), type="tertiary", use_container_width=True)
     with col5:
         st.button(":red[:material/delete:]", key=f"del_{model}", on_click=delete_model, args=(model,), type="tertiary", use_container_width=True)
     st.write("<hr style='margin: 0;'>", unsafe_allow_html=True)
 
-if pull2:
-    pull_model(placeholder)
@@ -1,9 +1,10 @@
-import json
+import datetime
 import time
 import streamlit as st
 
-from modules.utils import get_available_models, get_models, load_prompt
-from variables import MODELS_AVAILABLE_PATH, PROMPT_DEFAULT_PATH, PROMPT_USER_PATH
+from modules.utils import get_prompt_store
+
+MAX_VERSIONS = 20
 
 css = """
 <style>
@@ -17,59 +18,42 @@ st.html(css)
 
 st.write("## :material/article: Prompts")
 
-def reset_prompts(prompt_path: str, default_path: str) -> None:
-    with open(prompt_path, "w") as f:
-        f.write(json.dumps(load_prompt(default_path)))
-    
-    st.cache_data.clear()
+def reset_prompts() -> None:
+    get_prompt_store().reset()
     st.session_state.tab = "Prompts"
 
 def add_prompt() -> None:
-    if len(st.session_state.prompt_name.strip()) == 0:
-        st.toast(f":red[_**Name**_ cannot be empty]", icon=":material/warning:")
-        return
-    prompts = load_prompt(PROMPT_USER_PATH)
-    prompts = [prompt for prompt in prompts if prompt['name'] != st.session_state.prompt_name]
-    prompts.append({
-        "name": st.session_state.prompt_name,
-        "description": st.session_state.prompt_description,
-        "system": st.session_state.prompt_system,
-        "prompt": st.session_state.prompt_prompt
-    })
-    with open(PROMPT_USER_PATH, "w") as f:
-        f.write(json.dumps(prompts))
-
-    st.cache_data.clear()
-
-def edit_prompt(index: int, prompt_name: str, prompt_description: str, prompt_system: str, prompt_prompt: str) -> None:
-    if len(prompt_name.strip()) == 0:
-        st.toast(f"_**Name**_ cannot be empty", icon=":material/warning:")
-        return
-    prompts = load_prompt(PROMPT_USER_PATH)
-    if prompt_name in [prompt['name'] for prompt in prompts if prompt_name.lower() != prompts[index]['name'].lower()]:
-        st.toast(f"Prompt with name {prompt_name} already exists", icon=":material/warning:")
-        return
-    prompts[index] = {
-        "name": prompt_name,
-        "description": prompt_description,
-        "system": prompt_system,
-        "prompt": prompt_prompt
-    }
-
-    with open(PROMPT_USER_PATH, "w") as f:
-        f.write(json.dumps(prompts))
-
-    st.cache_data.clear()
+    try:
+        get_prompt_store().put({
+            "name": st.session_state.prompt_name,
+            "description": st.session_state.prompt_description,
+            "system": st.session_state.prompt_system,
+            "prompt": st.session_state.prompt_prompt
+        })
+    except ValueError as e:
+        st.toast(f":red[{e}]", icon=":material/warning:")
+
+def edit_prompt(previous_name: str, prompt_name: str, prompt_description: str, prompt_system: str, prompt_prompt: str) -> bool:
+    try:
+        get_prompt_store().put({
+            "name": prompt_name,
+            "description": prompt_description,
+            "system": prompt_system,
+            "prompt": prompt_prompt
+        }, previous=previous_name)
+    except ValueError as e:
+        st.toast(str(e), icon=":material/warning:")
+        return False
+
     st.toast("Prompt saved", icon=":material/check:")
+    return True
 
 def delete_prompt(prompt_name: str) -> None:
-    print(prompt_name)
-    prompts = load_prompt(PROMPT_USER_PATH)
-    prompts = [prompt for prompt in prompts if prompt['name'] != prompt_name]
-    with open(PROMPT_USER_PATH, "w") as f:
-        f.write(json.dumps(prompts))
+    get_prompt_store().delete(prompt_name)
 
-    st.cache_data.clear()
+def restore_prompt(prompt_name: str, version: dict) -> None:
+    get_prompt_store().put(version, previous=prompt_name)
+    st.toast("Prompt restored", icon=":material/check:")
 
 
 _, col2, col3 = st.columns([15, 1, 1], vertical_alignment="center")
@@ -80,7 +64,6 @@ with col2:
         ":material/sync:", 
         key="reset_prompt", 
         on_click=reset_prompts, 
-        args=(PROMPT_USER_PATH, PROMPT_DEFAULT_PATH), 
         type="secondary", 
         use_container_width=True,
         help="Reset prompts to default.  \n:red[:material/warning: _this will delete all your custom prompts_]"
@@ -93,7 +76,7 @@ with col3:
         use_container_width=True,
         help="Add a new prompt"
     )
-prompts = load_prompt(PROMPT_USER_PATH)
+prompts = get_prompt_store().all()
 
 placeholder = st.empty()
 
@@ -127,9 +110,12 @@ for prompt in prompts:
     if f"edit_{prompt['name']}" not in st.session_state:
         st.session_state[f"edit_{prompt['name']}"] = False
 
+versions = get_prompt_store().history()
+
 for index, prompt in enumerate(prompts):
+    name = prompt['name']
     with st.expander(label=f"_**{prompt['name']}**_"):
-        col1, col2, col3 = st.columns([20, 1, 1], vertical_alignment="center")
+        col1, col2, col3, col4 = st.columns([19, 1, 1, 1], vertical_alignment="center")
         with col1:
             st.write(f"### {prompt['name']}")
         with col2:
@@ -147,6 +133,16 @@ for index, prompt in enumerate(prompts):
                 st.rerun()
 
         with col3:
+            with st.popover(":material/history:", help="Versions", use_container_width=True):
+                for number, version in enumerate(versions.get(prompt['name'], [])[:MAX_VERSIONS]):
+                    date = datetime.datetime.fromisoformat(version['date']).strftime('%Y-%m-%d %H:%M:%S')
+                    st.write(f"**{date}**")
+                    st.caption(version['prompt']['prompt'][:200])
+                    st.button("Restore", key=f"restore_{index}_{number}", on_click=restore_prompt, args=(prompt['name'], version['prompt']), type="tertiary", disabled=version['prompt'] == prompt)
+                if prompt['name'] not in versions:
+                    st.write("No saved version")
+
+        with col4:
             prompt_delete = st.button(":red[:material/delete:]", key=f"del_{prompt['name']}", on_click=delete_prompt, args=(prompt['name'],), type="tertiary", use_container_width=True, help="Delete prompt")
         
         if prompt_delete:
@@ -162,9 +158,9 @@ for index, prompt in enumerate(prompts):
                 saved = st.form_submit_button("Save", type="primary")
                 
                 if saved:
-                    edit_prompt(index, prompt_name, prompt_description, prompt_system, prompt_prompt)
-                    time.sleep(2)
-                    st.session_state[f"edit_{prompt['name']}"] = False
+                    if edit_prompt(name, prompt_name, prompt_description, prompt_system, prompt_prompt):
+                        time.sleep(2)
+                        st.session_state[f"edit_{name}"] = False
                     st.rerun()
 
         else:
@@ -1,111 +1,273 @@
-import base64
 import datetime
-from io import BytesIO
-import json
+import math
+import os
+import zipfile
 import pandas as pd
 import streamlit as st
 
-from modules.utils import load_duration, total_duration
+from modules.archive import ArchiveReader, JsonReader, entry_summary, open_results
+from modules.preprocess import thumbnail
+from modules.similarity import METHODS, get_similarity, heatmap
+from modules.stats import long_frame, melt_results, pivot_metric, results_frame
+from modules.utils import display_telemetry
+
+EXTENSIONS = (".json", ".jsonl", ".zip")
+PAGE_SIZES = [25, 50, 100, 250]
+COMPARE_METRICS = {
+    "tokens_per_second": "Speed (tokens/s)",
+    "total_duration": "Total Duration (s)",
+    "load_duration": "Load Duration (s)",
+    "prompt_eval_duration": "Prompt Eval Duration (s)",
+    "eval_duration": "Eval Duration (s)",
+    "ttft": "Time To First Token (s)",
+    "itl_p90": "Inter-Token Latency p90 (s)",
+}
+COLUMNS = {
+    "file": "File",
+    "date": "Date",
+    "image_name": "Image",
+    "mode": "Mode",
+    "model": "Model",
+    "prompt": "Prompt",
+    "host": "Host",
+    "total_duration": st.column_config.NumberColumn("Total Duration", format="%.2f s"),
+    "load_duration": st.column_config.NumberColumn("Load Duration", format="%.2f s"),
+    "prompt_eval_count": st.column_config.NumberColumn("Prompt Eval Count"),
+    "prompt_eval_duration": st.column_config.NumberColumn("Prompt Eval Duration", format="%.2f s"),
+    "eval_count": st.column_config.NumberColumn("Eval Count"),
+    "eval_duration": st.column_config.NumberColumn("Eval Duration", format="%.2f s"),
+    "tokens_per_second": st.column_config.NumberColumn("Speed", format="%.2f tokens/s"),
+    "ttft": st.column_config.NumberColumn("TTFT", format="%.3f s"),
+    "itl_p50": st.column_config.NumberColumn("ITL p50", format="%.3f s"),
+    "itl_p90": st.column_config.NumberColumn("ITL p90", format="%.3f s"),
+    "max_stall": st.column_config.NumberColumn("Max Stall", format="%.3f s"),
+    "client_overhead": st.column_config.NumberColumn("Client Overhead", format="%.3f s"),
+    "cached": st.column_config.CheckboxColumn("Cached"),
+    "error": "Error",
+}
 
 def display_chart(data: dict):
+    long = long_frame([data])
     col1, col2 = st.columns(2)
     with col1:
-        duration = load_duration(data=data)
+        keys_, duration = pivot_metric(long, "load_duration", index="model", columns="metric", agg="sum")
         st.bar_chart(
-            duration,   
-            x="models",
+            duration,
+            x="model",
+            y=keys_,
             x_label="Model(s) Load Duration",
             y_label="Time (s)",
             horizontal=False
         )
     with col2:
-        keys_, total = total_duration(data=data)
-        print(keys_, total)
+        keys_, total = pivot_metric(long, "eval_duration")
         st.bar_chart(
             total,
-            x="col1",
+            x="prompt",
             x_label="Prompt(s) Eval Duration",
             y=keys_,
             y_label="Time (s)",
             horizontal=False,
             stack=False,
-            
-        )        
+        )
+    col1, col2 = st.columns(2)
+    with col1:
+        keys_, ttft = pivot_metric(long, "ttft")
+        st.bar_chart(
+            ttft,
+            x="prompt",
+            x_label="Prompt(s) Time To First Token",
+            y=keys_,
+            y_label="Time (s)",
+            horizontal=False,
+            stack=False,
+        )
+    with col2:
+        keys_, itl = pivot_metric(long, "itl_p90")
+        st.bar_chart(
+            itl,
+            x="prompt",
+            x_label="Prompt(s) Inter-Token Latency (p90)",
+            y=keys_,
+            y_label="Time (s)",
+            horizontal=False,
+            stack=False,
+        )
+    display_telemetry(data.get("telemetry"))
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def get_thumbnail(sha256: str, _reader: ArchiveReader | JsonReader) -> bytes | None:
+    """Preview of an image, the full image is only read the first time."""
+    image = _reader.image(sha256)
+    return thumbnail(image) if image is not None else None
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def open_file(file_key: str, _file) -> ArchiveReader | JsonReader:
+    """Reader of a file: only its index is read, records and images are read when selected."""
+    return open_results(_file)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_frame(file_key: str, _reader: ArchiveReader | JsonReader) -> pd.DataFrame:
+    return results_frame([entry_summary(entry) for entry in _reader.index()])
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_responses(file_key: str, _reader: ArchiveReader | JsonReader) -> pd.DataFrame:
+    return results_frame(_reader.records(), responses=True)[["image_sha256", "prompt", "model", "response", "cached"]]
+
+def list_directory(directory: str) -> list[str]:
+    paths = []
+    for root, _, names in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in names if name.lower().endswith(EXTENSIONS))
+    return sorted(paths)
+
+def format_date(date: str) -> str:
+    return datetime.datetime.fromisoformat(date).strftime('%Y-%m-%d %H:%M:%S')
 
 if "data" not in st.session_state:
     st.session_state.data = None
 
 with st.sidebar:
-    if archive:= st.file_uploader("Upload a JSON file", type=["json"]):
-        st.session_state.data = json.loads(archive.read())
-        image = st.session_state.data.get('image_data') 
-        st.image(BytesIO(base64.b64decode(image)))
-    else:
-        st.session_state.data = None
+    uploads = st.file_uploader("Upload JSON files or archives", type=["json", "jsonl", "zip"], accept_multiple_files=True)
+    directory = st.text_input("Directory", key="viewer_directory", help="Directory on the server, every JSON, JSONL and archive file in it is loaded")
+
+    sources = [(upload.name, upload.file_id, upload) for upload in uploads or []]
+    if directory:
+        if os.path.isdir(directory):
+            sources += [
+                (os.path.relpath(path, directory), f"{path}:{os.path.getmtime(path)}", path)
+                for path in list_directory(directory)
+            ]
+        else:
+            st.error(f"Directory not found: {directory}")
+    placeholder_image = st.empty()
 
     st.write("---")
 
 st.write("## :material/visibility: Viewer")
 
-if st.session_state.data is None:
-    st.write("Please upload a JSON file")
-else:
-    json_name = archive.name
-    date = datetime.datetime.fromisoformat(st.session_state.data['date']).strftime('%Y-%m-%d %H:%M:%S')
-    image_name = st.session_state.data['image_name']
-    st.write("---")
-    st.write(f"JSON Name: _{json_name}_  \nDate: _{date}_  \nImage Name: _{image_name}_")
-    st.write("---")
+if len(sources) == 0:
+    st.session_state.data = None
+    st.write("Please upload JSON files or archives, or enter a directory")
+    st.stop()
+
+readers = {}
+progress = st.progress(0.0) if len(sources) > 1 else None
+for n, (name, file_key, source) in enumerate(sources):
+    if name in readers:
+        name = f"{name} ({n})"
+    try:
+        readers[name] = (file_key, open_file(file_key, source))
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        st.warning(f"{name} skipped: {e}")
+    if progress is not None:
+        progress.progress((n + 1) / len(sources), text=f"{n + 1}/{len(sources)} file(s) read")
+if progress is not None:
+    progress.empty()
+
+if len(readers) == 0:
+    st.session_state.data = None
+    st.stop()
+frame = pd.concat([get_frame(file_key, reader).assign(file=name) for name, (file_key, reader) in readers.items()], ignore_index=True)
+if len(frame) == 0:
+    st.session_state.data = None
+    st.write("No result in these files")
+    st.stop()
+frame["date"] = pd.to_datetime(frame["date"], format="ISO8601").dt.strftime('%Y-%m-%d %H:%M:%S')
+
+st.write("---")
+st.write(f"{len(readers)} file(s) - {sum(len(reader.index()) for _, reader in readers.values())} run(s) - {len(frame)} result(s)")
+
+if len(readers) > 1:
+    st.write("#### Comparison")
+    metric = st.selectbox("Metric", options=list(COMPARE_METRICS), format_func=COMPARE_METRICS.get, key="viewer_metric")
+    keys_, table = pivot_metric(melt_results(frame), metric, index="file", columns="model")
+    st.bar_chart(
+        table,
+        x="file",
+        x_label="File(s)",
+        y=keys_,
+        y_label=COMPARE_METRICS[metric],
+        horizontal=False,
+        stack=False,
+    )
+
+st.write("#### Results")
+col1, col2 = st.columns([1, 1], vertical_alignment="top")
+with col1:
+    models_selected = st.multiselect("Model(s)", options=sorted(frame["model"].unique()), placeholder="All models", key="viewer_models")
+with col2:
+    prompts_selected = st.multiselect("Prompt(s)", options=sorted(frame["prompt"].unique()), placeholder="All prompts", key="viewer_prompts")
+filtered = frame
+if models_selected:
+    filtered = filtered[filtered["model"].isin(models_selected)]
+if prompts_selected:
+    filtered = filtered[filtered["prompt"].isin(prompts_selected)]
+
+col1, col2, col3 = st.columns([1, 1, 2], vertical_alignment="bottom")
+with col1:
+    page_size = st.selectbox("Rows per page", options=PAGE_SIZES, key="viewer_page_size")
+with col2:
+    pages = max(1, math.ceil(len(filtered) / page_size))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+with col3:
+    st.write(f"{len(filtered)} result(s)")
+st.dataframe(
+    filtered.iloc[(page - 1) * page_size:page * page_size][list(COLUMNS)],
+    column_config=COLUMNS,
+    hide_index=True,
+    use_container_width=True
+)
+
+st.write("#### Agreement")
+if st.toggle("Compare the responses", value=False, key="viewer_agreement", help="Reads every response of the files"):
+    method = st.segmented_control("Similarity", options=list(METHODS), default="tfidf", format_func=METHODS.get, key="viewer_similarity", help="Similarity of the responses of each pair of models to the same image and prompt, averaged over the images of every file  \nThe diagonal compares the runs of a model on the same image")
+
+    def responses():
+        frame = pd.concat([get_responses(file_key, reader) for file_key, reader in readers.values()], ignore_index=True)
+        if models_selected:
+            frame = frame[frame["model"].isin(models_selected)]
+        if prompts_selected:
+            frame = frame[frame["prompt"].isin(prompts_selected)]
+        return frame
+
+    key = ("viewer", tuple(file_key for file_key, _ in readers.values()), tuple(models_selected), tuple(prompts_selected))
+    matrix = get_similarity(key, method or "tfidf", responses)
+    if len(matrix) == 0:
+        st.write("At least two responses to the same image and prompt are needed")
+    else:
+        st.altair_chart(heatmap(matrix), use_container_width=True)
+
+st.write("---")
+entries = [(name, position) for name, (_, reader) in readers.items() for position in range(len(reader.index()))]
+entry = st.selectbox(
+    "Result",
+    entries,
+    format_func=lambda entry: f"{entry[0]} - {format_date(readers[entry[0]][1].index()[entry[1]]['date'])} - {readers[entry[0]][1].index()[entry[1]].get('image_name')}",
+    key="viewer_result"
+)
+reader = readers[entry[0]][1]
+st.session_state.data = reader.record(reader.index()[entry[1]]['id'])
+
+sha256 = st.session_state.data.get('image_sha256')
+preview = get_thumbnail(sha256, reader) if sha256 is not None else None
+if preview is not None:
+    placeholder_image.image(preview)
+
+date = format_date(st.session_state.data['date'])
+image_name = st.session_state.data['image_name']
+st.write(f"JSON Name: _{entry[0]}_  \nDate: _{date}_  \nImage Name: _{image_name}_")
+st.write("---")
+
+display_chart(data=st.session_state.data)
+
+for model in st.session_state.data['models']:
+    with st.expander(model['name']):
+        st.write(f"### Model: {model['name']}")
+        for prompt in model['prompts']:
+            st.write(f"#### Prompt: {prompt['prompt']}")
+
+            if 'error' in prompt and prompt['error'] is not None:
+                st.error(prompt['error'])
+                continue
 
-    display_chart(data=st.session_state.data)
-
-    for model in st.session_state.data['models']:
-        with st .expander(model['name']):
-            st.write(f"### Model: {model['name']}")
-            for prompt in model['prompts']:
-                st.write(f"#### Prompt: {prompt['prompt']}")
-
-                if 'error' in prompt and prompt['error'] is not None:
-                    st.error(prompt['error'])
-                    continue
-
-                st.write(prompt['response'])
-
-                done = [
-                    prompt['done']['total_duration'] / 10**9,
-                    prompt['done']['load_duration'] / 10**9,
-                    prompt['done']['prompt_eval_count'],
-                    prompt['done']['prompt_eval_duration'] / 10**9,
-                    prompt['done']['eval_count'],
-                    prompt['done']['eval_duration'] / 10**9
-                ]
-
-                df = pd.DataFrame([done], columns= ["total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration"])
-                st.dataframe(
-                df, 
-                column_config={
-                    "total_duration": st.column_config.NumberColumn(
-                        "Total Duration",
-                        format="%.2f s"
-                    ),
-                    "load_duration": st.column_config.NumberColumn(
-                        "Load Duration",
-                        format="%.2f s"
-                    ),
-                    "prompt_eval_count": st.column_config.NumberColumn(
-                        "Prompt Eval Count"
-                    ),
-                    "prompt_eval_duration": st.column_config.NumberColumn(
-                        "Prompt Eval Duration",
-                        format="%.2f s"
-                    ),
-                    "eval_count": st.column_config.NumberColumn(
-                        "Eval Count"
-                    ),
-                    "eval_duration": st.column_config.NumberColumn(
-                        "Eval Duration",
-                        format="%.2f s"
-                    )
-                }, 
-                hide_index=True
-            )
+            st.write(prompt['response'])
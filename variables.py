@@ -4,4 +4,55 @@ VERSION = "0.2.1"
 
 MODELS_AVAILABLE_PATH = os.path.join(os.path.dirname(__file__), "models.txt")
 PROMPT_DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "prompts_default.json")
-PROMPT_USER_PATH = os.path.join(os.path.dirname(__file__), "prompts_user.json")
\ No newline at end of file
+PROMPT_USER_PATH = os.path.join(os.path.dirname(__file__), "prompts_user.json")
+
+# Memory budget for the models loaded by a run, 0 for no limit.
+MEMORY_BUDGET = int(float(os.environ.get("VC_MEMORY_BUDGET_GB", 0)) * 1e9)
+
+# Response cache of deterministic generations.
+CACHE_PATH = os.environ.get("VC_CACHE_PATH", os.path.join(os.path.dirname(__file__), ".cache", "responses"))
+CACHE_MAX_BYTES = int(float(os.environ.get("VC_CACHE_MAX_MB", 512)) * 1e6)
+
+# Seconds before the list of models is fetched again from Ollama.
+REGISTRY_TTL = float(os.environ.get("VC_REGISTRY_TTL", 60))
+
+# Longest side of the images sent to the models, 0 to keep the original size.
+IMAGE_MAX_SIDE = int(os.environ.get("VC_IMAGE_MAX_SIDE", 0))
+
+# Largest input resolution (longest side in pixels) handled by each model,
+# larger images are downscaled by the model anyway.
+MODEL_NATIVE_SIDES = {
+    "llava": 672,
+    "bakllava": 336,
+    "moondream": 378,
+    "minicpm-v": 1344,
+    "llama3.2-vision": 1120,
+    "granite3.2-vision": 768,
+    "gemma3": 896,
+}
+
+# Journals of the comparisons in progress, to resume them after a crash.
+JOURNAL_PATH = os.environ.get("VC_JOURNAL_PATH", os.path.join(os.path.dirname(__file__), ".cache", "journal"))
+
+# Run history database.
+HISTORY_PATH = os.environ.get("VC_HISTORY_PATH", os.path.join(os.path.dirname(__file__), "history.db"))
+
+# Milliseconds between two refreshes of the streamed responses in the comparison grid.
+STREAM_FLUSH_MS = int(os.environ.get("VC_STREAM_FLUSH_MS", 250))
+
+# Models downloaded at the same time by the pull queue of the Models page.
+PULL_CONCURRENCY = int(os.environ.get("VC_PULL_CONCURRENCY", 2))
+
+# Ollama hosts of a run spread over several servers, comma separated
+# (e.g. http://gpu1:11434,http://gpu2:11434), the default host if empty.
+OLLAMA_HOSTS = os.environ.get("VC_OLLAMA_HOSTS", "")
+
+# Directory of the archives written by the multiple images mode of the Comparator.
+BATCH_PATH = os.environ.get("VC_BATCH_PATH", os.path.join(os.path.dirname(__file__), "batches"))
+
+# Seconds between two samples of the memory of the loaded models and of the host during a run, 0 to disable.
+TELEMETRY_INTERVAL = float(os.environ.get("VC_TELEMETRY_INTERVAL", 1.0))
+
+# Port of the OpenMetrics exporter (http://<address>:<port>/metrics), 0 to disable it.
+METRICS_PORT = int(os.environ.get("VC_METRICS_PORT", 0))
+METRICS_ADDRESS = os.environ.get("VC_METRICS_ADDRESS", "127.0.0.1")